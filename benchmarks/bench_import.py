@@ -0,0 +1,81 @@
+"""
+    cold start cost of the database api: import time (python -X importtime) and resident memory of a
+    fresh interpreter after "import package.api". exits with status 1 when the import takes longer than
+    --budget-ms or pulls in one of the --forbidden modules, so it can guard the budget in CI
+
+    python benchmarks/bench_import.py --budget-ms 1500 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import write_results
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PROBE = """import resource, sys, json
+import {module}
+print(json.dumps({{'modules': sorted(sys.modules), 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))"""
+
+
+def import_once(module: str) -> dict:
+    """
+    imports <module> in a fresh interpreter, returns its -X importtime table and the loaded modules
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module)],
+                         capture_output=True, text=True, check=True, cwd=ROOT)
+    times = {}
+    for line in out.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = {'self_us': int(self_us), 'cumulative_us': int(cumulative_us)}
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    res['times'] = times
+    return res
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--module', default='package.api')
+    p.add_argument('--runs', type=int, default=5, help='fresh interpreters, the median is reported')
+    p.add_argument('--budget-ms', type=float, default=1500, help='fail when the median import time exceeds this')
+    p.add_argument('--forbidden', nargs='*', default=['matplotlib', 'seaborn', 'sklearn', 'tqdm'],
+                   help='top level modules the import must not load')
+    p.add_argument('--top', type=int, default=15, help='report the slowest modules by cumulative time')
+    p.add_argument('--output', default=None, help='write the results to this json file')
+    args = p.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.runs)]
+    totals = [r['times'][args.module]['cumulative_us'] / 1000 for r in runs]
+    last = runs[-1]
+    top_level = {name.split('.')[0] for name in last['modules']}
+    loaded = sorted(m for m in args.forbidden if m in top_level)
+    # direct children only, a package's cumulative time already includes its submodules
+    slowest = sorted(((name, t['cumulative_us'] / 1000) for name, t in last['times'].items() if '.' not in name),
+                     key=lambda x: -x[1])[:args.top]
+
+    results = {
+        'benchmark': 'import',
+        'module': args.module,
+        'runs': args.runs,
+        'import_ms': {'median': statistics.median(totals), 'min': min(totals), 'max': max(totals)},
+        'rss_mb': statistics.median(r['rss_mb'] for r in runs),
+        'modules_loaded': len(last['modules']),
+        'forbidden_loaded': loaded,
+        'slowest_ms': dict(slowest),
+        'budget_ms': args.budget_ms,
+    }
+    ok = len(loaded) == 0 and (args.budget_ms is None or results['import_ms']['median'] <= args.budget_ms)
+    results['ok'] = ok
+    write_results(results, args.output)
+    if not ok:
+        print(f"[ERROR] import of {args.module} is over budget or loads {loaded}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
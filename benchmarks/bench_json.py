@@ -0,0 +1,104 @@
+"""
+    throughput and peak memory of reading a simulation json log into columnar batches:
+        load_parse:    utils.load_json + utils.parse_json (whole document in memory), then one dataframe
+        stream_key:    utils.json_batches with key= (ijson events, the key at any level)
+        stream_prefix: utils.json_batches with prefix= (ijson items, the layout is known)
+        jsonl:         utils.json_batches on the same records written as json lines (no ijson)
+    the log is generated once (--records samples in a top level "samples" list) and every mode runs in
+    its own process so the peak resident set size of one does not hide the other
+
+    python benchmarks/bench_json.py --records 2000000 --output json.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import write_results
+import package.utils as utils
+
+MODES = ['load_parse', 'stream_key', 'stream_prefix', 'jsonl']
+COLUMNS = ['asset_id', 'dt', 'cycle', 'status', 'temperature', 'voltage']
+
+
+def write_logs(directory: str, records: int, block: int = 100000) -> dict:
+    """
+    writes <records> samples as one json document and as json lines (a line per block), a block at a time
+    """
+    paths = {'json': os.path.join(directory, 'log.json'), 'jsonl': os.path.join(directory, 'log.jsonl')}
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp('2021-01-01')
+    with open(paths['json'], 'w') as fj, open(paths['jsonl'], 'w') as fl:
+        fj.write('{"run": {"name": "synthetic", "dt": 0.25}, "samples": [')
+        for i in range(0, records, block):
+            n = min(block, records - i)
+            idx = np.arange(i, i + n)
+            df = pd.DataFrame({'asset_id': 1 + idx % 8, 'dt': (start + pd.to_timedelta(idx * 250, unit='ms')).astype(str),
+                               'cycle': idx // 4000, 'status': (idx % 3 > 0).astype(int),
+                               'temperature': rng.random(n), 'voltage': rng.random(n)})
+            rows = df.to_json(orient='records')
+            fj.write(('' if i == 0 else ',') + rows[1:-1])
+            fl.write('{"samples": ' + rows + '}\n')
+        fj.write(']}')
+    return paths
+
+
+def run(mode: str, directory: str, batch_size: int) -> dict:
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rows = 0
+    if mode == 'load_parse':
+        data = utils.load_json(directory, 'log', '.json')
+        records = [r for v in utils.parse_json(data, 'samples') for r in v]
+        rows = len(pd.DataFrame.from_records(records, columns=COLUMNS))
+    else:
+        path = os.path.join(directory, 'log.jsonl' if mode == 'jsonl' else 'log.json')
+        kwargs = {'prefix': 'samples.item'} if mode == 'stream_prefix' else {'key': 'samples'}
+        for df in utils.json_batches(path, columns=COLUMNS, batch_size=batch_size, **kwargs):
+            rows += len(df)
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else None,
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--records', type=int, default=1000000)
+    p.add_argument('--batch-size', type=int, default=100000, help='rows per columnar batch of the streaming modes')
+    p.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    p.add_argument('--dir', default=None, help='directory of the generated logs, a temporary one by default')
+    p.add_argument('--mode', default=None, choices=MODES, help=argparse.SUPPRESS)
+    p.add_argument('--output', default=None, help='write the results to this json file')
+    args = p.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run(args.mode, args.dir, args.batch_size)))
+        return
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        paths = write_logs(directory, args.records)
+        results = {'benchmark': 'json', 'records': args.records, 'batch_size': args.batch_size,
+                   'file_mb': {k: os.path.getsize(v) / 1024**2 for k, v in paths.items()}}
+        for mode in args.modes:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--dir', directory,
+                                  '--batch-size', str(args.batch_size)],
+                                 capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+    latency of repeated point lookups (_get_asset by serial number, _get_asset_type by name)
+    with literal f-string sql versus bound parameters on a named prepared statement
+
+    python benchmarks/bench_lookups.py --dbname <db> --repeat 2000
+"""
+import random
+import warnings
+
+from common import parser, params, timeit, write_results
+from package.api import DB
+
+warnings.filterwarnings('ignore', message='pandas only supports SQLAlchemy')
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--repeat', type=int, default=1000)
+    args = p.parse_args()
+
+    db, cur = DB.connect(params(args))
+    serials = DB.execute("select serial_number from asset_tb limit 1000;", db).serial_number.tolist()
+    types = DB.execute("select type, subtype from asset_type_tb limit 100;", db).values.tolist()
+    assert len(serials) > 0 and len(types) > 0, '[ERROR] the database needs at least one asset and asset type'
+
+    def literal_asset():
+        DB.execute(f"""select * from asset_tb where "serial_number" = '{random.choice(serials)}';""", db)
+
+    def prepared_asset():
+        DB._get_asset(serial_number=random.choice(serials), db=db)
+
+    def literal_type():
+        t, st = random.choice(types)
+        DB.execute(f"""select * from asset_type_tb where "type" ilike '%{t}%' and "subtype" ilike '%{st}%';""", db)
+
+    def prepared_type():
+        t, st = random.choice(types)
+        DB._get_asset_type(asset_type=t, subtype=st, db=db)
+
+    results = {
+        'benchmark': 'lookups',
+        'repeat': args.repeat,
+        'get_asset_literal': timeit(literal_asset, args.repeat),
+        'get_asset_prepared': timeit(prepared_asset, args.repeat),
+        'get_asset_type_literal': timeit(literal_type, args.repeat),
+        'get_asset_type_prepared': timeit(prepared_type, args.repeat),
+    }
+    for name in ['get_asset', 'get_asset_type']:
+        results[f'{name}_speedup'] = results[f'{name}_literal']['mean'] / results[f'{name}_prepared']['mean']
+    write_results(results, args.output)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
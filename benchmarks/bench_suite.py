@@ -0,0 +1,180 @@
+"""
+    end to end benchmark at several data sizes. for every scale a throwaway database is created on the
+    server, filled with synthetic data (benchmarks/synthetic.py) and dropped afterwards. timed:
+        ingest:  batch_insert, execute_batch, executemany, copy_insert text and binary (rows per second)
+        lookups: _get_asset by serial number
+        reads:   get_device_data, get_unit_stats (raw and from cycle_stats_vw), get_round_data
+
+    python benchmarks/bench_suite.py --dbname postgres --scales 100000 1000000 10000000 --output suite.json
+    python benchmarks/bench_suite.py --timescale ...    # data_tb and cb_data_tb as hypertables
+"""
+import contextlib
+import io
+import os
+import platform
+import random
+import subprocess
+import time
+import warnings
+
+import psycopg2
+import psycopg2.extras
+import pandas as pd
+
+from common import parser, params, timeit, write_results
+from package.api import DB
+import synthetic
+
+warnings.filterwarnings('ignore', message='pandas only supports SQLAlchemy')
+
+
+def quiet(fn):
+    """runs fn without the progress prints of the DB methods"""
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return call
+
+
+def throughput(fn, rows: int) -> dict:
+    start = time.perf_counter()
+    quiet(fn)()
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds > 0 else None}
+
+
+def bench_ingest(db, cur, layout: dict, rows: int) -> dict:
+    """
+    inserts the same <rows> rows of a fresh asset with every method, deleting them in between.
+    executemany runs on a tenth of the rows, it is a round trip per row
+    """
+    group_id = int(layout['groups'].id.values[0])
+    type_id = int(layout['devices'].type_id.values[0])
+    asset = DB.create_assets(pd.DataFrame({'type_id': [type_id], 'group_id': [group_id]}), db=db, cur=cur)
+    asset_id = int(asset.id.values[0])
+    df = synthetic.device_frame(asset_id, group_id, rows, seed=1)
+    # batch_insert renders the values with str(), so the timestamps are passed as text
+    df_text = df.assign(dt=df.dt.astype(str))
+    statement = f"""insert into data_tb ({', '.join(f'"{c}"' for c in df.columns)}) values ({', '.join(['%s'] * len(df.columns))});"""
+    values = df_text.values.tolist()
+
+    def execute_batch():
+        psycopg2.extras.execute_batch(cur, statement, values, page_size=1000)
+        db.commit()
+
+    def executemany():
+        cur.executemany(statement, values[:max(1, rows // 10)])
+        db.commit()
+
+    methods = {
+        'batch_insert': (lambda: DB.batch_insert(df_text, 'data_tb', num_batches=10, db=db, cur=cur), rows),
+        'execute_batch': (execute_batch, rows),
+        'executemany': (executemany, max(1, rows // 10)),
+        'copy_insert_text': (lambda: DB.copy_insert(df, 'data_tb', num_batches=10, db=db, cur=cur, fmt='text'), rows),
+        'copy_insert_binary': (lambda: DB.copy_insert(df, 'data_tb', num_batches=10, db=db, cur=cur, fmt='binary'), rows),
+    }
+    res = {}
+    for name, (fn, n) in methods.items():
+        res[name] = throughput(fn, n)
+        written = DB.execute("select count(*) from data_tb where asset_id = %s;", db, params=(asset_id,)).values[0][0]
+        res[name]['rows_written'] = int(written)
+        cur.execute("delete from data_tb where asset_id = %s;", (asset_id,))
+        db.commit()
+    return res
+
+
+def bench_reads(db, cur, layout: dict, repeat: int, lookups: int, timescale: bool) -> dict:
+    serials = layout['devices'].serial_number.tolist() + layout['blocks'].serial_number.tolist()
+    devices = layout['devices'].id.tolist()
+    groups = layout['groups'][layout['groups'].group != 'none'].id.tolist()
+    res = {'get_asset': timeit(quiet(lambda: DB._get_asset(serial_number=random.choice(serials), db=db)), lookups)}
+
+    res['get_device_data'] = timeit(quiet(lambda: DB.get_device_data(random.choice(devices), db)), repeat)
+    res['get_device_data_typed'] = timeit(quiet(lambda: DB.get_device_data(random.choice(devices), db, typed=True)), repeat)
+    res['get_unit_stats'] = timeit(quiet(lambda: DB.get_unit_stats(random.choice(devices), 1, 0.5, db, use_aggregate=False)), repeat)
+
+    # pre-aggregated per cycle statistics
+    view = 'irel_cycle_stats_timescale.sql' if timescale else 'irel_cycle_stats.sql'
+    with open(os.path.join(synthetic.SQL, view), 'r') as f:
+        cur.execute(f.read())
+    db.commit()
+    DB.refresh_schema(db)
+    res['refresh_cycle_stats'] = timeit(quiet(lambda: DB.refresh_cycle_stats(db)), 1)
+    res['get_unit_stats_aggregate'] = timeit(quiet(lambda: DB.get_unit_stats(random.choice(devices), 1, 0.5, db)), repeat)
+
+    res['get_round_data'] = timeit(quiet(lambda: DB.get_round_data(random.choice(groups), db)), repeat)
+    res['get_round_data_cooling_block'] = timeit(quiet(lambda: DB.get_round_data(random.choice(groups), db, include_cooling_block=True)), repeat)
+    return res
+
+
+def run_scale(args, rows: int) -> dict:
+    name = f"dmf_bench_{rows}_{os.getpid()}"
+    admin = psycopg2.connect(**params(args))
+    admin.autocommit = True
+    with admin.cursor() as c:
+        c.execute(f"drop database if exists {name};")
+        c.execute(f"create database {name};")
+    try:
+        db, cur = DB.connect(dict(params(args), dbname=name))
+        random.seed(rows)
+        synthetic.create_schema(db, cur, timescale=args.timescale)
+        layout = synthetic.create_layout(db, cur, groups=args.groups, devices=args.devices)
+        print(f"[INFO] loading {rows} rows into {name}")
+        start = time.perf_counter()
+        written = quiet(lambda: synthetic.populate(db, cur, layout, rows, cb_fraction=args.cb_fraction))()
+        res = {'rows': written, 'load_seconds': time.perf_counter() - start}
+        size = DB.execute("select pg_total_relation_size('data_tb') as data_tb, pg_total_relation_size('cb_data_tb') as cb_data_tb;", db)
+        res['table_bytes'] = {k: int(v) for k, v in size.iloc[0].items()}
+        print(f"[INFO] timing ingest")
+        res['ingest'] = bench_ingest(db, cur, layout, min(args.ingest_rows, rows))
+        print(f"[INFO] timing reads")
+        res.update(bench_reads(db, cur, layout, args.repeat, args.lookups, args.timescale))
+        db.close()
+    finally:
+        if not args.keep:
+            with admin.cursor() as c:
+                c.execute(f"drop database if exists {name};")
+        admin.close()
+    return res
+
+
+def environment(args) -> dict:
+    db = psycopg2.connect(**params(args))
+    with db.cursor() as c:
+        c.execute("show server_version;")
+        server = c.fetchone()[0]
+        c.execute("select default_version from pg_available_extensions where name = 'timescaledb';")
+        ts = c.fetchone()
+    db.close()
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit = None
+    return {'postgres': server, 'timescaledb': ts[0] if ts else None, 'python': platform.python_version(),
+            'machine': platform.machine(), 'commit': commit, 'started': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--scales', type=float, nargs='+', default=[1e5, 1e6, 1e7], help='data_tb rows per run')
+    p.add_argument('--timescale', action='store_true', help='create data_tb and cb_data_tb as hypertables')
+    p.add_argument('--groups', type=int, default=4)
+    p.add_argument('--devices', type=int, default=8, help='transistors per group')
+    p.add_argument('--cb-fraction', type=float, default=0.1, help='cb_data_tb rows relative to data_tb')
+    p.add_argument('--ingest-rows', type=int, default=100000, help='rows inserted by each ingest method')
+    p.add_argument('--repeat', type=int, default=5, help='calls per read benchmark')
+    p.add_argument('--lookups', type=int, default=1000, help='calls of the point lookup benchmark')
+    p.add_argument('--keep', action='store_true', help='keep the databases')
+    args = p.parse_args()
+
+    results = {'benchmark': 'suite', 'environment': environment(args), 'timescale': args.timescale,
+               'config': {k: v for k, v in vars(args).items() if k not in ('password', 'output')}, 'scales': {}}
+    for rows in args.scales:
+        print(f"[INFO] scale {int(rows)}")
+        results['scales'][str(int(rows))] = run_scale(args, int(rows))
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
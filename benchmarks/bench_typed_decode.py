@@ -0,0 +1,66 @@
+"""
+    decode time and peak memory of a full table pull through DB.execute (pandas.read_sql, object
+    columns) versus DB.execute with dtypes (typed columnar decoding). each mode runs in its own
+    process so the peak resident set size of one does not hide the other
+
+    python benchmarks/bench_typed_decode.py --dbname <db> --table data_tb --limit 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+from common import parser, params, write_results
+from package.api import DB
+
+warnings.filterwarnings('ignore', message='pandas only supports SQLAlchemy')
+
+
+def run(args, mode: str) -> dict:
+    db, cur = DB.connect(params(args))
+    query = f"select * from {args.table} order by id limit %s;"
+    dtypes = DB.DTYPES.get(args.table, {}) if mode == 'typed' else None
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    df = DB.execute(query, db, params=(args.limit,), dtypes=dtypes)
+    seconds = time.perf_counter() - start
+    db.close()
+    return {
+        'rows': len(df),
+        'seconds': seconds,
+        'rows_per_second': len(df) / seconds if seconds > 0 else None,
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024,
+        'frame_mb': df.memory_usage(deep=True).sum() / 1024**2,
+        'dtypes': {c: str(t) for c, t in df.dtypes.items()},
+    }
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--table', default='data_tb')
+    p.add_argument('--limit', type=int, default=1000000)
+    p.add_argument('--mode', default=None, choices=['object', 'typed'], help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run(args, args.mode)))
+        return
+
+    results = {'benchmark': 'typed_decode', 'table': args.table, 'limit': args.limit}
+    for mode in ['object', 'typed']:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode] + sys.argv[1:],
+                             capture_output=True, text=True, check=True).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+    results['speedup'] = results['object']['seconds'] / results['typed']['seconds']
+    results['peak_rss_ratio'] = results['object']['peak_rss_growth_mb'] / max(results['typed']['peak_rss_growth_mb'], 1e-9)
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
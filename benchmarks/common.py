@@ -0,0 +1,61 @@
+"""
+    shared helpers for the benchmark scripts
+
+    connection parameters default to the standard PG* environment variables, results are
+    printed and optionally written as json (--output) so runs can be compared between commits
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    p.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    p.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'postgres'))
+    p.add_argument('--user', default=os.environ.get('PGUSER', os.environ.get('USER', 'postgres')))
+    p.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    p.add_argument('--output', default=None, help='write the results to this json file')
+    return p
+
+
+def params(args: argparse.Namespace) -> dict:
+    """returns the DB.connect parameters from parsed arguments"""
+    res = {'host': args.host, 'port': args.port, 'dbname': args.dbname, 'user': args.user}
+    if args.password:
+        res['password'] = args.password
+    return res
+
+
+def timeit(fn, repeat: int = 1) -> dict:
+    """
+        @brief: calls fn <repeat> times
+        @returns: a dict of latency statistics in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'n': repeat,
+        'total': sum(times),
+        'mean': statistics.mean(times),
+        'p50': times[len(times) // 2],
+        'p95': times[min(len(times) - 1, int(len(times) * 0.95))],
+        'min': times[0],
+    }
+
+
+def write_results(results: dict, output: str = None) -> None:
+    print(json.dumps(results, indent=2, default=str))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
@@ -0,0 +1,124 @@
+"""
+    synthetic iREL data for the benchmarks: the schema, rounds (group_tb), transistor and cooling block
+    assets with their component rows, and data_tb / cb_data_tb samples
+
+    each transistor runs 100 sample cycles at 1 sample per second, powered for the first 70% of a
+    cycle (status 1, voltage around 2.5V) and off for the rest (status 0, voltage ~0) while its
+    temperature rises and falls with the power. cooling blocks sample at the same rate
+"""
+import os
+import numpy as np
+import pandas as pd
+
+from package.api import DB
+import package.utils as utils
+
+SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql')
+START = pd.Timestamp('2021-01-01')
+CYCLE = 100
+
+
+def create_schema(db, cur, timescale: bool = False) -> None:
+    """
+    creates the framework and iREL tables, the iREL component tables and, with <timescale>, the hypertables
+    """
+    files = ['create_framework_tables.sql', 'create_functions.sql']
+    if timescale:
+        files.append('enable_timescale.sql')
+    files.append('irel_application_tables.sql')
+    for name in files:
+        with open(os.path.join(SQL, name), 'r') as f:
+            cur.execute(f.read())
+        db.commit()
+    # component tables are created by the asset type trigger with only an id, get_devices needs the unit
+    for asset_type, subtype in [('irel', 'transistor'), ('cooling', 'block')]:
+        DB._create_asset_type(asset_type=asset_type, subtype=subtype, db=db, cur=cur)
+        cur.execute(f"""alter table {asset_type}_{subtype}_tb add column "unit" int,
+                        add column "num_samples" int, add column "misc_info" varchar(256);""")
+        db.commit()
+    DB.refresh_schema(db)
+
+
+def create_layout(db, cur, groups: int = 4, devices: int = 8) -> dict:
+    """
+        @brief: registers <groups> rounds, each with <devices> transistors and one cooling block
+        @returns: {'groups': group_tb rows, 'devices': transistor assets, 'blocks': cooling block assets}
+    """
+    group_ids = []
+    for g in range(groups):
+        res = DB._create_group(group=f'round_{g + 1}', current=1.0 + 0.5 * g, num_devices=devices,
+                               info='synthetic', db=db, cur=cur)
+        group_ids.append(int(res.id.values[0]))
+
+    transistor = DB._get_asset_type(asset_type='irel', subtype='transistor', db=db)
+    block = DB._get_asset_type(asset_type='cooling', subtype='block', db=db)
+    assets = pd.DataFrame({
+        'type_id': [transistor] * (groups * devices) + [block] * groups,
+        'group_id': [g for g in group_ids for _ in range(devices)] + group_ids,
+        'serial_number': [utils.generate_serial_number(12) for _ in range(groups * (devices + 1))],
+        'common_name': [f'dut_{i}' for i in range(groups * devices)] + [f'block_{g}' for g in group_ids],
+    })
+    assets = DB.create_assets(assets, db=db, cur=cur)
+    assets['unit'] = list(range(1, groups * devices + 1)) + list(range(1, groups + 1))
+    DB.create_components(assets[['id', 'unit']].astype(int), db=db, cur=cur)
+    is_block = assets.type_id == block
+    return {
+        'groups': DB.get_rounds(db),
+        'devices': assets[~is_block].reset_index(drop=True),
+        'blocks': assets[is_block].reset_index(drop=True),
+    }
+
+
+def device_frame(asset_id: int, group_id: int, n: int, offset: int = 0, seed: int = 0) -> pd.DataFrame:
+    """
+    <n> data_tb rows of one transistor, starting <offset> samples after START
+    """
+    rng = np.random.default_rng(seed)
+    i = np.arange(offset, offset + n)
+    pos = i % CYCLE
+    status = (pos < 0.7 * CYCLE).astype(np.int16)
+    heat = np.where(status == 1, pos / (0.7 * CYCLE), 1 - (pos - 0.7 * CYCLE) / (0.3 * CYCLE))
+    return pd.DataFrame({
+        'asset_id': asset_id,
+        'group_id': group_id,
+        'dt': START + pd.to_timedelta(i, unit='s'),
+        'cycle': i // CYCLE,
+        'status': status,
+        'temperature': 25 + 60 * heat + rng.normal(0, 0.5, n),
+        'voltage': np.where(status == 1, rng.normal(2.5, 0.3, n), np.abs(rng.normal(0, 0.01, n))),
+    })
+
+
+def block_frame(asset_id: int, group_id: int, n: int, offset: int = 0, seed: int = 0) -> pd.DataFrame:
+    """
+    <n> cb_data_tb rows of one cooling block
+    """
+    df = device_frame(asset_id, group_id, n, offset, seed)
+    rng = np.random.default_rng(seed + 1)
+    df['voltage'] = 0.0
+    df['block_temperature1'] = 20 + 0.1 * df.temperature + rng.normal(0, 0.2, n)
+    df['block_temperature2'] = 20 + 0.1 * df.temperature + rng.normal(0, 0.2, n)
+    df['water_temperature1'] = 15 + rng.normal(0, 0.1, n)
+    df['water_temperature2'] = 16 + rng.normal(0, 0.1, n)
+    return df
+
+
+def populate(db, cur, layout: dict, rows: int, cb_fraction: float = 0.1, chunk_rows: int = 500000) -> dict:
+    """
+        @brief: loads <rows> data_tb rows spread evenly over the transistors and <rows> * <cb_fraction>
+                cb_data_tb rows over the cooling blocks, with binary COPY
+        @returns: {table: rows written}
+    """
+    written = {}
+    for tb, assets, total, frame in [('data_tb', layout['devices'], rows, device_frame),
+                                     ('cb_data_tb', layout['blocks'], int(rows * cb_fraction), block_frame)]:
+        per_asset = np.diff(np.linspace(0, total, len(assets) + 1).astype(int))
+        written[tb] = 0
+        for (_, asset), n in zip(assets.iterrows(), per_asset):
+            for offset in range(0, n, chunk_rows):
+                df = frame(int(asset.id), int(asset.group_id), min(chunk_rows, n - offset), offset, seed=int(asset.id) + offset)
+                DB.copy_insert(df, tb, num_batches=1, db=db, cur=cur, fmt='binary')
+                written[tb] += len(df)
+    cur.execute("analyze;")
+    db.commit()
+    return written
@@ -1,15 +1,30 @@
 import psycopg2
+import psycopg2.extras
 from psycopg2.errorcodes import UNIQUE_VIOLATION
 from psycopg2 import errors
 import pandas as pd
 import sys
+import io
+import struct
+import time
 import traceback
+import concurrent.futures
+import datetime
+import uuid
+import weakref
 import numpy as np
 try:
     import package.utils as utils
+    from package.schema_cache import SchemaCache
+    from package.pool import ConnectionPool
+    from package.instrument import Instrumentation
+    from package.query import Query
 except:
     import utils
-from tqdm import tqdm
+    from schema_cache import SchemaCache
+    from pool import ConnectionPool
+    from instrument import Instrumentation
+    from query import Query
 
 class DB:
     """database interface class"""
@@ -29,6 +44,7 @@ class DB:
             print("[INFO] connecting to db.")
             db = psycopg2.connect(**params)
             print("[INFO] connected.")
+            SchemaCache.listen(db)
             cur = db.cursor()
         except Exception as e:
             print("[ERROR] failed to connect to db.")
@@ -37,35 +53,337 @@ class DB:
         return [db, cur]
 
     @staticmethod
-    def execute(sql_query: str, database: psycopg2.extensions.connection) -> pd.DataFrame:
+    def create_pool(params: dict,
+                    minconn: int = 1,
+                    maxconn: int = 10,
+                    timeout: float = 30.0,
+                    health_check_interval: float = 30.0) -> ConnectionPool:
+        """
+            @brief: creates a thread safe connection pool, sessions checked out of it expose every DB method
+                    with the db/cur arguments filled in
+            @params:
+                params: dictionary of db connection parameters
+                minconn: connections opened up front
+                maxconn: maximum number of open connections
+                timeout: seconds to wait for a free connection
+                health_check_interval: idle seconds after which a connection is tested before reuse
+            @returns:
+                pool: use as "with pool.session() as s: s.get_devices()", see pool.stats() for reuse and wait times
+        """
+        print("[INFO] creating connection pool.")
+        return ConnectionPool(params, minconn=minconn, maxconn=maxconn, timeout=timeout,
+                              health_check_interval=health_check_interval)
+
+    @staticmethod
+    def create_registry(params: dict, max_staleness: float = 30.0, max_backoff: float = 60.0):
+        """
+            @brief: loads asset_tb, asset_type_tb, group_tb, process_tb and the component tables into in-memory
+                    lookup indexes kept current by the notifications of sql/registry.sql
+            @params:
+                params: dictionary of db connection parameters, the registry holds its own connection
+                max_staleness: seconds between version checks while no notification arrives
+                max_backoff: longest wait between reconnect attempts, the loaded tables are served meanwhile
+            @returns:
+                registry: pass as registry= to _get_asset, _get_asset_type, get_devices and get_rounds, or use
+                          its lookups (asset_id, serial_number, type_of, group_of, unit_of) directly
+        """
+        try:
+            from package.registry import Registry
+        except:
+            from registry import Registry
+        print("[INFO] loading registry.")
+        return Registry(params, max_staleness=max_staleness, max_backoff=max_backoff)
+
+    @staticmethod
+    def execute(sql_query: str,
+                database: psycopg2.extensions.connection,
+                params: tuple or dict = None,
+                dtypes: dict = None) -> pd.DataFrame:
         """
             @brief: shorthand sql style execution, preferred method for select statements
             @params:
-                sql_query: the query string to execute
+                sql_query: the query string to execute, values should be bound with %s placeholders
                 database: the database to execute on
+                params: the values bound to the placeholders (literal % must then be written as %%)
+                dtypes: {column: numpy dtype}, decodes the rows straight into preallocated arrays of these
+                        dtypes instead of building float64/int64/object columns and casting them (see DB.DTYPES)
             @returns: a pandas table of the query results
         """
+        start = time.perf_counter() if Instrumentation.enabled else None
         try:
-            return pd.read_sql_query(sql_query, database)
+            if dtypes is not None:
+                df = DB._execute_typed(sql_query, database, params, dtypes)
+            else:
+                df = pd.read_sql_query(sql_query, database, params=params)
+            if start is not None:
+                Instrumentation.observe(sql_query, start, rows=len(df), nbytes=Instrumentation.frame_bytes(df),
+                                        params=params, database=database)
+            return df
         except Exception as e:
+            if start is not None:
+                Instrumentation.observe(sql_query, start, params=params, error=e)
             print(e)
             print(traceback.print_exc())
             if ('NoneType' in str(e)):
                 print("ignoring error")
             return pd.DataFrame()
 
+    # statements prepared on each connection, {connection: {name: statement}}
+    _prepared = weakref.WeakKeyDictionary()
+
     @staticmethod
-    def get_tables(db: psycopg2.extensions.connection) -> pd.DataFrame:
-        """Returns a DataFrame of the tables in a given database"""
-        return DB.execute("""SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'""", db)
+    def execute_prepared(name: str,
+                         statement: str,
+                         params: tuple = (),
+                         database: psycopg2.extensions.connection = None) -> pd.DataFrame:
+        """
+            @brief: executes a named server side prepared statement, preparing it on first use per connection
+                    so repeated lookups reuse the plan instead of being parsed and planned on every call
+            @params:
+                name: the statement name, unique per statement text
+                statement: the query with $1, $2, ... placeholders
+                params: the values bound to the placeholders
+                database: the database to execute on
+            @returns: a pandas table of the query results (empty on error, as execute)
+        """
+        prepared = DB._prepared.setdefault(database, {})
+        execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))});" if len(params) > 0 else f"EXECUTE {name};"
+        for attempt in range(2):
+            # inside the caller's transaction the statements run under a savepoint (sent with the first of them),
+            # so a failure rolls back only this lookup and not the caller's work
+            status = database.get_transaction_status()
+            savepoint = not database.autocommit and status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+            prefix = "SAVEPOINT dmf_prepared; " if savepoint else ''
+            start = None
+            try:
+                with database.cursor() as cur:
+                    if prepared.get(name) != statement:
+                        if name in prepared:
+                            cur.execute(prefix + f"DEALLOCATE {name};")
+                            prefix = ''
+                        cur.execute(prefix + f"PREPARE {name} AS {statement}")
+                        prefix = ''
+                        prepared[name] = statement
+                    start = time.perf_counter() if Instrumentation.enabled else None
+                    cur.execute(prefix + execute, params)
+                    df = pd.DataFrame.from_records(cur.fetchall(), columns=[col[0] for col in cur.description])
+                    if savepoint:
+                        cur.execute("RELEASE SAVEPOINT dmf_prepared;")
+                    if start is not None:
+                        Instrumentation.observe(execute, start, rows=len(df), nbytes=Instrumentation.frame_bytes(df),
+                                                params=params, database=database)
+                    return df
+            except Exception as e:
+                DB._rollback_prepared(database, savepoint, status)
+                # deallocated behind our back, or the table changed under a cached "select *" plan
+                retry = isinstance(e, (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported))
+                if isinstance(e, psycopg2.errors.InvalidSqlStatementName):
+                    prepared.pop(name, None)
+                elif retry:
+                    prepared[name] = None
+                if not retry or attempt > 0:
+                    if start is not None:
+                        Instrumentation.observe(execute, start, params=params, error=e)
+                    print(e)
+                    return pd.DataFrame()
+
+
+
+    @staticmethod
+    def _rollback_prepared(database: psycopg2.extensions.connection, savepoint: bool, status: int) -> None:
+        """
+        undoes a failed execute_prepared, back to its savepoint or, if no transaction was open before it, the
+        implicit one it started. a transaction that had already failed is left to the caller (as execute does)
+        """
+        if database.closed or status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        if savepoint:
+            try:
+                with database.cursor() as cur:
+                    cur.execute("ROLLBACK TO SAVEPOINT dmf_prepared; RELEASE SAVEPOINT dmf_prepared;")
+                return
+            except psycopg2.Error:
+                pass
+        database.rollback()
+
+    # target dtypes of the typed fetch path per table, see execute(dtypes=...)
+    DTYPES = {
+        'data_tb': {
+            'id': np.int64,
+            'asset_id': np.int16,
+            'group_id': np.int16,
+            'dt': 'datetime64[us]',
+            'cycle': np.int32,
+            'status': np.int16,
+            'temperature': np.float32,
+            'voltage': np.float32,
+        },
+    }
+    DTYPES['cb_data_tb'] = dict(DTYPES['data_tb'], **{
+        'block_temperature1': np.float32,
+        'block_temperature2': np.float32,
+        'water_temperature1': np.float32,
+        'water_temperature2': np.float32,
+    })
+
+    # postgres type oid -> dtype for columns missing from the dtypes map (int2, int4, int8, float4, float8, numeric)
+    _default_dtypes = {21: np.int16, 23: np.int32, 20: np.int64, 700: np.float32, 701: np.float64, 1700: np.float64}
+
+    # timestamp without time zone left as its text form, parsed per column by numpy in _decode_block
+    _timestamp_us = psycopg2.extensions.new_type((1114,), 'DMF_TIMESTAMP_US', lambda value, cur: value)
+
+    @staticmethod
+    def _execute_typed(sql_query: str,
+                       database: psycopg2.extensions.connection,
+                       params: tuple or dict,
+                       dtypes: dict,
+                       block: int = 10000) -> pd.DataFrame:
+        """
+        runs a query and decodes the rows block by block into arrays allocated once with the target dtypes
+        """
+        with database.cursor() as cur:
+            psycopg2.extensions.register_type(DB._timestamp_us, cur)
+            cur.execute(sql_query, params)
+            arrays = DB._allocate(cur.description, cur.rowcount, dtypes)
+            pos = 0
+            while True:
+                rows = cur.fetchmany(block)
+                if not rows:
+                    break
+                DB._decode_block(rows, arrays, pos)
+                pos += len(rows)
+        return pd.DataFrame(arrays, copy=False)
+
+
+
+    @staticmethod
+    def _allocate(description, n: int, dtypes: dict) -> dict:
+        """
+        {column: array}, timestamps always as datetime64[us], undeclared columns by their postgres type
+        """
+        arrays = {}
+        for col in description:
+            if col.type_code == 1114:
+                arrays[col.name] = np.empty(n, dtype='datetime64[us]')
+            else:
+                arrays[col.name] = np.empty(n, dtype=dtypes.get(col.name, DB._default_dtypes.get(col.type_code, object)))
+        return arrays
+
+
+
+    @staticmethod
+    def _decode_block(rows: list, arrays: dict, pos: int) -> None:
+        """
+        writes a block of row tuples into the column arrays at <pos>. integer columns that turn out
+        to contain nulls are upcast to float64 (NaN), the same as pandas would
+        """
+        end = pos + len(rows)
+        for (col, arr), values in zip(list(arrays.items()), zip(*rows)):
+            if arr.dtype.kind == 'M':
+                arr[pos:end] = np.array(values, dtype='datetime64[us]')
+                continue
+            if arr.dtype.kind in 'iu' and None in values:
+                arr = arrays[col] = arr.astype(np.float64)
+                arr[pos:] = np.nan
+            arr[pos:end] = values
+
+
+    @staticmethod
+    def stream(sql_query: str,
+               database: psycopg2.extensions.connection,
+               chunksize: int = 100000,
+               arrow: bool = False,
+               params: tuple or dict = None,
+               dtypes: dict = None):
+        """
+            @brief: streaming counterpart of execute, runs the query on a named (server side) cursor so only
+                    <chunksize> rows are held in memory at a time. must be consumed inside a transaction,
+                    i.e. do not commit on <database> until the generator is exhausted or closed
+            @params:
+                sql_query: the query string to execute
+                database: the database to execute on
+                chunksize: number of rows per yielded chunk
+                arrow: yield pyarrow.RecordBatch instead of pandas tables
+                params: the values bound to %s placeholders in <sql_query>
+                dtypes: {column: numpy dtype} to decode each chunk into, as in execute
+            @returns: a generator of pandas tables (or record batches) of at most <chunksize> rows
+        """
+        assert chunksize > 0, '[ERROR] <chunksize> must be > 0'
+        if arrow:
+            import pyarrow as pa
+        cur = database.cursor(name=f"dmf_stream_{uuid.uuid4().hex}")
+        cur.itersize = chunksize
+        if dtypes is not None:
+            psycopg2.extensions.register_type(DB._timestamp_us, cur)
+        # with instrumentation, the time spent fetching and decoding (not consuming) is recorded once the stream ends
+        instrumented = Instrumentation.enabled
+        seconds, total_rows, total_bytes = 0.0, 0, 0
+        try:
+            start = time.perf_counter()
+            cur.execute(sql_query, params)
+            while True:
+                rows = cur.fetchmany(chunksize)
+                if not rows:
+                    break
+                if dtypes is not None:
+                    arrays = DB._allocate(cur.description, len(rows), dtypes)
+                    DB._decode_block(rows, arrays, 0)
+                    df = pd.DataFrame(arrays, copy=False)
+                else:
+                    df = pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description])
+                if instrumented:
+                    seconds += time.perf_counter() - start
+                    total_rows += len(df)
+                    total_bytes += Instrumentation.frame_bytes(df)
+                yield pa.RecordBatch.from_pandas(df, preserve_index=False) if arrow else df
+                start = time.perf_counter()
+        finally:
+            if not cur.closed and not database.closed:
+                cur.close()
+            if instrumented:
+                Instrumentation.observe(sql_query, start, rows=total_rows, nbytes=total_bytes, seconds=seconds)
+
+    @staticmethod
+    def refresh_schema(db: psycopg2.extensions.connection = None) -> None:
+        """Drops the cached tables, fields and asset ids for <db> (or every connection if None)"""
+        SchemaCache.invalidate(db)
+
+
+
+    @staticmethod
+    def has_extension(name: str = '',
+                      db: psycopg2.extensions.connection = None) -> bool:
+        """Returns True if the extension (e.g. timescaledb) is installed in the database (cached per connection)"""
+        entry = SchemaCache.get(db)
+        if entry['extensions'] is None:
+            entry['extensions'] = set(DB.execute("""select extname from pg_extension""", db).values.ravel().tolist())
+        return name in entry['extensions']
+
+
+
+    @staticmethod
+    def get_tables(db: psycopg2.extensions.connection,
+                   refresh: bool = False) -> pd.DataFrame:
+        """Returns a DataFrame of the tables in a given database (cached per connection)"""
+        entry = SchemaCache.get(db)
+        if refresh or entry['tables'] is None:
+            res = DB.execute("""SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'""", db)
+            if len(res) == 0:
+                return res
+            entry['tables'] = res
+        return entry['tables'].copy()
 
 
 
     @staticmethod
     def table_exists(tb: str = '',
-                     db: psycopg2.extensions.connection = None) -> bool:
-        res = DB.execute(f"""select * from information_schema.tables where table_schema = 'public' and table_name = '{tb}';""", db)
-        if len(res.table_name.values) > 0:
+                     db: psycopg2.extensions.connection = None,
+                     refresh: bool = False) -> bool:
+        tables = DB.get_tables(db, refresh=refresh)
+        if tb not in tables.values and not refresh:
+            # tables created by another connection may not have been announced yet
+            tables = DB.get_tables(db, refresh=True)
+        if tb in tables.values:
             return True
         else:
             return False
@@ -75,16 +393,17 @@ class DB:
     @staticmethod
     def get_fields(tb: str = None,
                    as_list: bool = True,
-                   db: psycopg2.extensions.connection = None) -> pd.DataFrame or list:
+                   db: psycopg2.extensions.connection = None,
+                   refresh: bool = False) -> pd.DataFrame or list:
         """Returns the fields (column headers) for a given table"""
 
         assert tb is not None and db is not None, '[ERROR] must supply the name of the table (tb=__) and psycopg2.extensions.connection (db=__)'
 
-        res = DB.execute("""SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS WHERE table_name = '{}';""".format(tb), db)
+        fields = list(DB.get_field_types(tb, db=db, refresh=refresh).keys())
         if not as_list:
-            return res
+            return pd.DataFrame({'column_name': fields})
         else:
-            return [col for cols in res.values.tolist() for col in cols]
+            return fields
 
 
 
@@ -95,12 +414,16 @@ class DB:
                      num_batches: int = 10,
                      db: psycopg2.extensions.connection = None,
                      cur: psycopg2.extensions.cursor = None,
-                     verbose: bool = False) -> int:
+                     verbose: bool = False,
+                     receipts: bool = False) -> int or pd.DataFrame:
         """
-        returns the id of the last record inserted
+        returns the id of the last record inserted (None if nothing was inserted or <tb> has no id column),
+        or with <receipts> a pandas table of the start row, row count, seconds and inserted id ranges of each chunk.
+        the ids are collected with RETURNING, so concurrent writers never see each other's rows
         """
         assert tb in DB.get_tables(db).values, f'[ERROR] table <{tb}> does not exist'
-        assert all(col in DB.get_fields(f'{tb}', as_list=True, db=db) for col in list(df.columns)), f'[ERROR] target table <{tb}> does not contain all passed columns <{list(df.columns)}>'
+        fields = DB.get_fields(f'{tb}', as_list=True, db=db)
+        assert all(col in fields for col in list(df.columns)), f'[ERROR] target table <{tb}> does not contain all passed columns <{list(df.columns)}>'
         # about 100x faster than a for loop, 2x faster than using executemany or execute_batch
         # uses a generator to bypass memory issues
         values = list(tuple(x) for x in zip(*(df[x].values.tolist() for x in list(df.columns))))
@@ -111,19 +434,461 @@ class DB:
 
         if verbose:
             print(f'chunk size: {chunk_size}, values shape: {len(values)}, {len(values[0])}')
-            
+
+        returning = ' RETURNING "id"' if 'id' in fields else ''
+        report = []
         for i, chunk in utils.chunk_generator(values, chunk_size):
             vals = str(chunk).replace('[', '').replace(']', '')
-            statement = f"""INSERT INTO {tb} {str(tuple(df.columns)).replace("'", '"')} VALUES {vals};"""
+            statement = f"""INSERT INTO {tb} {str(tuple(df.columns)).replace("'", '"')} VALUES {vals}{returning};"""
+            start = time.perf_counter()
+            ids = []
             try:
-                cur.execute(statement)
+                Instrumentation.execute(cur, statement)
+                ids = [row[0] for row in cur.fetchall() if row[0] is not None] if returning else []
+                rows = cur.rowcount
                 db.commit()
             except Exception as e:
                 # get error code
                 print(str(e))
-                
+                rows = 0
                 db.rollback()
-        return DB.execute(f"select max(id) from {tb};", db).values[0][0]
+            report.append(DB._receipt(i, rows, time.perf_counter() - start, DB._id_ranges(ids)))
+        report = pd.DataFrame(report, columns=DB._receipt_columns)
+        if receipts:
+            return report
+        last = report.last_id.dropna()
+        return int(last.max()) if len(last) > 0 else None
+
+
+
+
+    @staticmethod
+    def get_field_types(tb: str = None,
+                        db: psycopg2.extensions.connection = None,
+                        refresh: bool = False) -> dict:
+        """Returns a dict of {column_name: data_type} for a given table (cached per connection)"""
+
+        assert tb is not None and db is not None, '[ERROR] must supply the name of the table (tb=__) and psycopg2.extensions.connection (db=__)'
+
+        entry = SchemaCache.get(db)
+        if refresh or tb not in entry['fields']:
+            res = DB.execute("""SELECT column_name, data_type FROM INFORMATION_SCHEMA.COLUMNS WHERE table_name = %s ORDER BY ordinal_position;""", db, params=(tb,))
+            if len(res) == 0:
+                return {}
+            entry['fields'][tb] = dict(zip(res.column_name.values, res.data_type.values))
+        return dict(entry['fields'][tb])
+
+
+
+
+    @staticmethod
+    def get_key(tb: str = None,
+                db: psycopg2.extensions.connection = None,
+                refresh: bool = False) -> list:
+        """
+        Returns the columns of the primary key of a table, or of its first unique index (e.g. the one
+        enable_timescale.sql creates on data_tb), [] if it has neither (cached per connection)
+        """
+
+        assert tb is not None and db is not None, '[ERROR] must supply the name of the table (tb=__) and psycopg2.extensions.connection (db=__)'
+
+        entry = SchemaCache.get(db)
+        if refresh or tb not in entry['keys']:
+            res = DB.execute("""select i.indexrelid, a.attname from pg_index i
+                                join pg_attribute a on a.attrelid = i.indrelid and a.attnum = any(i.indkey)
+                                where i.indrelid = to_regclass(%s) and i.indisunique and i.indpred is null and i.indexprs is null
+                                order by i.indisprimary desc, i.indexrelid, array_position(i.indkey::int2[], a.attnum);""", db, params=(tb,))
+            entry['keys'][tb] = res[res.indexrelid == res.indexrelid.values[0]].attname.tolist() if len(res) > 0 else []
+        return list(entry['keys'][tb])
+
+
+
+
+    @staticmethod
+    def get_id_sequence(tb: str = None,
+                        db: psycopg2.extensions.connection = None,
+                        refresh: bool = False) -> str or None:
+        """Returns the sequence behind the id column of a table, None if it has none (e.g. cb_data_tb) (cached per connection)"""
+
+        assert tb is not None and db is not None, '[ERROR] must supply the name of the table (tb=__) and psycopg2.extensions.connection (db=__)'
+
+        entry = SchemaCache.get(db)
+        if refresh or tb not in entry['sequences']:
+            seq = None
+            if 'id' in DB.get_field_types(tb, db=db):
+                res = DB.execute("""select pg_get_serial_sequence(%s, 'id') as "seq";""", db, params=(tb,))
+                seq = res.seq.values[0] if len(res) > 0 else None
+            entry['sequences'][tb] = seq
+        return entry['sequences'][tb]
+
+
+
+    @staticmethod
+    def reserve_ids(tb: str = None,
+                    n: int = 0,
+                    db: psycopg2.extensions.connection = None) -> list:
+        """
+            @brief: reserves a block of <n> ids from the id sequence of <tb> in one round trip. the ids are
+                    never handed out again (even if unused), so rows can be written with them by any number
+                    of concurrent writers
+            @returns: the reserved ids as a list of inclusive (first, last) ranges, contiguous unless another
+                      writer drew from the sequence at the same time
+        """
+        seq = DB.get_id_sequence(tb, db=db)
+        assert seq is not None, f'[ERROR] <{tb}> has no id sequence'
+        if n <= 0:
+            return []
+        # gaps and islands: consecutive ids share id - row_number()
+        res = DB.execute("""with "ids" as (select nextval(%s::regclass) as "id" from generate_series(1, %s)),
+                                 "islands" as (select "id", "id" - row_number() over (order by "id") as "island" from "ids")
+                            select min("id") as "first_id", max("id") as "last_id" from "islands" group by "island" order by 1;""",
+                         db, params=(seq, int(n)))
+        return list(zip(res.first_id.astype(int).tolist(), res.last_id.astype(int).tolist()))
+
+
+
+    @staticmethod
+    def _id_ranges(ids) -> list:
+        """collapses ids into inclusive (first, last) ranges of consecutive ids"""
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        if len(ids) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(ids) != 1)
+        first = ids[np.r_[0, breaks + 1]]
+        last = ids[np.r_[breaks, len(ids) - 1]]
+        return list(zip(first.tolist(), last.tolist()))
+
+
+
+    @staticmethod
+    def _ids_of(ranges: list) -> np.ndarray:
+        """expands inclusive (first, last) ranges into the ids"""
+        if len(ranges) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(first, last + 1, dtype=np.int64) for first, last in ranges])
+
+
+
+    _receipt_columns = ['chunk', 'rows', 'seconds', 'first_id', 'last_id', 'id_ranges']
+
+    @staticmethod
+    def _receipt(chunk: int, rows: int, seconds: float, ranges: list) -> tuple:
+        if rows == 0 or len(ranges) == 0:
+            return (chunk, rows, seconds, None, None, [])
+        return (chunk, rows, seconds, ranges[0][0], ranges[-1][1], ranges)
+
+
+
+
+    @staticmethod
+    def _valid_asset_ids(units: list = None,
+                         db: psycopg2.extensions.connection = None) -> bool:
+        """
+        checks that every id in <units> exists in asset_tb, using the cached ids and reloading them once on a miss
+        """
+        entry = SchemaCache.get(db)
+        for attempt in range(2):
+            if attempt > 0 or entry['asset_ids'] is None:
+                entry['asset_ids'] = set(DB.execute("select id from asset_tb;", db).values.ravel().tolist())
+            if all(unit in entry['asset_ids'] for unit in units):
+                return True
+        return False
+
+
+
+
+    @staticmethod
+    def copy_insert(df: pd.DataFrame = None,
+                    tb: str = '',
+                    num_batches: int = 10,
+                    db: psycopg2.extensions.connection = None,
+                    cur: psycopg2.extensions.cursor = None,
+                    fmt: str = 'text',
+                    verbose: bool = False,
+                    receipts: bool = False) -> pd.DataFrame:
+        """
+            @brief: streams a dataframe into a table with COPY ... FROM STDIN, one chunk per transaction.
+                    drop-in replacement for batch_insert that never builds the full list of values.
+            @params:
+                df: the data to insert, columns must exist in <tb>
+                tb: the target table
+                num_batches: number of chunks (and transactions) to split df into
+                db: the database
+                cur: the cursor
+                fmt: 'text' (csv formatted text) or 'binary' (PGCOPY). binary is only used for chunks where every
+                     column is a fixed width type without nulls, other chunks fall back to text
+                verbose: print per chunk progress
+                receipts: pre-assign the ids of the rows from a block reserved on the id sequence of <tb> (see
+                          reserve_ids) and report the id ranges written by each chunk. ignored when df has an id
+                          column or <tb> has no id sequence (the ranges are then empty)
+            @returns: a pandas table with the start row, row count and seconds of each chunk (rows is 0 on failure),
+                      with <receipts> also the first id, last id and inclusive (first, last) id ranges of each chunk
+        """
+        assert fmt in ['text', 'binary'], '[ERROR] <fmt> must be "text" or "binary"'
+        assert tb in DB.get_tables(db).values, f'[ERROR] table <{tb}> does not exist'
+        field_types = DB.get_field_types(tb, db=db)
+        assert all(col in field_types for col in list(df.columns)), f'[ERROR] target table <{tb}> does not contain all passed columns <{list(df.columns)}>'
+        if len(df) == 0:
+            report = pd.DataFrame([], columns=DB._receipt_columns)
+            return report if receipts else report[['chunk', 'rows', 'seconds']]
+
+        chunk_size = int(len(df)/num_batches)
+        if chunk_size == 0:
+            chunk_size = len(df)
+
+        if verbose:
+            print(f'chunk size: {chunk_size}, df shape: {df.shape}')
+
+        ids = None
+        if receipts and 'id' not in df.columns and DB.get_id_sequence(tb, db=db) is not None:
+            # one reservation for the whole frame, a failed chunk leaves a gap in the sequence
+            ids = DB._ids_of(DB.reserve_ids(tb, len(df), db=db))
+            df = df.assign(id=ids.astype(np.int32) if field_types['id'] == 'integer' else ids)
+
+        types = [field_types[col] for col in df.columns]
+        report = []
+        for i, chunk in utils.chunk_generator(df, chunk_size):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                DB._copy_chunk(chunk, tb, types, fmt, cur)
+                rows = cur.rowcount
+                db.commit()
+            except Exception as e:
+                print(str(e))
+                db.rollback()
+            ranges = DB._id_ranges(ids[i - 1:i - 1 + len(chunk)]) if ids is not None and rows > 0 else []
+            report.append(DB._receipt(i, rows, time.perf_counter() - start, ranges))
+            if verbose:
+                print(f'chunk {i}: {rows} rows in {report[-1][2]:.3f}s')
+        report = pd.DataFrame(report, columns=DB._receipt_columns)
+        return report if receipts else report[['chunk', 'rows', 'seconds']]
+
+
+
+
+    # numpy big endian formats for the fixed width postgres types supported by binary COPY
+    _binary_formats = {
+        'smallint': '>i2',
+        'integer': '>i4',
+        'bigint': '>i8',
+        'real': '>f4',
+        'double precision': '>f8',
+        'boolean': '?',
+        'timestamp without time zone': '>i8',
+    }
+    _pg_epoch = np.datetime64('2000-01-01', 'us')
+    _int_ranges = {
+        'smallint': (-2**15, 2**15 - 1),
+        'integer': (-2**31, 2**31 - 1),
+        'bigint': (-2**63, 2**63 - 1),
+    }
+
+
+
+    @staticmethod
+    def _copy_chunk(chunk: pd.DataFrame = None,
+                    tb: str = '',
+                    types: list = None,
+                    fmt: str = 'text',
+                    cur: psycopg2.extensions.cursor = None) -> None:
+        """
+        copies a single chunk into <tb> on the given cursor, does not commit
+        """
+        cols = str(tuple(chunk.columns)).replace("'", '"').replace(',)', ')')
+        start = time.perf_counter() if Instrumentation.enabled else None
+        payload = DB._encode_binary(chunk, types) if fmt == 'binary' else None
+        if payload is not None:
+            statement = f"""COPY {tb} {cols} FROM STDIN WITH (FORMAT binary)"""
+            cur.copy_expert(statement, io.BytesIO(payload))
+            nbytes = len(payload)
+        else:
+            buf = io.StringIO()
+            DB._text_frame(chunk, types).to_csv(buf, header=False, index=False)
+            buf.seek(0)
+            statement = f"""COPY {tb} {cols} FROM STDIN WITH (FORMAT csv)"""
+            cur.copy_expert(statement, buf)
+            nbytes = buf.tell()
+        if start is not None:
+            Instrumentation.observe(statement, start, rows=len(chunk), nbytes=nbytes)
+
+
+
+    @staticmethod
+    def _text_frame(chunk: pd.DataFrame = None,
+                    types: list = None) -> pd.DataFrame:
+        """
+        the chunk as the text path writes it: float columns bound for integer columns (integers read with nulls)
+        become nullable integers, as to_csv writes 3.0 and COPY rejects that for an integer. columns with
+        fractions are left as they are and fail in COPY
+        """
+        ints = {}
+        for j, pg_type in enumerate(types):
+            col = chunk.iloc[:, j]
+            if pg_type in DB._int_ranges and col.dtype.kind == 'f':
+                values = col.values[~np.isnan(col.values)]
+                if np.all(np.isfinite(values)) and np.all(values == np.floor(values)):
+                    ints[j] = 'Int64'
+        if len(ints) == 0:
+            return chunk
+        return pd.DataFrame({j: chunk.iloc[:, j].astype(ints[j]) if j in ints else chunk.iloc[:, j] for j in range(len(types))})
+
+
+
+    @staticmethod
+    def _encode_binary(chunk: pd.DataFrame = None,
+                       types: list = None) -> bytes or None:
+        """
+        encodes a chunk as a PGCOPY payload with a single structured array, one record per row.
+        returns None if any column is not fixed width, contains nulls or does not fit its target type
+        without loss (see _binary_fits), the text path then converts it or raises as COPY does
+        """
+        fields = [('n', '>i2')]
+        for j, pg_type in enumerate(types):
+            col = chunk.iloc[:, j]
+            if pg_type not in DB._binary_formats or not DB._binary_fits(col, pg_type):
+                return None
+            fields += [(f'l{j}', '>i4'), (f'v{j}', DB._binary_formats[pg_type])]
+
+        rec = np.empty(len(chunk), dtype=np.dtype(fields))
+        rec['n'] = len(types)
+        for j, pg_type in enumerate(types):
+            values = chunk.iloc[:, j].values
+            if pg_type == 'timestamp without time zone':
+                values = (values.astype('datetime64[us]') - DB._pg_epoch).astype(np.int64)
+            rec[f'l{j}'] = rec.dtype[f'v{j}'].itemsize
+            rec[f'v{j}'] = values
+        header = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+        return header + rec.tobytes() + struct.pack('>h', -1)
+
+
+
+    @staticmethod
+    def _binary_fits(col: pd.Series, pg_type: str) -> bool:
+        """
+        True if the numpy cast of <col> to <pg_type> is exact: a plain numpy dtype (no extension, tz-aware or
+        object dtypes) without nulls, datetimes only for timestamps, booleans only for boolean, and integer
+        targets only from integers or whole floats within the range of the target
+        """
+        dtype = col.dtype
+        if not isinstance(dtype, np.dtype) or dtype.kind not in 'biufM' or col.isnull().any():
+            return False
+        if pg_type == 'timestamp without time zone' or dtype.kind == 'M':
+            return pg_type == 'timestamp without time zone' and dtype.kind == 'M'
+        if dtype.kind == 'b':
+            return pg_type == 'boolean' or pg_type in DB._int_ranges
+        if pg_type == 'boolean':
+            return False
+        if pg_type in DB._int_ranges:
+            values = col.values
+            if dtype.kind == 'f' and not (np.all(np.isfinite(values)) and np.all(values == np.floor(values))):
+                return False
+            lo, hi = DB._int_ranges[pg_type]
+            # python ints, so uint64 and float bounds compare exactly
+            return lo <= int(values.min()) and int(values.max()) <= hi
+        return True
+
+
+
+
+    @staticmethod
+    def upsert_insert(df: pd.DataFrame = None,
+                      tb: str = '',
+                      num_batches: int = 1,
+                      on_conflict: str = 'nothing',
+                      update_cols: list = None,
+                      keys: list = None,
+                      return_rejected: bool = False,
+                      db: psycopg2.extensions.connection = None,
+                      cur: psycopg2.extensions.cursor = None,
+                      fmt: str = 'binary',
+                      verbose: bool = False) -> dict:
+        """
+            @brief: conflict tolerant insert. each chunk is copied into a temporary staging table and merged into <tb>
+                    with a single INSERT ... ON CONFLICT, so rows that collide with existing keys are skipped (or
+                    update the existing rows) instead of rolling back the whole chunk as batch_insert does.
+                    rows repeating a key within a chunk are collapsed to the last one (counted as duplicates)
+            @params:
+                df: the data to insert, columns must exist in <tb> and include the key
+                tb: the target table
+                num_batches: number of chunks (and transactions) to split df into
+                on_conflict: 'nothing' to skip rows whose key exists, 'update' to overwrite the existing row
+                update_cols: columns overwritten on conflict, defaults to every non key column of df. rows whose
+                             values are unchanged are skipped rather than rewritten
+                keys: the conflict columns, defaults to the primary key (or first unique index) of <tb>
+                return_rejected: also return the keys of the rows that were neither inserted nor updated
+                db: the database
+                cur: the cursor
+                fmt: staging COPY format, 'binary' or 'text' (see copy_insert)
+                verbose: print per chunk counts
+            @returns: {'inserted', 'updated', 'skipped', 'duplicates', 'failed', 'rejected'}. skipped counts the rows
+                      whose key existed and were not updated, rejected is a pandas table of their keys (None unless
+                      <return_rejected>), duplicates counts the earlier rows of keys repeated within a chunk and
+                      failed the rows of chunks that raised an error
+        """
+        assert on_conflict in ['nothing', 'update'], '[ERROR] <on_conflict> must be "nothing" or "update"'
+        assert tb in DB.get_tables(db).values, f'[ERROR] table <{tb}> does not exist'
+        field_types = DB.get_field_types(tb, db=db)
+        assert all(col in field_types for col in list(df.columns)), f'[ERROR] target table <{tb}> does not contain all passed columns <{list(df.columns)}>'
+        keys = list(keys) if keys is not None else DB.get_key(tb, db=db)
+        assert len(keys) > 0, f'[ERROR] <{tb}> has no primary key or unique index, pass the conflict columns as <keys>'
+        assert all(col in df.columns for col in keys), f'[ERROR] the data must contain the key columns <{keys}>'
+        if update_cols is None:
+            update_cols = [col for col in df.columns if col not in keys]
+        assert all(col in df.columns and col not in keys for col in update_cols), f'[ERROR] <update_cols> must be non key columns of the data'
+
+        cols = ', '.join(f'"{col}"' for col in df.columns)
+        key = ', '.join(f'"{col}"' for col in keys)
+        if on_conflict == 'update' and len(update_cols) > 0:
+            targets = ', '.join(f'"{col}"' for col in update_cols)
+            action = f"""do update set ({targets}) = row({', '.join(f'excluded."{col}"' for col in update_cols)})
+                         where ({', '.join(f'{tb}."{col}"' for col in update_cols)}) is distinct from
+                               ({', '.join(f'excluded."{col}"' for col in update_cols)})"""
+        else:
+            action = "do nothing"
+        rejected_agg = ''
+        if return_rejected:
+            # one array per key column of the staged rows missing from the merge output
+            matched = ' and '.join(f'm."{col}" = s."{col}"' for col in keys)
+            rejected_agg = ', ' + ', '.join(f'(select array_agg(s."{col}" order by s.ctid) from src s where not exists (select 1 from m where {matched}))'
+                                            for col in keys)
+        # xmax is 0 on a freshly inserted row version and set on a row version created by the update
+        statement = f"""with src as (select distinct on ({key}) ctid, * from _upsert_stage order by {key}, ctid desc),
+                             m as (insert into {tb} ({cols}) select {cols} from src on conflict ({key}) {action}
+                                   returning {key}, (xmax = 0) as inserted)
+                        select count(*) filter (where inserted), count(*) filter (where not inserted),
+                               (select count(*) from src){rejected_agg} from m;"""
+
+        chunk_size = int(len(df)/num_batches)
+        if chunk_size == 0:
+            chunk_size = len(df)
+        types = [field_types[col] for col in df.columns]
+        res = {'inserted': 0, 'updated': 0, 'skipped': 0, 'duplicates': 0, 'failed': 0}
+        rejected = []
+        for i, chunk in utils.chunk_generator(df, chunk_size):
+            try:
+                Instrumentation.execute(cur, f"""create temp table _upsert_stage on commit drop as select {cols} from {tb} with no data;""")
+                DB._copy_chunk(chunk, '_upsert_stage', types, fmt, cur)
+                Instrumentation.execute(cur, statement)
+                row = cur.fetchone()
+                db.commit()
+            except Exception as e:
+                print(str(e))
+                db.rollback()
+                res['failed'] += len(chunk)
+                continue
+            res['inserted'] += row[0]
+            res['updated'] += row[1]
+            res['skipped'] += row[2] - row[0] - row[1]
+            res['duplicates'] += len(chunk) - row[2]
+            if return_rejected and row[3] is not None:
+                rejected.append(pd.DataFrame(dict(zip(keys, row[3:]))))
+            if verbose:
+                print(f'chunk {i}: {row[0]} inserted, {row[1]} updated, {row[2] - row[0] - row[1]} skipped, {len(chunk) - row[2]} duplicates')
+        res['rejected'] = None
+        if return_rejected:
+            res['rejected'] = pd.concat(rejected, ignore_index=True) if len(rejected) > 0 else pd.DataFrame(columns=keys)
+        return res
 
 
 
@@ -141,12 +906,15 @@ class DB:
 
         try:
             if description is not None:
-                cur.execute(f"""INSERT INTO asset_type_tb ("type", "subtype","description") values ('{asset_type}', '{subtype}', '{description}');""")
+                Instrumentation.execute(cur, """INSERT INTO asset_type_tb ("type", "subtype","description") values (%s, %s, %s);""", (asset_type, subtype, description))
             else:
-                cur.execute(f"""INSERT INTO asset_type_tb ("type", "subtype") values ('{asset_type}', '{subtype}');""")
+                Instrumentation.execute(cur, """INSERT INTO asset_type_tb ("type", "subtype") values (%s, %s);""", (asset_type, subtype))
             db.commit()
         except psycopg2.errors.UniqueViolation:
             print("[INFO] asset_type already exists.")
+            db.rollback()
+        # generate_table_trigger creates the component table
+        SchemaCache.invalidate(db)
         asset_type_df = DB._get_asset_type(asset_type=asset_type, subtype=subtype, id_only=False, db=db)
 
         return asset_type_df
@@ -159,19 +927,22 @@ class DB:
                         subtype: str = None,
                         type_id: int = None,
                         id_only: bool = True,
-                        db: psycopg2.extensions.connection = None) -> int:
+                        db: psycopg2.extensions.connection = None,
+                        registry=None) -> int:
         """
-        returns the asset type id or the asset type as dataframe
+        returns the asset type id or the asset type as dataframe, from <registry> (a Registry) if given
         """
         assert type_id or (asset_type is not None and subtype is not None) is not None, "[ERROR] must supply <asset_type>(str) and <subtype>(str), or <type_id>(int)."
+        if registry is not None:
+            return registry.asset_type(asset_type=asset_type, subtype=subtype, type_id=type_id, id_only=id_only)
         try:
             if type_id is not None:
                 id_only = False
-                statement = f"""select * from asset_type_tb where "id" = {type_id}"""
+                res = DB.execute_prepared('dmf_asset_type_by_id', """select * from asset_type_tb where "id" = $1""", (int(type_id),), db)
             else:
-                statement = f"""select * from asset_type_tb where "type" ilike '%{asset_type}%' and "subtype" ilike '%{subtype}%';"""
+                res = DB.execute_prepared('dmf_asset_type_by_name', """select * from asset_type_tb where "type" ilike $1 and "subtype" ilike $2""",
+                                          (f'%{asset_type}%', f'%{subtype}%'), db)
 
-            res = DB.execute(statement, db)
             if id_only:
                 return int(res.id.values[0])
             else:
@@ -201,6 +972,31 @@ class DB:
         owner, serial_number, and age have default db values so they can be ignored if desired
         process_id, common_name, eol, rul, and units are not required
         """
+        statement, values = DB._asset_insert(type_id, owner, process_id, group_id, serial_number, common_name, age, eol, rul, units)
+        if sandbox:
+            statement = statement % tuple(psycopg2.extensions.adapt(v).getquoted().decode() for v in values)
+            print(statement)
+            return statement
+        else:
+            try:
+                res = DB._get_asset(serial_number=serial_number, db=db)
+                if len(res) > 0:
+                    return res
+                else:
+                    Instrumentation.execute(cur, statement, values)
+                    db.commit()
+            except psycopg2.errors.UniqueViolation:
+                print("[ERROR] asset already exists (serial numbers must be unique).")
+                db.rollback()
+            return DB._get_asset(serial_number=serial_number, db=db)
+
+
+
+    @staticmethod
+    def _asset_insert(type_id, owner, process_id, group_id, serial_number, common_name, age, eol, rul, units) -> (str, list):
+        """
+        the insert statement of _create_asset (with %s placeholders) and its values
+        """
         assert type_id is not None and type(type_id) == int, '[ERROR] must supply <type_id>(int)'
         statement = 'insert into asset_tb("type_id", "group_id"'
         values = [type_id, group_id]
@@ -228,30 +1024,152 @@ class DB:
         if units is not None:
             statement = statement + ',"units"'
             values.append(units)
-        if len(values) == 1:
-            print('here')
-            statement = statement + f""") values ({values[0]});"""
-        else:
-            statement = statement + f""") values {tuple(values)};"""
-        if sandbox:
-            print(statement)
-            return statement
-        else:
+        statement = statement + f""") values ({', '.join(['%s'] * len(values))});"""
+        return statement, values
+
+
+
+    # column casts for the VALUES list of create_assets, NULL literals would otherwise be typed as text
+    _asset_columns = {
+        'type_id': 'int',
+        'group_id': 'int',
+        'process_id': 'int',
+        'owner': 'varchar',
+        'serial_number': 'varchar',
+        'common_name': 'varchar',
+        'age': 'float',
+        'eol': 'float',
+        'rul': 'float',
+        'units': 'varchar',
+    }
+    # columns with a default that a NULL must not override
+    _asset_defaults = {
+        'owner': 'current_user',
+        'age': '0',
+    }
+
+
+
+    @staticmethod
+    def create_assets(df: pd.DataFrame = None,
+                      batch_size: int = 1000,
+                      db: psycopg2.extensions.connection = None,
+                      cur: psycopg2.extensions.cursor = None) -> pd.DataFrame:
+        """
+            @brief: registers many assets with one INSERT ... ON CONFLICT ... RETURNING round trip per batch.
+                    like _create_asset, an asset whose serial_number already exists is returned as is
+            @params:
+                df: one row per asset, type_id is required, any other asset_tb column is optional.
+                    missing or empty serial numbers are generated
+                batch_size: assets per statement (and per transaction)
+                db: the database
+                cur: the cursor
+            @returns: the asset_tb rows in the order of <df>, with created=True for newly inserted assets.
+                      rows that violate another unique constraint are reported and have a null id
+        """
+        assert df is not None and 'type_id' in df.columns, '[ERROR] must supply <df> with at least a <type_id> column'
+        unknown = [col for col in df.columns if col not in DB._asset_columns]
+        assert len(unknown) == 0, f'[ERROR] <df> contains columns that are not in asset_tb: <{unknown}>'
+
+        df = df.copy()
+        if 'serial_number' not in df.columns:
+            df['serial_number'] = None
+        missing = df.serial_number.isnull() | (df.serial_number.astype(str).str.len() == 0)
+        df.loc[missing, 'serial_number'] = [utils.generate_serial_number(8) for _ in range(missing.sum())]
+
+        cols = list(df.columns)
+        names = ', '.join(f'"{col}"' for col in cols)
+        select = ', '.join(f'coalesce("{col}", {DB._asset_defaults[col]})' if col in DB._asset_defaults else f'"{col}"' for col in cols)
+        template = '(' + ', '.join(f'%s::{DB._asset_columns[col]}' for col in cols) + ')'
+        statement = f"""with "input"({names}) as (values %s),
+            "ins" as (insert into asset_tb({names}) select {select} from "input" on conflict do nothing returning *)
+            select "ins".*, true as "created" from "ins"
+            union all
+            select ast.*, false as "created" from asset_tb ast join "input" i on ast."serial_number" = i."serial_number";"""
+
+        frames = []
+        for i, chunk in utils.chunk_generator(df, batch_size):
+            values = chunk.astype(object).where(chunk.notnull(), None).values.tolist()
             try:
-                res = DB._get_asset(serial_number=serial_number, db=db)
-                if len(res) > 0:
-                    return res
-                else:
-                    cur.execute(statement)
+                start = time.perf_counter() if Instrumentation.enabled else None
+                rows = psycopg2.extras.execute_values(cur, statement, values, template=template, page_size=len(values), fetch=True)
+                if start is not None:
+                    Instrumentation.observe(statement, start, rows=len(rows), nbytes=len(cur.query or b''))
+                db.commit()
+                frames.append(pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description]))
+            except Exception as e:
+                print(f"[ERROR] batch starting at row {i} failed: {e}")
+                db.rollback()
+
+        res = pd.concat(frames).drop_duplicates(subset=['serial_number']) if len(frames) > 0 else pd.DataFrame(columns=['serial_number'])
+        res = df[['serial_number']].merge(res, on='serial_number', how='left')
+        not_created = res['id'].isnull().sum() if 'id' in res.columns else len(res)
+        if not_created > 0:
+            print(f"[ERROR] {not_created} assets were not created.")
+        return res
+
+
+
+    @staticmethod
+    def create_components(df: pd.DataFrame = None,
+                          batch_size: int = 1000,
+                          db: psycopg2.extensions.connection = None,
+                          cur: psycopg2.extensions.cursor = None) -> pd.DataFrame:
+        """
+            @brief: registers many components, the bulk version of _create_component. the component table of each row
+                    (<type>_<subtype>_tb) is resolved from its asset in one query, then each table gets one
+                    INSERT ... ON CONFLICT ... RETURNING round trip per batch
+            @params:
+                df: one row per component, <id> (the asset id, assets must be created first) is required, the other
+                    columns (unit, num_samples, misc_info, ...) must exist in the component tables
+                batch_size: components per statement
+                db: the database
+                cur: the cursor
+            @returns: the component rows (new and already existing) with the name of their table in <component_table>
+        """
+        assert df is not None and 'id' in df.columns, '[ERROR] must supply <df> with at least an <id> column'
+        ids = [int(i) for i in pd.unique(df['id'])]
+        types = DB.execute("""select ast."id", att."type", att."subtype" from asset_tb ast
+                              join asset_type_tb att on ast.type_id = att.id where ast."id" = any(%s)""", db, params=(ids,))
+        missing = set(ids) - set(types.id.values.tolist() if len(types) > 0 else [])
+        assert len(missing) == 0, f'[ERROR] assets do not exist: <{sorted(missing)[:10]}>'
+        tables = dict(zip(types.id.values.tolist(), (types.type + '_' + types.subtype + '_tb').values.tolist()))
+
+        frames = []
+        for table_name, group in df.groupby(df['id'].map(lambda i: tables[int(i)])):
+            assert DB.table_exists(table_name, db), f'[ERROR] table <{table_name}> does not exist'
+            field_types = DB.get_field_types(table_name, db=db)
+            cols = list(group.columns)
+            assert all(col in field_types for col in cols), f'[ERROR] target table <{table_name}> does not contain all passed columns <{cols}>'
+            names = ', '.join(f'"{col}"' for col in cols)
+            template = '(' + ', '.join(f'%s::{field_types[col]}' for col in cols) + ')'
+            statement = f"""with "input"({names}) as (values %s),
+                "ins" as (insert into {table_name}({names}) select {names} from "input" on conflict ("id") do nothing returning *)
+                select * from "ins"
+                union all
+                select t.* from {table_name} t join "input" i on t."id" = i."id";"""
+            for i, chunk in utils.chunk_generator(group, batch_size):
+                values = chunk.astype(object).where(chunk.notnull(), None).values.tolist()
+                try:
+                    start = time.perf_counter() if Instrumentation.enabled else None
+                    rows = psycopg2.extras.execute_values(cur, statement, values, template=template, page_size=len(values), fetch=True)
+                    if start is not None:
+                        Instrumentation.observe(statement, start, rows=len(rows), nbytes=len(cur.query or b''))
                     db.commit()
-            except psycopg2.errors.UniqueViolation:
-                print("[ERROR] asset already exists (serial numbers must be unique).")
-            return DB._get_asset(serial_number=serial_number, db=db)
+                    res = pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description])
+                    res['component_table'] = table_name
+                    frames.append(res)
+                except Exception as e:
+                    print(f"[ERROR] {table_name} batch starting at row {i} failed: {e}")
+                    db.rollback()
+        return pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame()
 
 
 
     @staticmethod
-    def get_devices(db):
+    def get_devices(db, registry=None):
+        if registry is not None:
+            return registry.devices()
         query = "select ast.*, irt.unit from asset_tb ast join irel_transistor_tb irt on ast.id = irt.id;"
         res1 = DB.execute(query, db)
 
@@ -263,15 +1181,69 @@ class DB:
     
     
     @staticmethod
-    def get_rounds(db):
+    def get_rounds(db, registry=None):
+        if registry is not None:
+            return registry.rounds()
         query = "select * from group_tb;"
         return DB.execute(query, db)
     
     
     
     @staticmethod
-    def get_device_data(unit, db):
-        query = f"""
+    def get_device_data(unit, db, stream=False, chunksize=100000, cycle_pos=False, cache=None,
+                        resolution=None, max_points=None, shape_preserving=False, typed=False, group_id=None):
+        """
+        returns the data of a device joined with the current of its group, or a generator of
+        chunks of <chunksize> rows if <stream> is set. with <cycle_pos> the data is resampled
+        to 1s and a normalized within-cycle position column is added (see _add_cycle_pos).
+        <group_id> keeps the rows of a single group (round), cached separately from the whole device.
+        with a ParquetCache as <cache> only rows newer than the cached ones are fetched.
+        <resolution> (e.g. '10s') or <max_points> downsample in the database, see _get_device_data_downsampled.
+        <typed> decodes the rows straight into the DB.DTYPES['data_tb'] dtypes
+        """
+        assert not (stream and cycle_pos), '[ERROR] <cycle_pos> needs whole cycles and cannot be used with <stream>'
+        assert not (stream and cache is not None), '[ERROR] <cache> cannot be used with <stream>'
+        if resolution is not None or max_points is not None:
+            assert not cycle_pos and cache is None and group_id is None, '[ERROR] <cycle_pos>, <cache> and <group_id> work on raw samples, not with <resolution> or <max_points>'
+            return DB._get_device_data_downsampled(unit, db, resolution=resolution, max_points=max_points,
+                                                   shape_preserving=shape_preserving, stream=stream, chunksize=chunksize)
+
+        conditions, params = [], [int(unit)]
+        if group_id is not None:
+            conditions.append('and dtt."group_id" = %s')
+            params.append(int(group_id))
+        dtypes = dict(DB.DTYPES['data_tb'], current=np.float64) if typed else None
+        if cache is not None:
+            cached, hwm = cache.read('device_data', unit, group_id=group_id)
+            print(f"getting data for asset {unit}" + ('' if hwm is None else f" newer than {hwm}"))
+            if hwm is not None:
+                conditions.append('and dtt."dt" > %s')
+                params.append(hwm.to_pydatetime())
+            df = DB.execute(DB._device_data_query.format(' '.join(conditions)), db, params=tuple(params), dtypes=dtypes)
+            df = DB._process_device_data(df)
+            cache.append('device_data', unit, df, group_id=group_id)
+            if cached is not None:
+                df = pd.concat([cached, df]) if len(df) > 0 else cached
+            if cycle_pos:
+                df = DB._add_cycle_pos(df)
+            return df
+        query = DB._device_data_query.format(' '.join(conditions))
+        if stream:
+            print(f"streaming data for asset {unit}")
+            return (DB._process_device_data(df) for df in DB.stream(query, db, chunksize=chunksize, params=tuple(params), dtypes=dtypes))
+        print(f"getting data for asset {unit}")
+        df = DB.execute(query, db, params=tuple(params), dtypes=dtypes)
+        print(f"processing asset {unit}")
+        df = DB._process_device_data(df)
+        if cycle_pos:
+            print(f"creating cycle pos column for asset {unit}")
+            df = DB._add_cycle_pos(df)
+        
+        return df
+
+
+
+    _device_data_query = """
             select dtt."asset_id", 
                    dtt."group_id",
                    dtt."dt", 
@@ -282,11 +1254,116 @@ class DB:
                    gtt."current" 
             from data_tb dtt 
             join group_tb gtt on dtt.group_id = gtt.id
-            where dtt.asset_id = {unit} order by dtt."dt";
+            where dtt.asset_id = %s {} order by dtt."dt";
+        """
+
+
+
+    @staticmethod
+    def _get_device_data_downsampled(unit: int,
+                                     db: psycopg2.extensions.connection,
+                                     resolution: str = None,
+                                     max_points: int = None,
+                                     shape_preserving: bool = False,
+                                     lttb_oversample: int = 4,
+                                     stream: bool = False,
+                                     chunksize: int = 100000) -> pd.DataFrame:
+        """
+            @brief: get_device_data aggregated into time buckets in the database (time_bucket on timescaledb,
+                    date_trunc or epoch arithmetic otherwise), so transfer scales with the requested resolution
+                    instead of the number of raw samples
+            @params:
+                unit: the asset id
+                db: the database
+                resolution: bucket width as a pandas offset string ('1s', '10min', ...)
+                max_points: the number of points wanted over the whole series, the bucket width is derived from the
+                            time span of the unit (ignored if <resolution> is given)
+                shape_preserving: buckets at <lttb_oversample> * <max_points> and then keeps <max_points> of them with
+                                  largest-triangle-three-buckets on the voltage, which keeps peaks for plotting
+                stream: yield chunks of <chunksize> buckets (not with shape_preserving)
+            @returns: one row per bucket with mean cycle (rounded), temperature and voltage, the max status and the
+                      number of raw samples <n>, indexed by the bucket start
+        """
+        assert resolution is not None or max_points is not None, '[ERROR] must supply <resolution>(str) or <max_points>(int)'
+        assert not shape_preserving or max_points is not None, '[ERROR] <shape_preserving> requires <max_points>'
+        assert not (shape_preserving and stream), '[ERROR] <shape_preserving> cannot be used with <stream>'
+
+        if resolution is not None:
+            seconds = pd.Timedelta(resolution).total_seconds()
+        else:
+            span = DB.execute("""select extract(epoch from max("dt") - min("dt")) as "span" from data_tb where asset_id = %s""", db, params=(int(unit),))
+            if len(span) == 0 or pd.isnull(span.span.values[0]):
+                return DB._process_device_data(pd.DataFrame(columns=['asset_id', 'group_id', 'dt', 'cycle', 'temperature', 'status', 'voltage', 'current', 'n']))
+            points = max_points * lttb_oversample if shape_preserving else max_points
+            seconds = max(float(span.span.values[0]) / points, 0.001)
+        assert seconds > 0, '[ERROR] <resolution> must be positive'
+
+        truncate = {1: 'second', 60: 'minute', 3600: 'hour', 86400: 'day'}
+        if DB.has_extension('timescaledb', db):
+            bucket, params = """time_bucket(%s, dtt."dt")""", [datetime.timedelta(seconds=seconds)]
+        elif seconds in truncate:
+            bucket, params = f"""date_trunc('{truncate[seconds]}', dtt."dt")""", []
+        else:
+            bucket, params = """to_timestamp(floor(extract(epoch from dtt."dt") / %s) * %s) at time zone 'UTC'""", [seconds, seconds]
+        query = f"""
+            select dtt."asset_id",
+                   dtt."group_id",
+                   {bucket} as "dt",
+                   round(avg(dtt."cycle"))::int as "cycle",
+                   avg(dtt."temperature") as "temperature",
+                   max(dtt."status") as "status",
+                   avg(case when dtt."status" = 0 then 0 else dtt."voltage" end) as "voltage",
+                   gtt."current",
+                   count(*) as "n"
+            from data_tb dtt
+            join group_tb gtt on dtt.group_id = gtt.id
+            where dtt.asset_id = %s
+            group by dtt."asset_id", dtt."group_id", gtt."current", 3
+            order by 3;
+        """
+        params = tuple(params + [int(unit)])
+        if stream:
+            return (DB._process_device_data(df) for df in DB.stream(query, db, chunksize=chunksize, params=params))
+        print(f"getting data for asset {unit} at {seconds}s resolution")
+        df = DB._process_device_data(DB.execute(query, db, params=params))
+        if shape_preserving and len(df) > max_points:
+            x = (df.index.values - df.index.values[0]).astype('timedelta64[ms]').astype(np.float64)
+            df = df.iloc[utils.lttb(x, df.voltage.values.astype(np.float64), max_points)]
+        return df
+
+
+
+    @staticmethod
+    def _add_cycle_pos(df: pd.DataFrame) -> pd.DataFrame:
+        """
+            @brief: resamples each (current, asset) series to 1s means, rounds the cycle and adds
+                    cycle_pos = index of the sample within its cycle / number of samples in the cycle.
+                    single groupby pass, equivalent to looping over currents, assets and cycles
+            @params:
+                df: device data indexed by dt (as returned by get_device_data)
+            @returns: the resampled data with a cycle_pos column, ordered by current, asset and dt
+        """
+        df = df[df['current'].notna()]
+        # order series like the nested loops did: currents by first appearance, then assets by first appearance
+        current_key = pd.factorize(df['current'])[0]
+        series_key = df.groupby(['current', 'asset_id'], sort=False).ngroup().values
+        res = df.groupby([current_key, series_key, df.index.floor('1s')]).mean().dropna()
+        series_key = res.index.get_level_values(1)
+        res.index = res.index.get_level_values(2).rename(df.index.name)
+
+        res['cycle'] = np.round(res['cycle'])
+        by_cycle = res.groupby([series_key, res['cycle'].values], sort=False)
+        res['cycle_pos'] = by_cycle.cumcount().values / by_cycle['cycle'].transform('size').values
+        return res
+
+    
+    
+    
+    @staticmethod
+    def _process_device_data(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        indexes device data by dt and downcasts it
         """
-        print(f"getting data for asset {unit}")
-        df = DB.execute(query, db)
-        print(f"processing asset {unit}")
         df.sort_values(by=['asset_id', 'dt', 'cycle'], inplace=True)
         df.index = df['dt']
         df.drop(columns=['dt'], inplace=True)
@@ -295,33 +1372,33 @@ class DB:
         df.temperature = df.temperature.astype(np.float32)
         df.voltage = df.voltage.astype(np.float32)
         df.loc[df.status == 0, 'voltage'] = 0
-        
         return df
-        
-        print(f"creating cycle pos column for asset {asset_id}")
-        new_df = pd.DataFrame()
-        for group in pd.unique(df.current):
-            group_df = df[df['current'] == group]
-            for asset in pd.unique(group_df.asset_id):
-                _df = pd.DataFrame()
-                #print(group, asset)
-                _df = group_df[group_df['asset_id'] == asset]
-                _df = _df.resample('1s').mean().dropna()
-                _df.cycle = _df.cycle.apply(np.round)
-                _df['cycle_pos'] = 0
-                for cycle in pd.unique(_df.cycle):
-                    num_samples = len(_df[_df.cycle == cycle])
-                    _df.loc[_df.cycle == cycle, 'cycle_pos'] = np.arange(0, num_samples)/num_samples
-                new_df = new_df.append(_df)
-
-        return new_df
 
     
     
     
     @staticmethod
-    def get_unit_stats(unit, downsample, voltage_cutoff, db):
-        query = f"""select asset_id, "cycle",
+    def get_unit_stats(unit, downsample, voltage_cutoff, db, use_aggregate=True, max_staleness=3600):
+        """
+        returns the per cycle voltage and temperature statistics of a unit. reads the pre-aggregated
+        cycle_stats_vw (sql/irel_cycle_stats*.sql) when <use_aggregate> is set, the view exists, it was
+        refreshed within <max_staleness> seconds and <voltage_cutoff> is a multiple of its band width.
+        otherwise the statistics are computed from data_tb
+        """
+        band = DB._cycle_stats_band(voltage_cutoff, max_staleness, db) if use_aggregate else None
+        if band is not None:
+            return DB._get_unit_stats_aggregate(unit, downsample, band, db)
+        query, params = DB._unit_stats_query(unit, downsample, voltage_cutoff)
+        return DB.execute(query, db, params=params)
+
+
+
+    @staticmethod
+    def _unit_stats_query(unit: int, downsample: int, voltage_cutoff: float) -> (str, tuple):
+        """
+        the get_unit_stats query over data_tb and its parameters
+        """
+        query = """select asset_id, "cycle",
                 round(avg(voltage)::numeric, 2) as "mean_voltage",
                 round(avg(temperature)::numeric, 2) as "mean_temperature",
                 round(stddev(voltage)::numeric,2) as "std_voltage",
@@ -331,26 +1408,258 @@ class DB:
                 round(max(voltage)::numeric,2) as "max_voltage",
                 round(max(temperature)::numeric,2) as "max_temperature"
                 from data_tb
-                where voltage > {voltage_cutoff}
-                and asset_id = {unit} """
+                where voltage > %s
+                and asset_id = %s """
+        params = [float(voltage_cutoff), int(unit)]
         if downsample > 1:
-            query = query + f"""and "cycle" % {downsample} = 0 """
+            query = query + """and "cycle" %% %s = 0 """
+            params.append(int(downsample))
         query = query + """group by ("cycle", "asset_id") order by ("cycle", "asset_id");"""
-        df = DB.execute(query, db)
+        return query, tuple(params)
+
+
+
+    # refresh state of cycle_stats_vw, the age is in seconds
+    _cycle_stats_meta_query = """select "kind", "band_width", extract(epoch from now() - "refreshed_at") as "age"
+                                 from cycle_stats_meta_tb where "view_name" = 'cycle_stats_vw'"""
+
+    @staticmethod
+    def _cycle_stats_band(voltage_cutoff: float, max_staleness: float, db: psycopg2.extensions.connection) -> int:
+        """
+        returns the first voltage band of cycle_stats_vw above <voltage_cutoff>, or None if the view cannot answer
+        (missing, stale, or a cutoff that falls inside a band)
+        """
+        # the cached table list, so a database without the aggregate is not asked again on every call
+        # (table_exists refreshes on a miss). the sql/irel_cycle_stats*.sql scripts announce it on dmf_schema
+        if 'cycle_stats_meta_tb' not in DB.get_tables(db).values:
+            return None
+        meta = DB.execute_prepared('dmf_cycle_stats_meta', DB._cycle_stats_meta_query, (), db)
+        return DB._band_of(meta, voltage_cutoff, max_staleness)
+
+
+
+    @staticmethod
+    def _band_of(meta: pd.DataFrame, voltage_cutoff: float, max_staleness: float) -> int:
+        """
+        the band for <voltage_cutoff> given the cycle_stats_meta_tb row <meta>, or None
+        """
+        if len(meta) == 0:
+            return None
+        kind, band_width, age = meta.values[0]
+        if kind != 'continuous' and (age is None or float(age) > max_staleness):
+            return None
+        band = float(voltage_cutoff) / band_width
+        if abs(band - round(band)) > 1e-9:
+            return None
+        return int(round(band))
+
+
+
+    @staticmethod
+    def _get_unit_stats_aggregate(unit: int, downsample: int, band: int, db: psycopg2.extensions.connection) -> pd.DataFrame:
+        """
+        get_unit_stats from the partial aggregates in cycle_stats_vw, merging voltage bands (and time buckets)
+        """
+        query, params = DB._unit_stats_aggregate_query(unit, downsample, band)
+        return DB.execute(query, db, params=params)
+
+
+
+    @staticmethod
+    def _unit_stats_aggregate_query(unit: int, downsample: int, band: int) -> (str, tuple):
+        """
+        the get_unit_stats query over cycle_stats_vw and its parameters
+        """
+        var = lambda col: f"""(sum("sumsq_{col}") - sum("sum_{col}") ^ 2 / sum("n_{col}")) / (sum("n_{col}") - 1)"""
+        std = lambda col: f"""round((case when sum("n_{col}") > 1 then sqrt(greatest({var(col)}, 0)) end)::numeric, 2)"""
+        query = f"""select asset_id, "cycle",
+                round((sum("sum_voltage") / nullif(sum("n_voltage"), 0))::numeric, 2) as "mean_voltage",
+                round((sum("sum_temperature") / nullif(sum("n_temperature"), 0))::numeric, 2) as "mean_temperature",
+                {std('voltage')} as "std_voltage",
+                {std('temperature')} as "std_temperature",
+                round(min("min_voltage")::numeric,2) as "min_voltage",
+                round(min("min_temperature")::numeric,2) as "min_temperature",
+                round(max("max_voltage")::numeric,2) as "max_voltage",
+                round(max("max_temperature")::numeric,2) as "max_temperature"
+                from cycle_stats_vw
+                where "vband" >= %s
+                and asset_id = %s """
+        params = [band, int(unit)]
+        if downsample > 1:
+            query = query + """and "cycle" %% %s = 0 """
+            params.append(int(downsample))
+        query = query + """group by ("cycle", "asset_id") order by ("cycle", "asset_id");"""
+        return query, tuple(params)
+
+
+
+    @staticmethod
+    def refresh_cycle_stats(db: psycopg2.extensions.connection = None) -> None:
+        """
+        refreshes cycle_stats_vw, a full refresh for the continuous aggregate or refresh_cycle_stats() for the materialized view.
+        the refresh runs in autocommit (refresh_continuous_aggregate cannot run inside a transaction block), so <db> must not
+        have a transaction open, it is not committed for the caller
+        """
+        if db.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raise RuntimeError('[ERROR] refresh_cycle_stats needs an idle connection, commit or roll back the open transaction first')
+        autocommit = db.autocommit
+        db.autocommit = True
+        try:
+            kind = DB.execute("""select "kind" from cycle_stats_meta_tb where "view_name" = 'cycle_stats_vw'""", db)
+            assert len(kind) > 0, '[ERROR] cycle_stats_vw is not installed, see sql/irel_cycle_stats.sql'
+            with db.cursor() as cur:
+                if kind.kind.values[0] == 'continuous':
+                    cur.execute("""call refresh_continuous_aggregate('cycle_stats_vw', null, null);""")
+                    cur.execute("""update cycle_stats_meta_tb set "refreshed_at" = now() where "view_name" = 'cycle_stats_vw';""")
+                else:
+                    cur.execute("""select refresh_cycle_stats();""")
+        finally:
+            db.autocommit = autocommit
+
+
+
+
+    @staticmethod
+    def fetch_many(units: list = None,
+                   fn: str = 'get_device_data',
+                   pool: ConnectionPool = None,
+                   params: dict = None,
+                   workers: int = 4,
+                   executor: str = 'thread',
+                   as_iterator: bool = False,
+                   **kwargs):
+        """
+            @brief: runs a per unit DB method for many units concurrently, each call on its own connection
+            @params:
+                units: the asset ids to fetch
+                fn: name of the DB method, called as fn(unit, db=<connection>, **kwargs)
+                pool: connection pool used by the thread executor (a temporary one is created from <params> if None)
+                params: dictionary of db connection parameters, required for the process executor
+                workers: number of concurrent units
+                executor: 'thread' (shares <pool>) or 'process' (one connection per worker process,
+                          useful when the per unit post processing is cpu bound)
+                as_iterator: yield (unit, result, error) tuples as units complete instead of concatenating
+                kwargs: passed through to <fn>
+            @returns: the concatenated results of all units that succeeded, failed units are printed and listed
+                      in df.attrs['errors'], or a generator of (unit, result, error) if <as_iterator>
+        """
+        assert units is not None and len(units) > 0, '[ERROR] must supply <units>(list)'
+        assert callable(getattr(DB, fn, None)), f'[ERROR] <fn> must name a DB method, got <{fn}>'
+        assert executor in ['thread', 'process'], '[ERROR] <executor> must be "thread" or "process"'
+        assert pool is not None or params is not None, '[ERROR] must supply <pool> or <params>'
+        assert executor == 'thread' or params is not None, '[ERROR] the process executor requires <params>'
+
+        results = DB._fetch_many(units, fn, pool, params, workers, executor, kwargs)
+        if as_iterator:
+            return results
+
+        frames, errors = [], {}
+        for unit, res, err in results:
+            if err is not None:
+                print(f"[ERROR] unit {unit} failed: {err}")
+                errors[unit] = repr(err)
+            else:
+                frames.append(res)
+        df = pd.concat(frames) if len(frames) > 0 else pd.DataFrame()
+        df.attrs['errors'] = errors
         return df
 
+
+
+    @staticmethod
+    def _fetch_many(units, fn, pool, params, workers, executor, kwargs):
+        """
+        generator behind fetch_many, owns the executor (and temporary pool) for its lifetime
+        """
+        own_pool = executor == 'thread' and pool is None
+        if own_pool:
+            pool = ConnectionPool(params, minconn=0, maxconn=workers)
+        if executor == 'thread':
+            ex = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            futures = {ex.submit(DB._fetch_pooled, pool, fn, unit, kwargs): unit for unit in units}
+        else:
+            ex = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=DB._init_fetch_worker, initargs=(params,))
+            futures = {ex.submit(DB._fetch_in_worker, fn, unit, kwargs): unit for unit in units}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+        finally:
+            ex.shutdown(wait=True, cancel_futures=True)
+            if own_pool:
+                pool.close()
+
+
+
+    @staticmethod
+    def _fetch_pooled(pool, fn, unit, kwargs):
+        with pool.session() as session:
+            return getattr(session, fn)(unit, **kwargs)
+
+
+
+    # connection of a fetch_many worker process, opened once by the pool initializer
+    _worker_db = None
+
+
+
+    @staticmethod
+    def _init_fetch_worker(params):
+        DB._worker_db = psycopg2.connect(**params)
+
+
+
+    @staticmethod
+    def _fetch_in_worker(fn, unit, kwargs):
+        try:
+            return getattr(DB, fn)(unit, db=DB._worker_db, **kwargs)
+        finally:
+            DB._worker_db.rollback()
+
+
+
+
+    @staticmethod
+    def get_device_data_many(units, pool=None, params=None, workers=4, as_iterator=False, **kwargs):
+        """
+        fetch_many for get_device_data, returns one frame of every unit's data
+        """
+        return DB.fetch_many(units, fn='get_device_data', pool=pool, params=params, workers=workers,
+                             as_iterator=as_iterator, **kwargs)
+
+
+
+    @staticmethod
+    def get_unit_stats_many(units, downsample, voltage_cutoff, pool=None, params=None, workers=4, as_iterator=False):
+        """
+        fetch_many for get_unit_stats, returns one frame of every unit's per cycle stats
+        """
+        return DB.fetch_many(units, fn='get_unit_stats', pool=pool, params=params, workers=workers,
+                             as_iterator=as_iterator, downsample=downsample, voltage_cutoff=voltage_cutoff)
+
     
     
     
     
-    def get_round_data(group_id, db, include_cooling_block=False):
-        group_id = 2
-        query1 = f"""select * from data_tb where group_id = {group_id} order by (asset_id, dt);"""
-        res1 = DB.execute(query1, db)
+    def get_round_data(group_id, db, include_cooling_block=False, stream=False, chunksize=100000, typed=False):
+        """
+        returns the data of a round (group), with <stream> set the tables are generators of chunks
+        of <chunksize> rows. when streaming both tables, each generator uses its own server side cursor.
+        <typed> decodes the rows straight into the DB.DTYPES dtypes of each table
+        """
+        def read(q, tb):
+            dtypes = DB.DTYPES[tb] if typed else None
+            if stream:
+                return DB.stream(q, db, chunksize=chunksize, params=(int(group_id),), dtypes=dtypes)
+            return DB.execute(q, db, params=(int(group_id),), dtypes=dtypes)
+        query1 = """select * from data_tb where group_id = %s order by (asset_id, dt);"""
+        res1 = read(query1, 'data_tb')
         
         if include_cooling_block:
-            query2 = f"""select * from cb_data_tb where group_id = {group_id};"""
-            res2 = DB.execute(query2, db)
+            query2 = """select * from cb_data_tb where group_id = %s;"""
+            res2 = read(query2, 'cb_data_tb')
             return res1, res2
         else:
             return res1
@@ -364,17 +1673,19 @@ class DB:
     @staticmethod
     def _get_asset(serial_number: str = None,
                    id: int = None,
-                   db: psycopg2.extensions.connection = None):
+                   db: psycopg2.extensions.connection = None,
+                   registry=None):
         """
-        returns the asset as a dataframe
+        returns the asset as a dataframe, from <registry> (a Registry) if given
         """
         assert serial_number is not None or id is not None, '[ERROR] must supply <serial_number>(str) or <id>(int)'
+        if registry is not None:
+            return registry.asset(serial_number=serial_number, id=id)
         assert db is not None, '[ERROR] must pass <db>(psycopg2.extensions.connection)'
         if serial_number is not None:
-            statement = f"""select * from asset_tb where "serial_number" = '{serial_number}';"""
+            return DB.execute_prepared('dmf_asset_by_serial', """select * from asset_tb where "serial_number" = $1""", (serial_number,), db)
         else:
-            statement = f"""select * from asset_tb where "id" = {id};"""
-        return DB.execute(statement, db)
+            return DB.execute_prepared('dmf_asset_by_id', """select * from asset_tb where "id" = $1""", (int(id),), db)
 
 
 
@@ -390,22 +1701,26 @@ class DB:
         creates a component in the db, the asset must be created first
         """
         assert asset is not None and unit is not None, '[ERROR] must supply all parameters'
-        asset_type = DB._get_asset_type(type_id=asset.type_id.values[0], db=db)
+        asset_type = DB._get_asset_type(type_id=int(asset.type_id.values[0]), db=db)
         assert len(asset_type) > 0, f'[ERROR] a valid asset type was not found with id <{asset.type_id.values[0]}>'
 
         table_name = f"{asset_type.type.values[0]}_{asset_type.subtype.values[0]}_tb"
         assert DB.table_exists(table_name, db), f'[ERROR] table <{table_name}> does not exist'
+        asset_id = int(asset.id.values[0])
         if num_samples == None and misc_info == None:
-            statement = f"""insert into {table_name}("id", "unit") values ({asset.id.values[0]}, {unit});"""
+            statement = f"""insert into {table_name}("id", "unit") values (%s, %s);"""
+            values = (asset_id, unit)
         else:
-            statement = f"""insert into {table_name}("id", "unit", "num_samples", "misc_info") values ({asset.id.values[0]}, {unit}, {num_samples}, '{misc_info}');"""
+            statement = f"""insert into {table_name}("id", "unit", "num_samples", "misc_info") values (%s, %s, %s, %s);"""
+            values = (asset_id, unit, num_samples, misc_info)
         try:
-            cur.execute(statement)
+            Instrumentation.execute(cur, statement, values)
             db.commit()
         except Exception as e:
             print(e)
+            db.rollback()
 
-        return DB.execute(f"""select * from {table_name} where "id" = {asset.id.values[0]}""", db)
+        return DB.execute(f"""select * from {table_name} where "id" = %s""", db, params=(asset_id,))
 
 
 
@@ -415,76 +1730,34 @@ class DB:
                    datasets: [] = None,
                    order_by: str = 'id',
                    db: psycopg2.extensions.connection = None):
+        """
+        returns the n-cmapss units (asset_tb joined with engine_ncmapss_tb) of the given groups, flight classes
+        and datasets (['all'] or None for every dataset), ordered by id, age or rul
+        """
         valid_order_by = [
             'id',
             'age',
             'rul'
         ]
-        statement = """select ast."id", 
-        ast."serial_number", 
-        ast."age", 
-        ast."eol",  
-        ast."rul", 
-        ent."group_id", 
-        ent."Fc", 
-        ent."unit", 
-        ent."dataset" 
-        from asset_tb ast 
-        join engine_ncmapss_tb ent 
-        on ast.id = ent.id """
         assert isinstance(group_id, list) or isinstance(group_id, type(None)), '[ERROR] pass arguments as lists'
         assert isinstance(Fc, list) or isinstance(Fc, type(None)), '[ERROR] pass arguments as lists'
         assert isinstance(datasets, list) or isinstance(datasets, type(None)), '[ERROR] pass dataset as a list'
         assert order_by in valid_order_by, f'[ERROR] <order_by> bust be in {valid_order_by}'
 
-        if group_id is not None:
-            if len(group_id) > 1:
-                group_id = tuple(group_id)
-            elif len(group_id) == 1:
-                group_id = f'({group_id[0]})'
-
-        if Fc is not None:
-            if len(Fc) > 1:
-                Fc = tuple(Fc)
-            elif len(Fc) == 1:
-                Fc = f'({Fc[0]})'
-
-        if datasets is not None:
-            if datasets[0] == 'all':
-                datasets = tuple(valid_datasets)
-            elif len(datasets) > 1:
-                datasets = tuple(datasets)
-            elif len(datasets) == 1:
-                datasets = f"('{datasets[0]}')"
-
-        clause = ''
-        if group_id is not None:
-            clause = f'where ent."group_id" in {group_id} '
-
-        if Fc is not None:
-            if group_id is not None:
-                clause = clause + f'and ent."Fc" in {Fc} '
-            else:
-                clause = f'where ent."Fc" in {Fc} '
-
+        if datasets is not None and datasets[0] == 'all':
+            datasets = None
         if datasets is not None:
-            if isinstance(datasets, tuple):
-                for ds in datasets:
-                    assert (any(ds in sub for sub in valid_datasets)), f'[ERROR] valid dataset was not supplied. valid datasets are {valid_datasets}'
-            elif isinstance(datasets, str):
-                assert eval(datasets) in valid_datasets, f'[ERROR] valid dataset was not supplied. valid datasets are {valid_datasets}'
-            if group_id is not None or Fc is not None:
-                clause = clause + f'and ent."dataset" in {datasets} '
-            else:
-                clause = f'where ent."dataset" in {datasets} '
-
-        statement = statement + clause
-        statement = statement + f'order by ast."{order_by}" asc;'
-
-        return DB.execute(statement, db)
-
-
+            valid_datasets = DB.execute("""select distinct "dataset" from engine_ncmapss_tb;""", db).dataset.tolist()
+            assert all(ds in valid_datasets for ds in datasets), f'[ERROR] valid dataset was not supplied. valid datasets are {valid_datasets}'
 
+        query = (Query('asset_tb', 'ast')
+                 .join('engine_ncmapss_tb', 'ent', on='ast."id" = ent."id"')
+                 .select(['ast.id', 'ast.serial_number', 'ast.age', 'ast.eol', 'ast.rul', 'ent.group_id', 'ent.Fc', 'ent.unit', 'ent.dataset'])
+                 .where_in('ent.group_id', group_id)
+                 .where_in('ent.Fc', Fc)
+                 .where_in('ent.dataset', datasets)
+                 .order_by(f'ast.{order_by} asc'))
+        return query.execute(db)
 
 
 
@@ -497,17 +1770,57 @@ class DB:
                   cycle_start: int = None,
                   cycle_stop: int = None,
                   drop_cols: [] = None,
-                  db: psycopg2.extensions.connection = None) -> pd.DataFrame:
-        valid_units = DB.execute("select id from asset_tb;", db).values
-
-        assert units is None or all(unit in valid_units for unit in units), '[ERROR], either do not pass a value for <units> or ensure all values passed are valid'
-
-
-        statement = f"""select * from {table} where asset_id = {units[0]} order by id asc;"""
-        if drop_cols is None:
-            return DB.execute(statement, db)
-        else:
-            return DB.execute(statement, db).drop(columns=drop_cols)
+                  db: psycopg2.extensions.connection = None,
+                  stream: bool = False,
+                  chunksize: int = 100000,
+                  cache=None,
+                  typed: bool = False,
+                  group_id: int = None) -> pd.DataFrame:
+        """
+            @brief: reads rows of a data table, every filter is part of the statement (see query.Query)
+            @params:
+                units: asset ids, None for every asset
+                limit: maximum number of rows
+                table: the data table
+                date_start, date_stop: date_start <= dt < date_stop
+                cycle_start, cycle_stop: cycle_start <= cycle <= cycle_stop
+                drop_cols: columns not to select
+                db: the database
+                stream: return a generator of chunks of <chunksize> rows
+                cache: a ParquetCache, only rows newer than the cached ones of the unit are read (a single unit
+                       without filters or limit other than <group_id>)
+                typed: decode into the DB.DTYPES dtypes of <table>
+                group_id: only the rows of this group (round), for tables with a group_id column
+            @returns: the rows ordered by dt (by asset_id, dt for several units)
+        """
+        assert table is not None, '[ERROR] must supply the data <table>'
+        assert units is None or DB._valid_asset_ids(units, db), '[ERROR], either do not pass a value for <units> or ensure all values passed are valid'
+        assert not (stream and cache is not None), '[ERROR] <cache> cannot be used with <stream>'
+
+        query = (Query(table)
+                 .where_in('asset_id', units)
+                 .where_in('group_id', group_id)
+                 .between('dt', date_start, date_stop, inclusive=False)
+                 .between('cycle', cycle_start, cycle_stop)
+                 .order_by(*(['dt'] if units is not None and len(units) == 1 else ['asset_id', 'dt']))
+                 .limit(limit))
+        dtypes = DB.DTYPES.get(table, {}) if typed else None
+        if cache is not None:
+            assert units is not None and len(units) == 1 and limit is None and date_start is None and date_stop is None \
+                and cycle_start is None and cycle_stop is None, '[ERROR] <cache> reads whole units, pass a single unit without filters or limit'
+            # the cache holds whole rows, columns are dropped after reading it
+            cached, hwm = cache.read(table, units[0], group_id=group_id)
+            if hwm is not None:
+                query.where('dt', '>', hwm.to_pydatetime())
+            df = query.execute(db, dtypes=dtypes)
+            cache.append(table, units[0], df, group_id=group_id)
+            if cached is not None:
+                df = pd.concat([cached, df], ignore_index=True) if len(df) > 0 else cached
+            return df if drop_cols is None else df.drop(columns=drop_cols)
+        query.drop(drop_cols)
+        if stream:
+            return query.stream(db, chunksize=chunksize, dtypes=dtypes)
+        return query.execute(db, dtypes=dtypes)
 
 
 
@@ -518,11 +1831,11 @@ class DB:
                       db: psycopg2.extensions.connection = None,
                       cur: psycopg2.extensions.cursor = None):
         
-        statement = f"""insert into group_tb ("group", "current", "num_devices", "info") values('{group}', {current}, {num_devices}, '{info}');"""
+        statement = """insert into group_tb ("group", "current", "num_devices", "info") values(%s, %s, %s, %s);"""
         try:
-            cur.execute(statement)
+            Instrumentation.execute(cur, statement, (group, current, num_devices, info))
             db.commit()
         except Exception as e:
             print(e)
             db.rollback()
-        return DB.execute(f"""select * from group_tb where "group" = '{group}'""", db)
+        return DB.execute("""select * from group_tb where "group" = %s""", db, params=(group,))
@@ -0,0 +1,390 @@
+import contextlib
+import itertools
+import re
+import asyncpg
+import pandas as pd
+try:
+    from package.api import DB
+except:
+    from api import DB
+
+
+class AsyncDB:
+    """
+    asyncio counterpart of DB on asyncpg. every method takes <db> as either an asyncpg pool or a
+    single connection and returns the same pandas tables as its DB namesake, e.g.
+
+        pool = await AsyncDB.create_pool(params, minconn=2, maxconn=20)
+        frames = await asyncio.gather(*(AsyncDB.get_device_data(unit, pool) for unit in units))
+
+    with a pool each call checks out its own connection, so concurrent calls run concurrently.
+    a single connection runs one statement at a time (asyncpg raises InterfaceError otherwise).
+    queries are written with $1, $2, ... placeholders, see AsyncDB.numbered for DB style %s queries.
+    """
+
+    @staticmethod
+    def _params(params: dict) -> dict:
+        """
+        DB.connect parameters to asyncpg ones (dbname -> database)
+        """
+        res = dict(params)
+        if 'dbname' in res:
+            res['database'] = res.pop('dbname')
+        if 'port' in res:
+            res['port'] = int(res['port'])
+        return res
+
+
+
+    @staticmethod
+    async def connect(params: dict) -> asyncpg.Connection:
+        """
+            @brief: connects to the database
+            @params:
+                params: dictionary of db connection parameters (as in DB.connect)
+            @returns: the connection
+        """
+        print("[INFO] connecting to db.")
+        db = await asyncpg.connect(**AsyncDB._params(params))
+        print("[INFO] connected.")
+        return db
+
+
+
+    @staticmethod
+    async def create_pool(params: dict,
+                          minconn: int = 1,
+                          maxconn: int = 10,
+                          timeout: float = 30.0) -> asyncpg.Pool:
+        """
+            @brief: creates an asyncpg connection pool
+            @params:
+                params: dictionary of db connection parameters (as in DB.connect)
+                minconn: connections opened up front
+                maxconn: maximum number of open connections, further checkouts wait
+                timeout: seconds a statement may run before it is cancelled
+            @returns: the pool, close it with "await pool.close()"
+        """
+        print("[INFO] creating connection pool.")
+        return await asyncpg.create_pool(min_size=minconn, max_size=maxconn, command_timeout=timeout,
+                                         **AsyncDB._params(params))
+
+
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def _connection(db):
+        """
+        yields a connection, checked out of <db> if it is a pool
+        """
+        assert db is not None, '[ERROR] must pass <db>(asyncpg.Pool or asyncpg.Connection)'
+        if isinstance(db, asyncpg.Pool):
+            async with db.acquire() as con:
+                yield con
+        else:
+            yield db
+
+
+
+    @staticmethod
+    def numbered(sql_query: str) -> str:
+        """
+        rewrites the %s placeholders of a DB style query as $1, $2, ... and %% as %
+        """
+        n = itertools.count(1)
+        return '%'.join(re.sub(r'%s', lambda m: f'${next(n)}', part) for part in sql_query.split('%%'))
+
+
+
+    @staticmethod
+    def _frame(rows: list, columns: list) -> pd.DataFrame:
+        """
+        builds the table like pandas.read_sql_query does, numeric (Decimal) values are coerced to float
+        """
+        return pd.DataFrame.from_records([tuple(r) for r in rows], columns=columns, coerce_float=True)
+
+
+
+    @staticmethod
+    async def execute(sql_query: str,
+                      db,
+                      params: tuple = ()) -> pd.DataFrame:
+        """
+            @brief: shorthand sql style execution, preferred method for select statements
+            @params:
+                sql_query: the query string to execute, values bound with $1, $2, ... placeholders
+                db: the pool or connection to execute on
+                params: the values bound to the placeholders
+            @returns: a pandas table of the query results (empty on error, as DB.execute)
+        """
+        try:
+            async with AsyncDB._connection(db) as con:
+                # fetch goes through the connection's statement cache (prepare does not), so a repeated
+                # query is parsed once per connection
+                rows = await con.fetch(sql_query, *params)
+                if len(rows) > 0:
+                    columns = list(rows[0].keys())
+                else:
+                    # an empty result has no record to read the column names from
+                    columns = [a.name for a in (await con.prepare(sql_query)).get_attributes()]
+                return AsyncDB._frame(rows, columns)
+        except Exception as e:
+            print(f"[ERROR] {e}")
+            return pd.DataFrame()
+
+
+
+    @staticmethod
+    async def get_tables(db) -> pd.Series:
+        res = await AsyncDB.execute("""SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';""", db)
+        return res.table_name
+
+
+
+    @staticmethod
+    async def get_fields(tb: str = None, db=None) -> list:
+        """
+        returns the columns of <tb> in table order
+        """
+        assert tb is not None, '[ERROR] must supply the name of the table (tb=__)'
+        res = await AsyncDB.execute("""SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS WHERE table_name = $1 ORDER BY ordinal_position;""",
+                                    db, (tb,))
+        return res.column_name.tolist()
+
+
+
+    @staticmethod
+    async def batch_insert(df: pd.DataFrame = None,
+                           tb: str = '',
+                           num_batches: int = 10,
+                           db=None,
+                           verbose: bool = False) -> int:
+        """
+        inserts <df> into <tb> in <num_batches> binary COPY batches, each in its own transaction. a batch
+        that fails is rolled back and reported, the others are kept (as DB.batch_insert).
+        returns the id of the last record inserted, None if nothing was inserted or <tb> has no id sequence.
+        the ids are drawn from the sequence up front (one round trip, as DB.reserve_ids) since COPY has no RETURNING
+        """
+        assert tb in (await AsyncDB.get_tables(db)).values, f'[ERROR] table <{tb}> does not exist'
+        fields = await AsyncDB.get_fields(tb, db)
+        assert all(col in fields for col in list(df.columns)), f'[ERROR] target table <{tb}> does not contain all passed columns <{list(df.columns)}>'
+
+        chunk_size = int(len(df) / num_batches)
+        if chunk_size == 0:
+            chunk_size = len(df)
+        if verbose:
+            print(f'chunk size: {chunk_size}, values shape: {len(df)}, {len(df.columns)}')
+
+        async with AsyncDB._connection(db) as con:
+            ids = df['id'].tolist() if 'id' in df.columns else None
+            if ids is None and 'id' in fields:
+                seq = await con.fetchval("select pg_get_serial_sequence($1, 'id');", tb)
+                if seq is not None:
+                    ids = [r[0] for r in await con.fetch("select nextval($1::regclass) from generate_series(1, $2);", seq, len(df))]
+                    df = df.assign(id=ids)
+            # python objects with None for missing values, timestamps as datetimes
+            records = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+            last = None
+            for i in range(0, len(records), chunk_size):
+                try:
+                    async with con.transaction():
+                        await con.copy_records_to_table(tb, records=records[i:i + chunk_size], columns=list(df.columns))
+                    if ids is not None:
+                        last = max(ids[i:i + chunk_size] + ([last] if last is not None else []))
+                except Exception as e:
+                    print(str(e))
+            return last
+
+
+
+    @staticmethod
+    async def _create_asset_type(asset_type: str = None,
+                                 subtype: str = None,
+                                 description: str = None,
+                                 db=None) -> pd.DataFrame:
+        """
+        returns the asset type as a dataframe
+        """
+        assert asset_type is not None and subtype is not None, "[ERROR] must supply <asset_type>(str) and <subtype>(str)."
+        try:
+            async with AsyncDB._connection(db) as con:
+                await con.execute("""INSERT INTO asset_type_tb ("type", "subtype", "description") values ($1, $2, $3);""",
+                                  asset_type, subtype, description)
+        except asyncpg.UniqueViolationError:
+            print("[INFO] asset_type already exists.")
+        return await AsyncDB._get_asset_type(asset_type=asset_type, subtype=subtype, id_only=False, db=db)
+
+
+
+    @staticmethod
+    async def _get_asset_type(asset_type: str = None,
+                              subtype: str = None,
+                              type_id: int = None,
+                              id_only: bool = True,
+                              db=None) -> int:
+        """
+        returns the asset type id or the asset type as dataframe
+        """
+        assert type_id is not None or (asset_type is not None and subtype is not None), "[ERROR] must supply <asset_type>(str) and <subtype>(str), or <type_id>(int)."
+        if type_id is not None:
+            id_only = False
+            res = await AsyncDB.execute("""select * from asset_type_tb where "id" = $1""", db, (int(type_id),))
+        else:
+            res = await AsyncDB.execute("""select * from asset_type_tb where "type" ilike $1 and "subtype" ilike $2""",
+                                        db, (f'%{asset_type}%', f'%{subtype}%'))
+        if id_only:
+            if len(res) == 0:
+                print("[ERROR] asset_type does not exist or invalid parameters passed")
+                return -1
+            return int(res.id.values[0])
+        return res
+
+
+
+    @staticmethod
+    async def _create_asset(type_id: int = None,
+                            owner: str = '',
+                            process_id: int = None,
+                            group_id: int = None,
+                            serial_number: str = '',
+                            common_name: str = '',
+                            age: float = None,
+                            eol: float = None,
+                            rul: float = None,
+                            units: str = None,
+                            db=None) -> pd.DataFrame:
+        """
+        creates an asset from the same parameters as DB._create_asset, an existing serial number returns that asset
+        """
+        statement, values = DB._asset_insert(type_id, owner, process_id, group_id, serial_number, common_name, age, eol, rul, units)
+        res = await AsyncDB._get_asset(serial_number=serial_number, db=db)
+        if len(res) > 0:
+            return res
+        try:
+            async with AsyncDB._connection(db) as con:
+                await con.execute(AsyncDB.numbered(statement), *values)
+        except asyncpg.UniqueViolationError:
+            print("[ERROR] asset already exists (serial numbers must be unique).")
+        return await AsyncDB._get_asset(serial_number=serial_number, db=db)
+
+
+
+    @staticmethod
+    async def _get_asset(serial_number: str = None,
+                         id: int = None,
+                         db=None) -> pd.DataFrame:
+        """
+        returns the asset as a dataframe
+        """
+        assert serial_number is not None or id is not None, '[ERROR] must supply <serial_number>(str) or <id>(int)'
+        if serial_number is not None:
+            return await AsyncDB.execute("""select * from asset_tb where "serial_number" = $1""", db, (serial_number,))
+        return await AsyncDB.execute("""select * from asset_tb where "id" = $1""", db, (int(id),))
+
+
+
+    @staticmethod
+    async def _create_component(asset: pd.DataFrame = None,
+                                unit: int = None,
+                                num_samples: int = None,
+                                manufacturer: str = None,
+                                misc_info: str = None,
+                                db=None) -> pd.DataFrame:
+        """
+        creates a component in the db, the asset must be created first
+        """
+        assert asset is not None and unit is not None, '[ERROR] must supply all parameters'
+        asset_type = await AsyncDB._get_asset_type(type_id=int(asset.type_id.values[0]), db=db)
+        assert len(asset_type) > 0, f'[ERROR] a valid asset type was not found with id <{asset.type_id.values[0]}>'
+
+        table_name = f"{asset_type.type.values[0]}_{asset_type.subtype.values[0]}_tb"
+        assert table_name in (await AsyncDB.get_tables(db)).values, f'[ERROR] table <{table_name}> does not exist'
+        asset_id = int(asset.id.values[0])
+        if num_samples is None and misc_info is None:
+            statement = f"""insert into {table_name}("id", "unit") values ($1, $2);"""
+            values = (asset_id, unit)
+        else:
+            statement = f"""insert into {table_name}("id", "unit", "num_samples", "misc_info") values ($1, $2, $3, $4);"""
+            values = (asset_id, unit, num_samples, misc_info)
+        try:
+            async with AsyncDB._connection(db) as con:
+                await con.execute(statement, *values)
+        except Exception as e:
+            print(e)
+        return await AsyncDB.execute(f"""select * from {table_name} where "id" = $1""", db, (asset_id,))
+
+
+
+    @staticmethod
+    async def _create_group(group: str = None,
+                            current: float = None,
+                            num_devices: int = None,
+                            info: str = None,
+                            db=None) -> pd.DataFrame:
+        try:
+            async with AsyncDB._connection(db) as con:
+                await con.execute("""insert into group_tb ("group", "current", "num_devices", "info") values($1, $2, $3, $4);""",
+                                  group, current, num_devices, info)
+        except Exception as e:
+            print(e)
+        return await AsyncDB.execute("""select * from group_tb where "group" = $1""", db, (group,))
+
+
+
+    @staticmethod
+    async def get_devices(db) -> pd.DataFrame:
+        res1 = await AsyncDB.execute("select ast.*, irt.unit from asset_tb ast join irel_transistor_tb irt on ast.id = irt.id;", db)
+        res2 = await AsyncDB.execute("select ast.*, cbt.unit from asset_tb ast join cooling_block_tb cbt on ast.id = cbt.id;", db)
+        return pd.concat([res1, res2])
+
+
+
+    @staticmethod
+    async def get_rounds(db) -> pd.DataFrame:
+        return await AsyncDB.execute("select * from group_tb;", db)
+
+
+
+    @staticmethod
+    async def get_device_data(unit, db, cycle_pos=False) -> pd.DataFrame:
+        """
+        returns the data of a device joined with the current of its group, indexed by dt as DB.get_device_data.
+        with <cycle_pos> the data is resampled to 1s and a within-cycle position column is added
+        """
+        df = await AsyncDB.execute(AsyncDB.numbered(DB._device_data_query.format('')), db, (int(unit),))
+        df = DB._process_device_data(df)
+        if cycle_pos:
+            df = DB._add_cycle_pos(df)
+        return df
+
+
+
+    @staticmethod
+    async def get_unit_stats(unit, downsample, voltage_cutoff, db, use_aggregate=True, max_staleness=3600) -> pd.DataFrame:
+        """
+        returns the per cycle voltage and temperature statistics of a unit, from cycle_stats_vw when it
+        can answer (see DB.get_unit_stats), otherwise from data_tb
+        """
+        band = None
+        if use_aggregate and 'cycle_stats_meta_tb' in (await AsyncDB.get_tables(db)).values:
+            meta = await AsyncDB.execute(DB._cycle_stats_meta_query, db)
+            band = DB._band_of(meta, voltage_cutoff, max_staleness)
+        if band is not None:
+            query, params = DB._unit_stats_aggregate_query(unit, downsample, band)
+        else:
+            query, params = DB._unit_stats_query(unit, downsample, voltage_cutoff)
+        return await AsyncDB.execute(AsyncDB.numbered(query), db, params)
+
+
+
+    @staticmethod
+    async def get_round_data(group_id, db, include_cooling_block=False):
+        """
+        returns the data of a round (group), and of its cooling blocks with <include_cooling_block>
+        """
+        res1 = await AsyncDB.execute("""select * from data_tb where group_id = $1 order by (asset_id, dt);""", db, (int(group_id),))
+        if include_cooling_block:
+            res2 = await AsyncDB.execute("""select * from cb_data_tb where group_id = $1;""", db, (int(group_id),))
+            return res1, res2
+        return res1
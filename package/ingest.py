@@ -0,0 +1,346 @@
+"""
+    parallel file to database ingestion for the data tables (data_tb, cb_data_tb)
+
+    files (csv, optionally compressed, parquet, or json logs) are read in chunks of <chunksize> rows, each chunk is
+    partitioned by asset_id % <partitions> and the partitions are fanned out to worker processes, each
+    with its own connection loading through DB.copy_insert. every worker has a bounded queue, so the
+    reader blocks instead of buffering when the database falls behind (memory stays around
+    workers * queue_size * batch_rows rows).
+
+    progress is tracked per file in a json file: the number of chunks fully committed and, for chunks
+    past that point, the batches (partition, batch index) already committed. every batch is its own
+    transaction, so a rerun skips exactly what was committed, provided the file (size, mtime) and
+    chunksize did not change (partitions and batch_rows are fixed per file).
+
+    python -m package.ingest round_1.csv round_2.parquet --table data_tb --workers 4 --dbname dmf
+    python -m package.ingest sim_*.json --json-prefix samples.item --group-id 3 --dbname dmf
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+import pandas as pd
+try:
+    from package.api import DB
+    import package.utils as utils
+except:
+    from api import DB
+    import utils
+
+
+def _worker(worker_id: int, params: dict, table: str, fmt: str, tasks, results) -> None:
+    """
+    loads the batches of its queue until it receives None, reporting each batch on <results>
+    """
+    db, cur = DB.connect(params)
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+        key, chunk, partition, batch, df = item
+        start = time.perf_counter()
+        error = None
+        try:
+            rows = int(DB.copy_insert(df, table, num_batches=1, db=db, cur=cur, fmt=fmt).rows.sum())
+        except Exception as e:
+            db.rollback()
+            rows, error = 0, str(e)
+        results.put(('batch', worker_id, key, chunk, partition, batch, rows, len(df), time.perf_counter() - start, error))
+    db.close()
+    results.put(('done', worker_id))
+
+
+
+
+class IngestPipeline:
+    """
+    streams files into a data table with a pool of worker processes
+
+        pipeline = IngestPipeline(params, table='data_tb', workers=4)
+        report = pipeline.run(['round_1.csv', 'round_2.parquet'])
+    """
+
+    def __init__(self,
+                 params: dict = None,
+                 table: str = 'data_tb',
+                 workers: int = 4,
+                 chunksize: int = 200000,
+                 batch_rows: int = 50000,
+                 queue_size: int = 4,
+                 fmt: str = 'binary',
+                 progress: str = 'ingest_progress.json',
+                 constants: dict = None,
+                 json_key: str = None,
+                 json_prefix: str = None):
+        """
+            @params:
+                params: dictionary of db connection parameters (as in DB.connect)
+                table: the target data table
+                workers: worker processes, each with its own connection
+                chunksize: rows read from a file at a time, also the unit of progress tracking
+                batch_rows: maximum rows per COPY (partitions of a chunk are split with utils.chunk_generator), fixed per file once it has progress
+                queue_size: batches buffered per worker before the reader blocks
+                fmt: copy_insert format, 'binary' or 'text'
+                progress: the json file of per file progress, None to disable resuming
+                constants: {column: value} added to every row (e.g. {'group_id': 3} for a file of one round)
+                json_key: the key holding the records (or lists of records) of .json/.jsonl files, see utils.iter_json
+                json_prefix: or the ijson prefix of the records, e.g. 'samples.item'
+        """
+        assert params is not None, '[ERROR] must supply <params>(dict)'
+        assert workers > 0 and chunksize > 0 and batch_rows > 0 and queue_size > 0, '[ERROR] <workers>, <chunksize>, <batch_rows> and <queue_size> must be > 0'
+        self.params = params
+        self.table = table
+        self.workers = workers
+        self.chunksize = chunksize
+        self.batch_rows = batch_rows
+        self.queue_size = queue_size
+        self.fmt = fmt
+        self.progress_path = progress
+        self.constants = constants or {}
+        self.json_key = json_key
+        self.json_prefix = json_prefix
+
+        db, cur = DB.connect(params)
+        assert table in DB.get_tables(db).values, f'[ERROR] table <{table}> does not exist'
+        # the id is generated by the table
+        self.columns = [col for col in DB.get_fields(table, as_list=True, db=db) if col != 'id']
+        db.close()
+        assert 'asset_id' in self.columns, f'[ERROR] <{table}> has no asset_id to partition on'
+
+
+
+    def _load_progress(self) -> dict:
+        if self.progress_path is None or not os.path.exists(self.progress_path):
+            return {}
+        with open(self.progress_path, 'r') as f:
+            return json.load(f)
+
+
+
+    def _save_progress(self) -> None:
+        if self.progress_path is None:
+            return
+        tmp = self.progress_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._progress, f, indent=1)
+        os.replace(tmp, self.progress_path)
+
+
+
+    def _read(self, path: str):
+        """
+        yields the chunks of a file with the table columns it has (dt parsed, constants added)
+        """
+        if path.endswith('.parquet') or path.endswith('.parq'):
+            import pyarrow.parquet as pq
+            f = pq.ParquetFile(path)
+            columns = [col for col in f.schema_arrow.names if col in self.columns]
+            chunks = (batch.to_pandas() for batch in f.iter_batches(batch_size=self.chunksize, columns=columns))
+        elif path.endswith('.json') or path.endswith('.jsonl') or path.endswith('.ndjson'):
+            assert self.json_key is not None or self.json_prefix is not None, '[ERROR] json files need <json_key> or <json_prefix>'
+            chunks = (df[[col for col in df.columns if col in self.columns]]
+                      for df in utils.json_batches(path, key=self.json_key, prefix=self.json_prefix, batch_size=self.chunksize))
+        else:
+            chunks = pd.read_csv(path, chunksize=self.chunksize, usecols=lambda col: col in self.columns)
+        for df in chunks:
+            for col, value in self.constants.items():
+                df[col] = value
+            if 'dt' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['dt']):
+                df['dt'] = pd.to_datetime(df['dt'])
+            yield df
+
+
+
+    def _put(self, worker: int, item: tuple) -> None:
+        """
+        blocks while the worker's queue is full (backpressure), handling results in the meantime
+        """
+        while True:
+            try:
+                self._tasks[worker].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                self._drain(block=False)
+                if not self._procs[worker].is_alive():
+                    raise RuntimeError(f'[ERROR] ingest worker {worker} died (exit code {self._procs[worker].exitcode})')
+
+
+
+    def _drain(self, block: bool = False) -> None:
+        """
+        handles the results available (waiting for at least one with <block>)
+        """
+        while True:
+            try:
+                msg = self._results.get(timeout=1.0) if block else self._results.get_nowait()
+            except queue.Empty:
+                if block and not any(p.is_alive() for p in self._procs):
+                    raise RuntimeError('[ERROR] all ingest workers died')
+                if block:
+                    continue
+                return
+            block = False
+            if msg[0] == 'done':
+                self._finished.add(msg[1])
+                continue
+            _, worker, key, chunk, partition, batch, rows, expected, seconds, error = msg
+            s = self._stats[worker]
+            s['rows'] += rows
+            s['batches'] += 1
+            s['seconds'] += seconds
+            pending = self._pending[key][chunk]
+            pending['parts'][partition] -= 1
+            if rows != expected:
+                s['errors'] += 1
+                pending['failed'].add(partition)
+                print(f"[ERROR] worker {worker}: {os.path.basename(key)} chunk {chunk} partition {partition} batch {batch} failed" + (f": {error}" if error else ''))
+            else:
+                # the batch committed on its own, a rerun must not send it again
+                done = self._progress[key]['partial'].setdefault(str(chunk), {})
+                done.setdefault(str(partition), []).append(batch)
+            self._advance(key)
+
+
+
+    def _advance(self, key: str) -> None:
+        """
+        moves the committed chunk count of a file past every leading chunk whose partitions all committed
+        """
+        entry = self._progress[key]
+        pending = self._pending[key]
+        while entry['chunks_done'] in pending:
+            p = pending[entry['chunks_done']]
+            if p['failed'] or any(n > 0 for n in p['parts'].values()):
+                break
+            entry['rows_done'] += p['rows']
+            entry['partial'].pop(str(entry['chunks_done']), None)
+            del pending[entry['chunks_done']]
+            entry['chunks_done'] += 1
+        self._save_progress()
+
+
+
+    def _ingest_file(self, path: str) -> None:
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._progress.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime or entry['chunksize'] != self.chunksize:
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'chunksize': self.chunksize, 'partitions': self.workers,
+                     'batch_rows': self.batch_rows, 'chunks_done': 0, 'rows_done': 0, 'partial': {}, 'done': False}
+            self._progress[key] = entry
+        if entry['done']:
+            print(f"[INFO] {path} already ingested ({entry['rows_done']} rows), skipping.")
+            return
+        print(f"[INFO] ingesting {path}" + (f" from chunk {entry['chunks_done']}" if entry['chunks_done'] > 0 else ''))
+        self._pending[key] = {}
+        # partitions and batches are fixed per file, so progress stays valid if the number of workers or batch_rows changes
+        partitions = entry['partitions']
+        batch_rows = entry.setdefault('batch_rows', self.batch_rows)
+
+        for chunk, df in enumerate(self._read(path)):
+            if chunk < entry['chunks_done']:
+                continue
+            part = df['asset_id'].values % partitions
+            done = entry['partial'].get(str(chunk), {})
+            pending = {'rows': len(df), 'parts': {}, 'failed': set()}
+            self._pending[key][chunk] = pending
+            for p in range(partitions):
+                sub = df[part == p]
+                committed = set(done.get(str(p), []))
+                batches = [(b, batch) for b, (_, batch) in enumerate(utils.chunk_generator(sub, batch_rows)) if b not in committed]
+                if len(batches) == 0:
+                    continue
+                pending['parts'][p] = len(batches)
+                for b, batch in batches:
+                    self._put(p % self.workers, (key, chunk, p, b, batch))
+            self._drain(block=False)
+            self._advance(key)
+
+        while any(any(n > 0 for n in c['parts'].values()) for c in self._pending[key].values()):
+            self._drain(block=True)
+        failed = any(c['failed'] for c in self._pending[key].values())
+        entry['done'] = not failed and len(self._pending[key]) == 0
+        self._save_progress()
+        print(f"[INFO] {path}: {entry['rows_done']} rows committed" + (', some batches failed (rerun to retry them)' if failed else '.'))
+
+
+
+    def run(self, files: list) -> pd.DataFrame:
+        """
+            @brief: ingests <files> in order
+            @returns: per worker rows, batches, errors, busy seconds and rows per second
+        """
+        self._progress = self._load_progress()
+        self._pending = {}
+        self._finished = set()
+        self._stats = {w: {'rows': 0, 'batches': 0, 'errors': 0, 'seconds': 0.0} for w in range(self.workers)}
+        ctx = multiprocessing.get_context()
+        self._tasks = [ctx.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._results = ctx.Queue()
+        self._procs = [ctx.Process(target=_worker, args=(w, self.params, self.table, self.fmt, self._tasks[w], self._results), daemon=True)
+                       for w in range(self.workers)]
+        for p in self._procs:
+            p.start()
+        start = time.perf_counter()
+        try:
+            for path in files:
+                self._ingest_file(path)
+        finally:
+            for w in range(self.workers):
+                if self._procs[w].is_alive():
+                    self._tasks[w].put(None)
+            while len(self._finished) < self.workers and any(p.is_alive() for p in self._procs):
+                try:
+                    self._drain(block=True)
+                except RuntimeError:
+                    break
+            for p in self._procs:
+                p.join(timeout=10)
+        wall = time.perf_counter() - start
+
+        report = pd.DataFrame.from_dict(self._stats, orient='index').rename_axis('worker')
+        report['rows_per_second'] = report.rows / report.seconds.where(report.seconds > 0)
+        print(f"[INFO] {report.rows.sum()} rows in {wall:.1f}s ({report.rows.sum() / max(wall, 1e-9):.0f} rows/s) over {self.workers} workers")
+        print(report.to_string())
+        return report
+
+
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('files', nargs='+', help='csv (optionally compressed), parquet, json or json lines files')
+    p.add_argument('--table', default='data_tb')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--chunksize', type=int, default=200000)
+    p.add_argument('--batch-rows', type=int, default=50000)
+    p.add_argument('--queue-size', type=int, default=4)
+    p.add_argument('--fmt', default='binary', choices=['binary', 'text'])
+    p.add_argument('--progress', default='ingest_progress.json', help='progress file, "none" to disable resuming')
+    p.add_argument('--group-id', type=int, default=None, help='set group_id for every row (files of a single round)')
+    p.add_argument('--json-key', default=None, help='key holding the records of json files, at any level')
+    p.add_argument('--json-prefix', default=None, help='or the ijson prefix of the records, e.g. samples.item')
+    p.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    p.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    p.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'postgres'))
+    p.add_argument('--user', default=os.environ.get('PGUSER', os.environ.get('USER', 'postgres')))
+    p.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    args = p.parse_args()
+
+    params = {'host': args.host, 'port': args.port, 'dbname': args.dbname, 'user': args.user}
+    if args.password:
+        params['password'] = args.password
+    pipeline = IngestPipeline(params, table=args.table, workers=args.workers, chunksize=args.chunksize,
+                              batch_rows=args.batch_rows, queue_size=args.queue_size, fmt=args.fmt,
+                              progress=None if args.progress.lower() == 'none' else args.progress,
+                              constants=None if args.group_id is None else {'group_id': args.group_id},
+                              json_key=args.json_key, json_prefix=args.json_prefix)
+    report = pipeline.run(args.files)
+    if report.errors.sum() > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import pandas as pd
+import psycopg2
+
+
+class Instrumentation:
+    """
+    opt-in hook layer around the statements run by DB (execute, execute_prepared, stream, batch_insert,
+    copy_insert and the _create_* / create_* helpers). every statement becomes an event
+
+        {'ts', 'method', 'statement', 'seconds', 'rows', 'bytes', 'error', 'explain'}
+
+    where method is the outermost DB method on the stack (the api call that issued the statement) and
+    bytes is approximate (the size of the result columns, the rendered statement or the COPY payload).
+    statements slower than <slow_threshold> seconds that only read (select, values, table, execute, with
+    queries without insert/update/delete/merge) are run again under EXPLAIN (ANALYZE, BUFFERS) in a savepoint
+    that is rolled back, and the plan is attached to the event. events are passed to every sink.
+
+        stats = MemorySink()
+        Instrumentation.enable(sinks=[stats, LogSink()], slow_threshold=0.5)
+        DB.get_device_data(5, db)
+        print(stats.summary())
+        Instrumentation.disable()
+
+    while disabled every hook costs a single attribute check.
+    """
+
+    enabled = False
+    sinks = []
+    slow_threshold = None
+    explain = True
+    _lock = threading.Lock()
+    _read_only = re.compile(r'^\s*(select|with|values|table|execute)\b', re.IGNORECASE)
+    # a with query can hold data modifying statements (e.g. upsert_insert's merge)
+    _writes = re.compile(r'\b(insert|update|delete|merge)\b', re.IGNORECASE)
+    _api_modules = ('package.api', 'api')
+
+    @staticmethod
+    def enable(sinks: list = None, slow_threshold: float = None, explain: bool = True) -> None:
+        """
+            @params:
+                sinks: objects with a record(event) method, defaults to a single MemorySink
+                slow_threshold: seconds above which a statement counts as slow, None to never capture plans
+                explain: capture EXPLAIN (ANALYZE, BUFFERS) of slow read only statements (runs them a second time)
+        """
+        with Instrumentation._lock:
+            Instrumentation.sinks = list(sinks) if sinks is not None else [MemorySink()]
+            Instrumentation.slow_threshold = slow_threshold
+            Instrumentation.explain = explain
+            Instrumentation.enabled = True
+
+
+
+    @staticmethod
+    def disable() -> None:
+        Instrumentation.enabled = False
+
+
+
+    @staticmethod
+    def _method() -> str:
+        """
+        the outermost DB method on the current call stack
+        """
+        method = None
+        frame = sys._getframe(2)
+        while frame is not None:
+            if frame.f_globals.get('__name__') in Instrumentation._api_modules and frame.f_code.co_name[0] != '<':
+                method = frame.f_code.co_name
+            frame = frame.f_back
+        return method
+
+
+
+    @staticmethod
+    def observe(statement: str,
+                start: float,
+                rows: int = None,
+                nbytes: int = None,
+                params: tuple or dict = None,
+                database: psycopg2.extensions.connection = None,
+                error: Exception = None,
+                seconds: float = None) -> None:
+        """
+        records a statement that started at <start> (time.perf_counter()) and just finished, or that took
+        <seconds> if given. with <database> a slow read only statement is explained on it
+        """
+        seconds = time.perf_counter() - start if seconds is None else seconds
+        event = {
+            'ts': time.time(),
+            'method': Instrumentation._method(),
+            'statement': ' '.join(statement.split()),
+            'seconds': seconds,
+            'rows': rows,
+            'bytes': nbytes,
+            'error': None if error is None else f"{type(error).__name__}: {error}".strip(),
+            'slow': Instrumentation.slow_threshold is not None and seconds >= Instrumentation.slow_threshold,
+            'explain': None,
+        }
+        if event['slow'] and Instrumentation.explain and error is None and database is not None:
+            event['explain'] = Instrumentation._explain(statement, params, database)
+        for sink in Instrumentation.sinks:
+            try:
+                sink.record(event)
+            except Exception as e:
+                print(f"[ERROR] instrumentation sink {type(sink).__name__} failed: {e}")
+
+
+
+    @staticmethod
+    def _explain(statement: str, params: tuple or dict, database: psycopg2.extensions.connection) -> str:
+        """
+        EXPLAIN (ANALYZE, BUFFERS) of a read only statement, None for anything else. ANALYZE runs the
+        statement, so it runs inside a savepoint that is rolled back, leaving the caller's transaction as it was
+        """
+        if not Instrumentation._read_only.match(statement) or Instrumentation._writes.search(statement):
+            return None
+        if database.closed or database.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return None
+        # outside autocommit psycopg2 opens a transaction on the first statement, savepoints need one
+        savepoint = not database.autocommit
+        with database.cursor() as cur:
+            try:
+                if savepoint:
+                    cur.execute("SAVEPOINT dmf_explain;")
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, params)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+            except Exception as e:
+                plan = f"[ERROR] explain failed: {e}"
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT dmf_explain;")
+                cur.execute("RELEASE SAVEPOINT dmf_explain;")
+        return plan
+
+
+
+    @staticmethod
+    def frame_bytes(df: pd.DataFrame) -> int:
+        """
+        approximate size of a result table, fixed width columns at their item size and object columns
+        at pointer size (cheaper than df.memory_usage, which dominates the cost of small lookups)
+        """
+        return len(df) * sum(getattr(dtype, 'itemsize', 8) for dtype in df.dtypes)
+
+
+
+    @staticmethod
+    def execute(cur: psycopg2.extensions.cursor, statement: str, values: tuple or dict = None) -> None:
+        """
+        cur.execute(statement, values), recorded when enabled
+        """
+        if not Instrumentation.enabled:
+            return cur.execute(statement, values)
+        start = time.perf_counter()
+        try:
+            cur.execute(statement, values)
+        except Exception as e:
+            Instrumentation.observe(statement, start, params=values, error=e)
+            raise
+        Instrumentation.observe(statement, start, rows=cur.rowcount, nbytes=len(cur.query or b''), params=values, database=cur.connection)
+
+
+
+
+class MemorySink:
+    """
+    aggregates events per (method, statement) in memory and keeps the last <keep> events and slow events
+    """
+
+    def __init__(self, keep: int = 1000):
+        self._lock = threading.Lock()
+        self.events = collections.deque(maxlen=keep)
+        self.slow = collections.deque(maxlen=keep)
+        self._stats = {}
+
+    def record(self, event: dict) -> None:
+        with self._lock:
+            self.events.append(event)
+            if event['slow']:
+                self.slow.append(event)
+            s = self._stats.setdefault((event['method'], event['statement']),
+                                       {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'bytes': 0})
+            s['calls'] += 1
+            s['errors'] += event['error'] is not None
+            s['seconds'] += event['seconds']
+            s['max_seconds'] = max(s['max_seconds'], event['seconds'])
+            s['rows'] += event['rows'] or 0
+            s['bytes'] += event['bytes'] or 0
+
+    def summary(self, by: str = 'statement'):
+        """
+            @brief: the aggregated statistics
+            @params:
+                by: 'statement' for one row per (method, statement), 'method' for one row per api method
+            @returns: a pandas table ordered by total time
+        """
+        with self._lock:
+            df = pd.DataFrame([dict(method=m, statement=st, **s) for (m, st), s in self._stats.items()],
+                              columns=['method', 'statement', 'calls', 'errors', 'seconds', 'max_seconds', 'rows', 'bytes'])
+        if by == 'method':
+            df = df.groupby('method', dropna=False).agg({'calls': 'sum', 'errors': 'sum', 'seconds': 'sum',
+                                                         'max_seconds': 'max', 'rows': 'sum', 'bytes': 'sum'}).reset_index()
+        df['mean_seconds'] = df.seconds / df.calls
+        return df.sort_values('seconds', ascending=False).reset_index(drop=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.events.clear()
+            self.slow.clear()
+            self._stats = {}
+
+
+
+
+class LogSink:
+    """
+    writes every event (or only slow / failed ones) as a json line to the 'dmf.queries' logger
+    """
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO, only_slow: bool = False):
+        self.logger = logger if logger is not None else logging.getLogger('dmf.queries')
+        self.level = level
+        self.only_slow = only_slow
+
+    def record(self, event: dict) -> None:
+        if self.only_slow and not event['slow'] and event['error'] is None:
+            return
+        self.logger.log(logging.WARNING if event['error'] is not None else self.level, json.dumps(event, default=str))
+
+
+
+
+class PrometheusSink:
+    """
+    counters per api method in the prometheus text exposition format, served by render()
+    (or written for the node exporter textfile collector with write(path))
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float('inf'))
+
+    def __init__(self, prefix: str = 'dmf'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def record(self, event: dict) -> None:
+        with self._lock:
+            m = self._methods.setdefault(event['method'] or 'unknown',
+                                         {'count': 0, 'errors': 0, 'slow': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0,
+                                          'buckets': [0] * len(PrometheusSink.buckets)})
+            m['count'] += 1
+            m['errors'] += event['error'] is not None
+            m['slow'] += event['slow']
+            m['seconds'] += event['seconds']
+            m['rows'] += event['rows'] or 0
+            m['bytes'] += event['bytes'] or 0
+            for i, le in enumerate(PrometheusSink.buckets):
+                if event['seconds'] <= le:
+                    m['buckets'][i] += 1
+
+    def render(self) -> str:
+        p = self.prefix
+        with self._lock:
+            methods = [(f'method="{method}"', dict(m, buckets=list(m['buckets']))) for method, m in sorted(self._methods.items())]
+        # every sample of a family follows its own TYPE line, contiguously
+        lines = [f"# TYPE {p}_query_seconds histogram"]
+        for label, m in methods:
+            for le, n in zip(PrometheusSink.buckets, m['buckets']):
+                lines.append(f'{p}_query_seconds_bucket{{{label},le="{"+Inf" if le == float("inf") else le}"}} {n}')
+            lines.append(f'{p}_query_seconds_sum{{{label}}} {m["seconds"]}')
+            lines.append(f'{p}_query_seconds_count{{{label}}} {m["count"]}')
+        for name in ('errors', 'slow', 'rows', 'bytes'):
+            lines.append(f"# TYPE {p}_query_{name}_total counter")
+            lines += [f'{p}_query_{name}_total{{{label}}} {m[name]}' for label, m in methods]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
@@ -0,0 +1,346 @@
+"""
+    fleet wide feature statistics (count, mean, variance, min, max) for scaling model inputs, computed
+    without loading the data: either pushed down to the database as aggregates or accumulated over
+    streamed chunks. accumulators merge exactly (Chan et al.), so per unit or per worker statistics can
+    be computed in parallel and combined, and the fitted statistics are stored as json in
+    process_tb.parameters so every training job scales with the same values.
+
+        stats = FeatureStats.from_sql(db, 'data_tb', ['temperature', 'voltage'])
+        stats.save(db, description='irel fleet scaler')
+        ...
+        stats = FeatureStats.load(db, description='irel fleet scaler')
+        X = stats.transform(X, method='standard')
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import psycopg2
+try:
+    from package.api import DB
+except:
+    from api import DB
+
+
+class FeatureStats:
+    """
+    mergeable per feature count, mean, sum of squared deviations (m2), min and max. nulls and NaN are skipped
+    """
+
+    process_type = ('normalization', 'feature_stats')
+    source = 'package.normalization'
+
+    def __init__(self, features: list = None, table: str = None):
+        assert features is not None and len(features) > 0, '[ERROR] must supply the <features>'
+        self.features = list(features)
+        self.table = table
+        n = len(self.features)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n, dtype=np.float64)
+        self.m2 = np.zeros(n, dtype=np.float64)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+
+
+
+    @property
+    def var(self) -> np.ndarray:
+        """population variance (var_pop)"""
+        return np.divide(self.m2, self.count, out=np.full(len(self.features), np.nan), where=self.count > 0)
+
+
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+
+
+    def _merge(self, count, mean, m2, vmin, vmax) -> 'FeatureStats':
+        """
+        combines partial statistics into these (parallel variance of Chan et al.)
+        """
+        count = np.asarray(count, dtype=np.int64)
+        n = self.count + count
+        safe = np.where(n > 0, n, 1)
+        delta = np.nan_to_num(np.asarray(mean, dtype=np.float64)) - self.mean
+        self.mean = self.mean + delta * count / safe
+        self.m2 = self.m2 + np.nan_to_num(np.asarray(m2, dtype=np.float64)) + delta ** 2 * self.count * count / safe
+        self.count = n
+        self.min = np.fmin(self.min, vmin)
+        self.max = np.fmax(self.max, vmax)
+        return self
+
+
+
+    def merge(self, other: 'FeatureStats') -> 'FeatureStats':
+        """
+        adds the statistics of <other> (same features) to these and returns self
+        """
+        assert other.features == self.features, f'[ERROR] cannot merge statistics of <{other.features}> into <{self.features}>'
+        return self._merge(other.count, other.mean, other.m2, other.min, other.max)
+
+
+
+    def __add__(self, other: 'FeatureStats') -> 'FeatureStats':
+        return self.copy().merge(other)
+
+
+
+    def copy(self) -> 'FeatureStats':
+        new = FeatureStats(self.features, self.table)
+        new.count, new.mean, new.m2 = self.count.copy(), self.mean.copy(), self.m2.copy()
+        new.min, new.max = self.min.copy(), self.max.copy()
+        return new
+
+
+
+    def update(self, data: pd.DataFrame or np.ndarray) -> 'FeatureStats':
+        """
+        accumulates a chunk, a frame with the feature columns or an array (rows, features), returns self
+        """
+        if isinstance(data, pd.DataFrame):
+            data = np.column_stack([data[col].values for col in self.features]).astype(np.float64, copy=False)
+        x = np.asarray(data, dtype=np.float64).reshape(-1, len(self.features))
+        valid = ~np.isnan(x)
+        count = valid.sum(axis=0)
+        if count.sum() == 0:
+            return self
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(x, axis=0) / count
+            m2 = np.nansum((x - mean) ** 2, axis=0)
+        vmin = np.where(count > 0, np.nanmin(np.where(valid, x, np.inf), axis=0), np.inf)
+        vmax = np.where(count > 0, np.nanmax(np.where(valid, x, -np.inf), axis=0), -np.inf)
+        return self._merge(count, mean, m2, vmin, vmax)
+
+
+
+    @staticmethod
+    def _check(table: str, features: list, db: psycopg2.extensions.connection) -> list:
+        fields = DB.get_fields(table, as_list=True, db=db)
+        assert len(fields) > 0, f'[ERROR] table <{table}> does not exist'
+        if features is None:
+            types = DB.get_field_types(table, db=db)
+            features = [col for col, t in types.items() if t in ['real', 'double precision']]
+        assert all(col in fields for col in features), f'[ERROR] <{table}> does not contain all features <{features}>'
+        return list(features)
+
+
+
+    @staticmethod
+    def from_sql(db: psycopg2.extensions.connection = None,
+                 table: str = 'data_tb',
+                 features: list = None,
+                 units: list = None,
+                 group_ids: list = None) -> 'FeatureStats':
+        """
+            @brief: one pass of count/avg/var_pop/min/max aggregates in the database
+            @params:
+                db: the database
+                table: the data table
+                features: the columns, default every float column of <table>
+                units: restrict to these asset ids
+                group_ids: restrict to these groups
+        """
+        assert db is not None, '[ERROR] must supply <db>(psycopg2.extensions.connection)'
+        features = FeatureStats._check(table, features, db)
+        where, params = [], []
+        if units is not None:
+            where.append('"asset_id" = any(%s)')
+            params.append([int(u) for u in units])
+        if group_ids is not None:
+            where.append('"group_id" = any(%s)')
+            params.append([int(g) for g in group_ids])
+        aggs = ', '.join(f'count("{f}"), avg("{f}"::float8), var_pop("{f}"::float8), min("{f}"::float8), max("{f}"::float8)' for f in features)
+        res = DB.execute(f"""select {aggs} from {table}{' where ' + ' and '.join(where) if where else ''};""", db,
+                         params=tuple(params) if params else None)
+        assert len(res) > 0, f'[ERROR] could not compute the statistics of <{table}>'
+        row = res.values[0].astype(np.float64).reshape(len(features), 5)
+        stats = FeatureStats(features, table)
+        count = np.nan_to_num(row[:, 0]).astype(np.int64)
+        return stats._merge(count, row[:, 1], np.nan_to_num(row[:, 2]) * count,
+                            np.where(count > 0, row[:, 3], np.inf), np.where(count > 0, row[:, 4], -np.inf))
+
+
+
+    @staticmethod
+    def from_stream(db: psycopg2.extensions.connection = None,
+                    table: str = 'data_tb',
+                    features: list = None,
+                    units: list = None,
+                    chunksize: int = 100000) -> 'FeatureStats':
+        """
+        accumulates the statistics over chunks of <chunksize> rows streamed from <table> (a server side cursor)
+        """
+        assert db is not None, '[ERROR] must supply <db>(psycopg2.extensions.connection)'
+        features = FeatureStats._check(table, features, db)
+        stats = FeatureStats(features, table)
+        cols = ', '.join(f'"{f}"' for f in features)
+        query = f"""select {cols} from {table}{' where "asset_id" = any(%s)' if units is not None else ''};"""
+        params = ([int(u) for u in units],) if units is not None else None
+        for chunk in DB.stream(query, db, chunksize=chunksize, params=params, dtypes={f: np.float64 for f in features}):
+            stats.update(chunk)
+        db.commit()
+        return stats
+
+
+
+    @staticmethod
+    def fit_many(units: list = None,
+                 table: str = 'data_tb',
+                 features: list = None,
+                 pool=None,
+                 workers: int = 4,
+                 method: str = 'sql') -> 'FeatureStats':
+        """
+        computes the statistics of each unit concurrently on connections of <pool> (from_sql or from_stream
+        per <method>) and merges them
+        """
+        assert units is not None and pool is not None, '[ERROR] must supply <units> and <pool>(ConnectionPool)'
+        assert method in ['sql', 'stream'], '[ERROR] <method> must be "sql" or "stream"'
+        fit = FeatureStats.from_sql if method == 'sql' else FeatureStats.from_stream
+
+        def one(unit):
+            with pool.session() as s:
+                res = fit(s.db, table, features, units=[unit])
+                s.db.commit()
+                return res
+
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(one, units))
+        total = FeatureStats(parts[0].features, table)
+        for part in parts:
+            total.merge(part)
+        return total
+
+
+
+    def transform(self, X: np.ndarray or pd.DataFrame, method: str = 'standard', feature_range: tuple = (-1, 1)):
+        """
+        scales X (features in the last axis, or the feature columns of a frame). 'standard' is (x - mean) / std,
+        'minmax' maps [min, max] to <feature_range> as sklearn's MinMaxScaler does
+        """
+        assert method in ['standard', 'minmax'], '[ERROR] <method> must be "standard" or "minmax"'
+        if method == 'standard':
+            scale = np.where(self.std > 0, self.std, 1.0)
+            offset = self.mean
+            lo = 0.0
+        else:
+            span = self.max - self.min
+            scale = np.where(span > 0, span, 1.0) / (feature_range[1] - feature_range[0])
+            offset = self.min
+            lo = feature_range[0]
+        if isinstance(X, pd.DataFrame):
+            out = X.copy()
+            out[self.features] = (X[self.features].values - offset) / scale + lo
+            return out
+        X = np.asarray(X)
+        dtype = X.dtype if X.dtype.kind == 'f' else np.float64
+        return ((X - offset) / scale + lo).astype(dtype, copy=False)
+
+
+
+    def to_dict(self) -> dict:
+        finite = lambda a: [None if not np.isfinite(v) else float(v) for v in a]
+        return {
+            'table': self.table,
+            'features': self.features,
+            'count': self.count.tolist(),
+            'mean': finite(self.mean),
+            'var': finite(self.var),
+            'm2': finite(self.m2),
+            'min': finite(self.min),
+            'max': finite(self.max),
+        }
+
+
+
+    @staticmethod
+    def from_dict(d: dict) -> 'FeatureStats':
+        stats = FeatureStats(d['features'], d.get('table'))
+        nums = lambda key, default: np.array([default if v is None else v for v in d[key]], dtype=np.float64)
+        stats.count = np.array(d['count'], dtype=np.int64)
+        stats.mean = nums('mean', 0.0)
+        stats.m2 = nums('m2', 0.0)
+        stats.min = nums('min', np.inf)
+        stats.max = nums('max', -np.inf)
+        return stats
+
+
+
+    @staticmethod
+    def _process_type_id(db: psycopg2.extensions.connection, cur: psycopg2.extensions.cursor) -> int:
+        """
+        the process_type_tb row of feature statistics, created on first use (subtype2 is null, which the
+        unique constraint does not cover, so it is looked up before inserting)
+        """
+        type_, subtype1 = FeatureStats.process_type
+        select = """select "id" from process_type_tb where "type" = %s and "subtype1" = %s and "subtype2" is null;"""
+        cur.execute(select, (type_, subtype1))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("""insert into process_type_tb ("type", "subtype1") values (%s, %s) returning "id";""", (type_, subtype1))
+            row = cur.fetchone()
+        return row[0]
+
+
+
+    def save(self,
+             db: psycopg2.extensions.connection = None,
+             description: str = None,
+             source: str = None,
+             extra: dict = None) -> int:
+        """
+            @brief: stores the statistics as json in process_tb.parameters, replacing the parameters of an existing
+                    (description, source) entry
+            @params:
+                db: the database
+                description: the name the statistics are loaded by, e.g. 'irel fleet scaler'
+                source: defaults to 'package.normalization'
+                extra: other values stored alongside (e.g. the units or the date range fitted on)
+            @returns: the process_tb id
+        """
+        assert db is not None and description is not None, '[ERROR] must supply <db>(psycopg2.extensions.connection) and <description>(str)'
+        parameters = dict(self.to_dict(), fitted=time.strftime('%Y-%m-%dT%H:%M:%S'), **(extra or {}))
+        try:
+            with db.cursor() as cur:
+                type_id = FeatureStats._process_type_id(db, cur)
+                cur.execute("""insert into process_tb ("type_id", "description", "source", "parameters") values (%s, %s, %s, %s)
+                               on conflict ("type_id", "description", "source") do update set "parameters" = excluded."parameters"
+                               returning "id";""", (type_id, description, source or FeatureStats.source, json.dumps(parameters)))
+                process_id = cur.fetchone()[0]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return process_id
+
+
+
+    @staticmethod
+    def load(db: psycopg2.extensions.connection = None,
+             description: str = None,
+             source: str = None,
+             process_id: int = None) -> 'FeatureStats':
+        """
+        loads statistics stored by save, by <description> (and <source>) or by <process_id>
+        """
+        assert db is not None and (description is not None or process_id is not None), '[ERROR] must supply <db> and <description> or <process_id>'
+        if process_id is not None:
+            res = DB.execute("""select "parameters"::text as "parameters" from process_tb where "id" = %s;""", db, params=(int(process_id),))
+        else:
+            type_, subtype1 = FeatureStats.process_type
+            res = DB.execute("""select p."parameters"::text as "parameters" from process_tb p
+                                join process_type_tb t on t."id" = p."type_id"
+                                where t."type" = %s and t."subtype1" = %s and p."description" = %s and p."source" = %s;""",
+                             db, params=(type_, subtype1, description, source or FeatureStats.source))
+        db.commit()
+        assert len(res) > 0, f'[ERROR] no feature statistics stored as <{process_id if process_id is not None else description}>'
+        return FeatureStats.from_dict(json.loads(res.parameters.values[0]))
+
+
+
+    def __repr__(self) -> str:
+        return repr(pd.DataFrame({'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max},
+                                 index=self.features))
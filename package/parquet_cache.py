@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+
+
+class ParquetCache:
+    """
+    opt-in on-disk cache of per asset time series, stored as parquet parts under
+    <root>/<table>/asset_<asset_id>/group_<group_id|all>/ with a json index of high-water marks.
+    _get_data caches under the name of the table it reads, get_device_data under 'device_data', both
+    under group_all unless they are called with a group_id.
+
+    a repeat pull only fetches rows with dt newer than the cached high-water mark and appends them
+    as a new part. rows that arrive later with an older dt are not seen until the entry is invalidated.
+    the least recently used entries are evicted once the cache grows beyond <max_bytes>.
+
+        cache = ParquetCache('~/.cache/dmf', max_bytes=4 * 1024**3)
+        df = DB.get_device_data(5, db, cache=cache)
+    """
+
+    max_parts = 16
+
+    def __init__(self, root: str = '~/.cache/dmf', max_bytes: int = 2 * 1024**3):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('[ERROR] ParquetCache requires pyarrow (pip install pyarrow)')
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+        self._index_path = os.path.join(self.root, 'index.json')
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                self._index = json.load(f)
+
+
+
+    @staticmethod
+    def key(table: str, asset_id: int, group_id: int = None) -> str:
+        return f"{table}/asset_{int(asset_id)}/group_{'all' if group_id is None else int(group_id)}"
+
+
+
+    def _save_index(self) -> None:
+        tmp = self._index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
+
+
+
+    def read(self, table: str, asset_id: int, group_id: int = None) -> (pd.DataFrame, pd.Timestamp):
+        """
+            @brief: loads a cached series
+            @returns: the cached rows (None on a miss) and the high-water mark of dt (None on a miss)
+        """
+        key = ParquetCache.key(table, asset_id, group_id)
+        with self._lock:
+            entry = self._index.get(key)
+            path = os.path.join(self.root, key)
+            if entry is None or not os.path.isdir(path):
+                return None, None
+            parts = sorted(p for p in os.listdir(path) if p.endswith('.parquet'))
+            if len(parts) == 0:
+                return None, None
+            df = pd.concat([pd.read_parquet(os.path.join(path, p)) for p in parts])
+            entry['last_access'] = time.time()
+            self._save_index()
+            return df, pd.Timestamp(entry['hwm'])
+
+
+
+    def append(self, table: str, asset_id: int, new: pd.DataFrame, group_id: int = None, dt_col: str = 'dt') -> None:
+        """
+            @brief: appends newly fetched rows as a new part and advances the high-water mark
+            @params:
+                new: the rows, dtypes are kept as is in the parquet file
+                dt_col: the timestamp column, or the index name if the rows are indexed by it
+        """
+        if new is None or len(new) == 0:
+            return
+        key = ParquetCache.key(table, asset_id, group_id)
+        dt = new.index if new.index.name == dt_col else new[dt_col]
+        with self._lock:
+            path = os.path.join(self.root, key)
+            os.makedirs(path, exist_ok=True)
+            entry = self._index.get(key, {'hwm': None, 'parts': 0, 'bytes': 0})
+            part = os.path.join(path, f"part-{entry['parts']:05d}.parquet")
+            new.to_parquet(part)
+            entry['parts'] += 1
+            entry['bytes'] += os.path.getsize(part)
+            hwm = pd.Timestamp(dt.max())
+            entry['hwm'] = str(hwm if entry['hwm'] is None else max(hwm, pd.Timestamp(entry['hwm'])))
+            entry['last_access'] = time.time()
+            self._index[key] = entry
+            if entry['parts'] > ParquetCache.max_parts:
+                self._compact(key)
+            self._evict(keep=key)
+            self._save_index()
+
+
+
+    def _compact(self, key: str) -> None:
+        """
+        rewrites the parts of an entry as a single file
+        """
+        path = os.path.join(self.root, key)
+        parts = sorted(p for p in os.listdir(path) if p.endswith('.parquet'))
+        df = pd.concat([pd.read_parquet(os.path.join(path, p)) for p in parts])
+        tmp = os.path.join(path, 'compacted.tmp')
+        df.to_parquet(tmp)
+        for p in parts:
+            os.remove(os.path.join(path, p))
+        os.replace(tmp, os.path.join(path, 'part-00000.parquet'))
+        self._index[key].update({'parts': 1, 'bytes': os.path.getsize(os.path.join(path, 'part-00000.parquet'))})
+
+
+
+    def _evict(self, keep: str = None) -> None:
+        """
+        drops least recently used entries until the cache fits in max_bytes
+        """
+        total = sum(e['bytes'] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._index[key]['bytes']
+            self._remove(key)
+
+
+
+    def _remove(self, key: str) -> None:
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        self._index.pop(key, None)
+
+
+
+    def invalidate(self, table: str = None, asset_id: int = None, group_id: int = None) -> None:
+        """
+        forces the next pull to refetch. with no arguments the whole cache is cleared, with only
+        <table> (and <asset_id>) every matching entry is cleared, with all three only that entry
+        """
+        with self._lock:
+            if table is not None and asset_id is not None and group_id is not None:
+                keys = [ParquetCache.key(table, asset_id, group_id)]
+            else:
+                # prefixes end with the separator, so asset_1/ does not match asset_10/
+                if table is not None and asset_id is not None:
+                    prefix = f"{table}/asset_{int(asset_id)}/"
+                elif table is not None:
+                    prefix = f"{table}/"
+                else:
+                    prefix = ''
+                keys = [k for k in self._index if k.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            self._save_index()
+
+
+
+    def size(self) -> int:
+        """returns the cached bytes"""
+        return sum(e['bytes'] for e in self._index.values())
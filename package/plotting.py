@@ -0,0 +1,61 @@
+import pandas as pd
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+
+def plot_feature_distributions(df: pd.DataFrame = None,
+                                scale: bool = False,
+                               feature_range: tuple = (-1,1),
+                               figsize: tuple = (12,4),
+                               stats=None) -> None:
+    """
+    with <stats> (a normalization.FeatureStats, e.g. FeatureStats.load(...)) the columns are min-max scaled
+    with the fleet wide statistics instead of a scaler fitted on <df>
+    """
+    if stats is not None:
+        _df = stats.transform(df, method='minmax', feature_range=feature_range)
+    elif scale:
+        from sklearn import preprocessing
+        scaler = preprocessing.MinMaxScaler(feature_range=feature_range)
+        _df = df.copy()
+        _df = pd.DataFrame(data=scaler.fit_transform(_df), columns=df.columns)
+    else:
+        _df = df
+    _plt = _df.melt(var_name='Feature', value_name='Normalized')
+    plt.figure(figsize=(figsize))
+    ax = sns.violinplot(x='Feature', y='Normalized', data=_plt)
+    _ = ax.set_xticklabels(_df.keys(), rotation=45)
+    plt.title("Normalized Feature Distribution")
+    plt.show()
+    
+    
+def plot_loss(history):
+    plt.plot(history.history['loss'], label='loss')
+    plt.plot(history.history['val_loss'], label='val_loss')
+    #plt.ylim([0, 10])
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+
+def plot_rmse(history):
+    plt.plot(history.history['root_mean_squared_error'], label='root_mean_squared_error')
+    plt.plot(history.history['val_root_mean_squared_error'], label='val_root_mean_squared_error')
+    #plt.ylim([0, 10])
+    plt.xlabel('Epoch')
+    plt.ylabel('RMSE')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+    
+    
+    
+    
+    
+    
+    
+    
+    
+    
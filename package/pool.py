@@ -0,0 +1,231 @@
+import collections
+import contextlib
+import inspect
+import threading
+import time
+import psycopg2
+try:
+    from package.schema_cache import SchemaCache
+except:
+    from schema_cache import SchemaCache
+
+
+class Session:
+    """
+    a checked out connection and its cursor. any DB method can be called on the session and the
+    db/database/cur arguments are filled in, e.g. session.get_device_data(5) or session.batch_insert(df=df, tb='data_tb')
+    """
+
+    def __init__(self, db: psycopg2.extensions.connection, cur: psycopg2.extensions.cursor):
+        self.db = db
+        self.cur = cur
+
+    def __getattr__(self, name):
+        try:
+            from package.api import DB
+        except:
+            from api import DB
+        fn = getattr(DB, name)
+        if not callable(fn):
+            return fn
+        sig = inspect.signature(fn)
+        injected = {'db': self.db, 'database': self.db, 'cur': self.cur}
+
+        def call(*args, **kwargs):
+            bound = sig.bind_partial(*args, **kwargs).arguments
+            for arg, value in injected.items():
+                if arg in sig.parameters and arg not in bound:
+                    kwargs[arg] = value
+            return fn(*args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = fn.__doc__
+        return call
+
+
+
+
+class ConnectionPool:
+    """
+    thread safe psycopg2 connection pool with min/max size and health checks on checkout
+
+        pool = DB.create_pool(params, minconn=2, maxconn=8)
+        with pool.session() as s:
+            df = s.get_device_data(5)
+    """
+
+    def __init__(self,
+                 params: dict = None,
+                 minconn: int = 1,
+                 maxconn: int = 10,
+                 timeout: float = 30.0,
+                 health_check_interval: float = 30.0):
+        """
+            @params:
+                params: dictionary of db connection parameters (as in DB.connect)
+                minconn: connections opened up front and kept open
+                maxconn: upper bound on open connections, checkouts beyond this wait
+                timeout: seconds to wait for a free connection before raising TimeoutError
+                health_check_interval: connections idle longer than this are tested with "select 1" before reuse
+        """
+        assert params is not None, '[ERROR] must supply <params>(dict)'
+        assert 0 <= minconn <= maxconn and maxconn > 0, '[ERROR] must have 0 <= <minconn> <= <maxconn> and <maxconn> > 0'
+        self.params = params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {'created': 0, 'reused': 0, 'checkouts': 0, 'discarded': 0, 'failed_health_checks': 0,
+                       'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+
+
+
+    def _bump(self, key: str) -> None:
+        with self._cond:
+            self._stats[key] += 1
+
+
+
+    def _open(self) -> psycopg2.extensions.connection:
+        db = psycopg2.connect(**self.params)
+        SchemaCache.listen(db)
+        self._bump('created')
+        return db
+
+
+
+    def _healthy(self, db: psycopg2.extensions.connection, idle_since: float) -> bool:
+        if db.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with db.cursor() as cur:
+                cur.execute("select 1;")
+            db.rollback()
+            return True
+        except Exception:
+            self._bump('failed_health_checks')
+            return False
+
+
+
+    def _discard(self, db: psycopg2.extensions.connection) -> None:
+        self._bump('discarded')
+        try:
+            db.close()
+        except Exception:
+            pass
+
+
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        """
+        checks out a connection, prefer session() which always returns it
+        """
+        start = time.monotonic()
+        with self._cond:
+            assert not self._closed, '[ERROR] pool is closed'
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise TimeoutError(f'[ERROR] no connection available after {self.timeout}s ({self.maxconn} in use)')
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self._stats['waits'] += 1
+            self._stats['wait_seconds'] += waited
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+            candidate = self._idle.pop() if self._idle else None
+
+        # health checks and connects happen outside the lock
+        try:
+            if candidate is not None:
+                db, idle_since = candidate
+                if self._healthy(db, idle_since):
+                    self._bump('reused')
+                    return db
+                self._discard(db)
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+
+
+    def putconn(self, db: psycopg2.extensions.connection) -> None:
+        """
+        returns a connection to the pool, rolling back any open transaction
+        """
+        keep = not db.closed and not self._closed
+        if keep:
+            try:
+                if db.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    db.rollback()
+            except Exception:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) + self._in_use < self.maxconn:
+                self._idle.append((db, time.monotonic()))
+            else:
+                self._discard(db)
+            self._cond.notify()
+
+
+
+    @contextlib.contextmanager
+    def session(self) -> Session:
+        """
+        context managed checkout, yields a Session bound to a pooled connection
+        """
+        db = self.getconn()
+        cur = db.cursor()
+        try:
+            yield Session(db, cur)
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+            self.putconn(db)
+
+
+
+    def stats(self) -> dict:
+        """
+        returns connection reuse and wait time counters
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._in_use
+        stats['reuse_ratio'] = stats['reused'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        stats['mean_wait_seconds'] = stats['wait_seconds'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+
+
+    def report(self) -> None:
+        s = self.stats()
+        print(f"[INFO] pool: {s['checkouts']} checkouts, {s['reused']} reused ({s['reuse_ratio']:.0%}), "
+              f"{s['created']} created, {s['discarded']} discarded, {s['in_use']} in use, {s['idle']} idle, "
+              f"mean wait {s['mean_wait_seconds']*1000:.2f}ms, max wait {s['max_wait_seconds']*1000:.2f}ms")
+
+
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                db, _ = self._idle.pop()
+                db.close()
+            self._cond.notify_all()
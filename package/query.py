@@ -0,0 +1,204 @@
+import numpy as np
+
+
+class Query:
+    """
+    composable select statements over the data tables (and the lookup tables joined to them). filters,
+    projection, ordering and the limit all become part of one statement with bound parameters, so the
+    planner can use the (group_id, asset_id, dt) index and timescaledb can exclude chunks outside a dt range
+
+        statement, params = (Query('data_tb')
+                             .drop(['id'])
+                             .where_in('asset_id', [3, 5])
+                             .between('dt', '2021-01-01', '2021-02-01')
+                             .order_by('asset_id', 'dt')
+                             .limit(10000)
+                             .build(db))
+        df = Query('data_tb').where_in('asset_id', [3]).order_by('dt').execute(db, dtypes=DB.DTYPES['data_tb'])
+
+    columns are checked against the catalog (DB.get_fields) when the statement is built. with joins,
+    columns are written 'alias.column', unqualified columns belong to the first table
+    """
+
+    def __init__(self, table: str = None, alias: str = None):
+        assert table is not None, '[ERROR] must supply the <table> to select from'
+        self.tables = [(table, alias or table, None)]
+        self._columns = None
+        self._drop = []
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+
+
+
+    def join(self, table: str, alias: str = None, on: str = None, how: str = 'inner') -> 'Query':
+        """
+        joins <table> on the sql condition <on>, e.g. .join('group_tb', 'gtt', on='dtt."group_id" = gtt."id"')
+        """
+        assert on is not None, '[ERROR] must supply the join condition <on>'
+        assert how in ['inner', 'left'], '[ERROR] <how> must be "inner" or "left"'
+        self.tables.append((table, alias or table, f'{how} join {table} {alias or table} on {on}'))
+        return self
+
+
+
+    def select(self, columns: list) -> 'Query':
+        """
+        the columns to return, every column of the first table by default
+        """
+        self._columns = list(columns)
+        return self
+
+
+
+    def drop(self, columns: list) -> 'Query':
+        """
+        leaves <columns> out of the default projection, so they are never transferred
+        """
+        self._drop += list(columns or [])
+        return self
+
+
+
+    def where_in(self, column: str, values: list) -> 'Query':
+        """
+        column = value for a single value, column = any(array) for any other iterable (list, set, numpy
+        array, pandas Series, ...). None is no filter
+        """
+        if values is None:
+            return self
+        scalar = isinstance(values, (str, bytes)) or not hasattr(values, '__iter__') or (np.ndim(values) == 0 and not isinstance(values, (set, frozenset)))
+        values = [values] if scalar else list(values)
+        values = [v.item() if hasattr(v, 'item') else v for v in values]
+        if len(values) == 1:
+            self._where.append((column, '= %s'))
+            self._params.append(values[0])
+        else:
+            self._where.append((column, '= any(%s)'))
+            self._params.append(values)
+        return self
+
+
+
+    def between(self, column: str, start=None, stop=None, inclusive: bool = True) -> 'Query':
+        """
+        start <= column <= stop (column < stop if not <inclusive>), either bound may be None
+        """
+        if start is not None:
+            self._where.append((column, '>= %s'))
+            self._params.append(start.item() if hasattr(start, 'item') else start)
+        if stop is not None:
+            self._where.append((column, '<= %s' if inclusive else '< %s'))
+            self._params.append(stop.item() if hasattr(stop, 'item') else stop)
+        return self
+
+
+
+    def where(self, column: str, op: str, value) -> 'Query':
+        """
+        a single comparison, e.g. .where('dt', '>', hwm). <op> must be one of = <> < <= > >=
+        """
+        assert op in ['=', '<>', '<', '<=', '>', '>='], f'[ERROR] unsupported operator <{op}>'
+        self._where.append((column, f'{op} %s'))
+        self._params.append(value.item() if hasattr(value, 'item') else value)
+        return self
+
+
+
+    def order_by(self, *columns: str) -> 'Query':
+        """
+        ordering columns, 'column desc' for descending
+        """
+        self._order += list(columns)
+        return self
+
+
+
+    def limit(self, n: int = None) -> 'Query':
+        assert n is None or n >= 0, '[ERROR] <limit> must be >= 0'
+        self._limit = None if n is None else int(n)
+        return self
+
+
+
+    def _resolve(self, column: str, fields: dict) -> str:
+        """
+        'alias.column' or 'column' -> quoted reference, checked against the catalog
+        """
+        alias, name = column.split('.', 1) if '.' in column else (self.tables[0][1], column)
+        assert alias in fields, f'[ERROR] unknown table alias <{alias}> in <{column}>'
+        assert name in fields[alias], f'[ERROR] <{self._table_of(alias)}> has no column <{name}>'
+        return f'{alias}."{name}"' if len(self.tables) > 1 else f'"{name}"'
+
+
+
+    def _table_of(self, alias: str) -> str:
+        return next(table for table, a, _ in self.tables if a == alias)
+
+
+
+    def build(self, db) -> (str, tuple):
+        """
+            @brief: renders the statement
+            @params:
+                db: the database, its cached catalog is used to check the table and column names
+            @returns: (statement, params) for DB.execute / DB.stream
+        """
+        try:
+            from package.api import DB
+        except:
+            from api import DB
+        fields = {}
+        for table, alias, _ in self.tables:
+            fields[alias] = DB.get_fields(table, as_list=True, db=db)
+            assert len(fields[alias]) > 0, f'[ERROR] table <{table}> does not exist'
+        base = self.tables[0][1]
+        if self._columns is None:
+            columns = [f'{base}.{col}' for col in fields[base] if col not in self._drop]
+        else:
+            columns = [col for col in self._columns if col not in self._drop and col.split('.')[-1] not in self._drop]
+        assert len(columns) > 0, '[ERROR] every column was dropped'
+        assert all(col.split('.')[-1] in fields[col.split('.')[0] if '.' in col else base] for col in self._drop), \
+            f'[ERROR] <{self._drop}> are not all columns of the query'
+
+        projection = ', '.join(self._resolve(col, fields) for col in columns)
+        table, alias, _ = self.tables[0]
+        statement = f"select {projection} from {table}" + (f" {alias}" if len(self.tables) > 1 else '')
+        for _, _, join in self.tables[1:]:
+            statement += f" {join}"
+        if len(self._where) > 0:
+            statement += ' where ' + ' and '.join(f'{self._resolve(col, fields)} {cond}' for col, cond in self._where)
+        if len(self._order) > 0:
+            order = []
+            for spec in self._order:
+                parts = spec.split()
+                assert len(parts) in [1, 2] and (len(parts) == 1 or parts[1].lower() in ['asc', 'desc']), f'[ERROR] invalid order <{spec}>'
+                order.append(self._resolve(parts[0], fields) + (f' {parts[1].lower()}' if len(parts) == 2 else ''))
+            statement += ' order by ' + ', '.join(order)
+        if self._limit is not None:
+            statement += ' limit %s'
+        params = tuple(self._params) + ((self._limit,) if self._limit is not None else ())
+        return statement + ';', params
+
+
+
+    def execute(self, db, dtypes: dict = None):
+        """runs the statement with DB.execute"""
+        try:
+            from package.api import DB
+        except:
+            from api import DB
+        statement, params = self.build(db)
+        return DB.execute(statement, db, params=params if params else None, dtypes=dtypes)
+
+
+
+    def stream(self, db, chunksize: int = 100000, dtypes: dict = None):
+        """runs the statement with DB.stream"""
+        try:
+            from package.api import DB
+        except:
+            from api import DB
+        statement, params = self.build(db)
+        return DB.stream(statement, db, chunksize=chunksize, params=params if params else None, dtypes=dtypes)
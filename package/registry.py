@@ -0,0 +1,467 @@
+"""
+    in-memory lookup indexes over asset_tb, asset_type_tb, group_tb, process_tb and the component tables
+
+    the tables are read once, in a single snapshot, into arrays indexed by id (id -> row) and dicts keyed
+    by name (serial number -> row, (type, subtype) -> row, group -> row), so an asset's serial number,
+    type, group, process or unit is an array read instead of a round trip.
+
+    the registry holds its own autocommit connection that LISTENs on 'dmf_registry'. sql/registry.sql
+    installs statement triggers on the tables that take a new version from registry_version_seq and
+    notify the channel on commit. every lookup polls the connection (no round trip) and reloads after a
+    notification, the version is also compared at most every <max_staleness> seconds and whenever a
+    lookup misses, which covers lost notifications and rows this process has just committed.
+    without sql/registry.sql installed the registry reloads every <max_staleness> seconds.
+
+        registry = DB.create_registry(params)
+        asset_id = registry.asset_id('SN0001')
+        units = registry.unit_of(asset_ids)
+        df = DB._get_asset(serial_number='SN0001', db=db, registry=registry)
+"""
+import threading
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+
+
+class Registry:
+    """
+    thread safe, read mostly. the indexes of a load are kept together in one snapshot dict that a reload
+    replaces whole, so a lookup never sees half of two versions
+    """
+
+    channel = 'dmf_registry'
+    # tables of DB.get_devices
+    device_tables = ['irel_transistor_tb', 'cooling_block_tb']
+    # the sequence is not transactional, it can be ahead of the loaded tables until the notification of the commit
+    _version_query = """select case when "is_called" then "last_value" else 0 end as "version" from registry_version_seq;"""
+
+    def __init__(self, params: dict = None, max_staleness: float = 30.0, max_backoff: float = 60.0):
+        """
+            @params:
+                params: dictionary of db connection parameters, the registry opens its own connection
+                max_staleness: seconds between version checks while no notification arrives, None to rely on
+                               notifications (and misses) alone
+                max_backoff: longest wait between reconnect attempts after the connection is lost, the loaded
+                             tables are served in the meantime
+        """
+        assert params is not None, '[ERROR] must supply <params>(dict)'
+        self.params = params
+        self.max_staleness = max_staleness
+        self.max_backoff = max_backoff
+        self._lock = threading.RLock()
+        self._db = None
+        self._snapshot = None
+        self._checked = 0.0
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self.reloads = 0
+        self.refresh()
+
+
+
+    def _connect(self) -> None:
+        """
+        opens the registry connection, raising psycopg2.OperationalError on failure (DB.connect returns [])
+        """
+        if self._db is not None and not self._db.closed:
+            self._db.close()
+        self._db = None
+        print("[INFO] registry connecting to db.")
+        db = psycopg2.connect(**self.params)
+        db.autocommit = True
+        with db.cursor() as cur:
+            cur.execute(f"LISTEN {Registry.channel};")
+        self._db = db
+
+
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and not self._db.closed:
+                self._db.close()
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+    @staticmethod
+    def _index(ids: np.ndarray):
+        """
+        id -> row. a direct address array when the ids are dense enough, a dict otherwise
+        """
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int32)
+        top = int(ids.max())
+        if ids.min() >= 0 and top < 4 * len(ids) + 1024:
+            pos = np.full(top + 1, -1, dtype=np.int32)
+            pos[ids] = np.arange(len(ids), dtype=np.int32)
+            return pos
+        return {int(i): row for row, i in enumerate(ids)}
+
+
+
+    @staticmethod
+    def _row(index, key) -> int:
+        """
+        row of <key> in an index built by _index, -1 if it is not there
+        """
+        if isinstance(index, dict):
+            return index.get(key, -1)
+        return int(index[key]) if 0 <= key < len(index) else -1
+
+
+
+    @staticmethod
+    def _rows(index, keys: np.ndarray) -> np.ndarray:
+        """
+        vectorized _row
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if isinstance(index, dict):
+            return np.array([index.get(int(k), -1) for k in keys], dtype=np.int32)
+        rows = np.full(len(keys), -1, dtype=np.int32)
+        ok = (keys >= 0) & (keys < len(index))
+        rows[ok] = index[keys[ok]]
+        return rows
+
+
+
+    @staticmethod
+    def _ids(col: pd.Series) -> np.ndarray:
+        """
+        a nullable id column as int64 with -1 for null
+        """
+        return pd.to_numeric(col, errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+
+
+
+    def _read(self, sql_query: str, params: tuple = None) -> pd.DataFrame:
+        """
+        the query results as a pandas table, raising on errors (DB.execute returns an empty table instead)
+        """
+        with self._db.cursor() as cur:
+            cur.execute(sql_query, params)
+            return pd.DataFrame.from_records(cur.fetchall(), columns=[col[0] for col in cur.description], coerce_float=True)
+
+
+
+    def _load(self) -> dict:
+        """
+        reads every table in one repeatable read transaction, the version read with them is the version of
+        the snapshot
+        """
+        with self._db.cursor() as cur:
+            cur.execute("begin isolation level repeatable read read only;")
+        try:
+            has_version = self._read("""select to_regclass('registry_version_seq') is not null as "ok";""").ok.values[0]
+            version = int(self._read(Registry._version_query).version.values[0]) if has_version else None
+            assets = self._read("""select * from asset_tb order by "id";""")
+            types = self._read("""select * from asset_type_tb order by "id";""")
+            groups = self._read("""select * from group_tb order by "id";""")
+            processes = self._read("""select * from process_tb order by "id";""")
+            names = [f"{t}_{s}_tb" for t, s in zip(types.type, types.subtype)]
+            existing = self._read("""select "table_name" from information_schema.tables where "table_schema" = 'public' and "table_name" = any(%s);""",
+                                  (names,)).table_name.tolist()
+            components = {tb: self._read(f"""select * from {tb} order by "id";""") for tb in names if tb in existing}
+        finally:
+            if not self._db.closed:
+                with self._db.cursor() as cur:
+                    cur.execute("commit;")
+
+        asset_ids = assets.id.to_numpy(dtype=np.int64)
+        snapshot = {
+            'version': version,
+            'assets': assets,
+            'asset_pos': Registry._index(asset_ids),
+            'asset_ids': asset_ids,
+            'type_id': Registry._ids(assets.type_id),
+            'group_id': Registry._ids(assets.group_id),
+            'process_id': Registry._ids(assets.process_id),
+            'serials': {s: row for row, s in enumerate(assets.serial_number)},
+            'types': types,
+            'type_pos': Registry._index(types.id.to_numpy(dtype=np.int64)),
+            'type_names': {(t.lower(), s.lower()): row for row, (t, s) in enumerate(zip(types.type, types.subtype))},
+            'groups': groups,
+            'group_pos': Registry._index(groups.id.to_numpy(dtype=np.int64)),
+            'group_names': {g: row for row, g in enumerate(groups.group)},
+            'processes': processes,
+            'process_pos': Registry._index(processes.id.to_numpy(dtype=np.int64)),
+            'components': components,
+            'component_names': list(components),
+            'unit': np.full(len(assets), -1, dtype=np.int64),
+            'component': np.full(len(assets), -1, dtype=np.int16),
+            'devices': None,
+        }
+        for k, (tb, df) in enumerate(components.items()):
+            rows = Registry._rows(snapshot['asset_pos'], df.id.to_numpy(dtype=np.int64))
+            ok = rows >= 0
+            snapshot['component'][rows[ok]] = k
+            if 'unit' in df.columns:
+                snapshot['unit'][rows[ok]] = Registry._ids(df.unit)[ok]
+        return snapshot
+
+
+
+    def refresh(self) -> None:
+        """
+        reloads every table, reconnecting if the connection was lost
+        """
+        with self._lock:
+            if self._db is None or self._db.closed:
+                self._connect()
+            # notifications up to here are covered by the reload
+            self._db.poll()
+            self._db.notifies.clear()
+            self._snapshot = self._load()
+            self._checked = time.monotonic()
+            self._backoff = 0.0
+            self.reloads += 1
+
+
+
+    def _version(self):
+        with self._db.cursor() as cur:
+            cur.execute(Registry._version_query)
+            return cur.fetchone()[0]
+
+
+
+    def _sync(self, check: bool = False) -> dict:
+        """
+        returns the current snapshot, after reloading it if a change was announced, or the version moved
+        since the last check (made when <check> is set or <max_staleness> has passed). while the connection
+        is down the snapshot is served as is and reconnects are attempted with exponential backoff
+        """
+        with self._lock:
+            now = time.monotonic()
+            try:
+                if self._db is None or self._db.closed:
+                    if now >= self._retry_at:
+                        self.refresh()
+                    return self._snapshot
+                self._db.poll()
+                # other channels (e.g. dmf_schema) are not ours to keep, drop them so they do not pile up
+                changed = any(n.channel == Registry.channel for n in self._db.notifies)
+                self._db.notifies.clear()
+                if changed:
+                    self.refresh()
+                    return self._snapshot
+                if check or (self.max_staleness is not None and now - self._checked > self.max_staleness):
+                    if self._snapshot['version'] is None or self._version() != self._snapshot['version']:
+                        self.refresh()
+                    else:
+                        self._checked = now
+            except psycopg2.Error as e:
+                self._backoff = min(self.max_backoff, max(1.0, 2 * self._backoff))
+                self._retry_at = time.monotonic() + self._backoff
+                print(f"[ERROR] registry connection lost, serving version {self._snapshot['version']}, retrying in {self._backoff:.0f}s: {e}")
+                if self._db is not None and not self._db.closed:
+                    self._db.close()
+            return self._snapshot
+
+
+
+    @property
+    def version(self) -> int:
+        """registry_version_seq value of the loaded tables, None without sql/registry.sql"""
+        return self._snapshot['version']
+
+
+
+    @property
+    def staleness(self) -> float:
+        """seconds since the loaded tables were last confirmed current"""
+        return time.monotonic() - self._checked
+
+
+
+    def _asset_row(self, serial_number: str = None, id: int = None) -> (dict, int):
+        """
+        (snapshot, row) of an asset, a miss checks the version once before it is reported
+        """
+        snap = self._sync()
+        for attempt in range(2):
+            if serial_number is not None:
+                row = snap['serials'].get(serial_number, -1)
+            else:
+                row = Registry._row(snap['asset_pos'], int(id))
+            if row >= 0 or attempt == 1:
+                return snap, row
+            snap = self._sync(check=True)
+
+
+
+    def asset_id(self, serial_number: str) -> int:
+        """id of the asset with <serial_number>, None if there is none"""
+        snap, row = self._asset_row(serial_number=serial_number)
+        return int(snap['asset_ids'][row]) if row >= 0 else None
+
+
+
+    def serial_number(self, asset_id: int) -> str:
+        """serial number of the asset <asset_id>, None if there is none"""
+        snap, row = self._asset_row(id=asset_id)
+        return snap['assets'].serial_number.values[row] if row >= 0 else None
+
+
+
+    def _lookup(self, column: str, asset_ids):
+        """
+        <column> array value of one asset id (None if it is null or unknown) or of an array of ids (-1)
+        """
+        if np.ndim(asset_ids) == 0:
+            snap, row = self._asset_row(id=asset_ids)
+            value = int(snap[column][row]) if row >= 0 else -1
+            return value if value >= 0 else None
+        snap = self._sync()
+        rows = Registry._rows(snap['asset_pos'], asset_ids)
+        if np.any(rows < 0):
+            snap = self._sync(check=True)
+            rows = Registry._rows(snap['asset_pos'], asset_ids)
+        return np.where(rows >= 0, snap[column][rows], -1)
+
+
+
+    def type_of(self, asset_ids):
+        """asset type id(s) of the asset id(s)"""
+        return self._lookup('type_id', asset_ids)
+
+
+
+    def group_of(self, asset_ids):
+        """group id(s) of the asset id(s)"""
+        return self._lookup('group_id', asset_ids)
+
+
+
+    def process_of(self, asset_ids):
+        """process id(s) of the asset id(s)"""
+        return self._lookup('process_id', asset_ids)
+
+
+
+    def unit_of(self, asset_ids):
+        """unit(s) of the asset id(s) in their component table"""
+        return self._lookup('unit', asset_ids)
+
+
+
+    def component_of(self, asset_id: int) -> str:
+        """the component table with a row for <asset_id>, None if there is none"""
+        snap, row = self._asset_row(id=asset_id)
+        k = int(snap['component'][row]) if row >= 0 else -1
+        return snap['component_names'][k] if k >= 0 else None
+
+
+
+    def asset(self, serial_number: str = None, id: int = None) -> pd.DataFrame:
+        """
+        the asset_tb row as a dataframe, empty if there is none (as DB._get_asset)
+        """
+        assert serial_number is not None or id is not None, '[ERROR] must supply <serial_number>(str) or <id>(int)'
+        snap, row = self._asset_row(serial_number=serial_number, id=id)
+        return snap['assets'].iloc[[row] if row >= 0 else []].reset_index(drop=True)
+
+
+
+    def assets(self, asset_ids=None) -> pd.DataFrame:
+        """
+        asset_tb rows of <asset_ids> in that order (unknown ids are left out), every asset if None
+        """
+        snap = self._sync()
+        if asset_ids is None:
+            return snap['assets'].copy()
+        rows = Registry._rows(snap['asset_pos'], asset_ids)
+        return snap['assets'].iloc[rows[rows >= 0]].reset_index(drop=True)
+
+
+
+    def asset_type(self, asset_type: str = None, subtype: str = None, type_id: int = None, id_only: bool = True):
+        """
+        the asset type id or the asset type as dataframe (as DB._get_asset_type). a name is matched exactly
+        (ignoring case) and then as a substring of the type and subtype, like the ilike of the query
+        """
+        assert type_id or (asset_type is not None and subtype is not None) is not None, "[ERROR] must supply <asset_type>(str) and <subtype>(str), or <type_id>(int)."
+        snap = self._sync()
+        for attempt in range(2):
+            types = snap['types']
+            if type_id is not None:
+                id_only = False
+                row = Registry._row(snap['type_pos'], int(type_id))
+            else:
+                row = snap['type_names'].get((asset_type.lower(), subtype.lower()), -1)
+                if row < 0:
+                    match = [r for r, (t, s) in enumerate(zip(types.type, types.subtype))
+                             if asset_type.lower() in t.lower() and subtype.lower() in s.lower()]
+                    row = match[0] if len(match) > 0 else -1
+            if row >= 0 or attempt == 1:
+                break
+            snap = self._sync(check=True)
+        if row < 0:
+            if id_only:
+                print("[ERROR] asset_type does not exist or invalid parameters passed")
+                return -1
+            return types.iloc[[]].reset_index(drop=True)
+        return int(types.id.values[row]) if id_only else types.iloc[[row]].reset_index(drop=True)
+
+
+
+    def group_id(self, group: str) -> int:
+        """id of the group named <group>, None if there is none"""
+        snap = self._sync()
+        row = snap['group_names'].get(group, -1)
+        return int(snap['groups'].id.values[row]) if row >= 0 else None
+
+
+
+    def group(self, group_id: int) -> pd.DataFrame:
+        """the group_tb row as a dataframe"""
+        snap = self._sync()
+        row = Registry._row(snap['group_pos'], int(group_id))
+        return snap['groups'].iloc[[row] if row >= 0 else []].reset_index(drop=True)
+
+
+
+    def process(self, process_id: int) -> pd.DataFrame:
+        """the process_tb row as a dataframe"""
+        snap = self._sync()
+        row = Registry._row(snap['process_pos'], int(process_id))
+        return snap['processes'].iloc[[row] if row >= 0 else []].reset_index(drop=True)
+
+
+
+    def component(self, table: str) -> pd.DataFrame:
+        """every row of the component table <table>"""
+        snap = self._sync()
+        assert table in snap['components'], f'[ERROR] <{table}> is not a component table'
+        return snap['components'][table].copy()
+
+
+
+    def rounds(self) -> pd.DataFrame:
+        """group_tb (as DB.get_rounds)"""
+        return self._sync()['groups'].copy()
+
+
+
+    def devices(self) -> pd.DataFrame:
+        """
+        assets of the device tables with their unit (as DB.get_devices), built once per version
+        """
+        snap = self._sync()
+        if snap['devices'] is None:
+            frames = []
+            for tb in Registry.device_tables:
+                if tb in snap['components']:
+                    frames.append(snap['assets'].merge(snap['components'][tb][['id', 'unit']], on='id'))
+            snap['devices'] = pd.concat(frames) if len(frames) > 0 else snap['assets'].iloc[[]].assign(unit=None)
+        return snap['devices'].copy()
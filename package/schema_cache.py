@@ -0,0 +1,89 @@
+import weakref
+import psycopg2
+
+
+class SchemaCache:
+    """
+    per connection cache of catalog metadata (tables, column types, conflict keys, id sequences, asset ids,
+    extensions)
+
+    entries are dropped when the connection is garbage collected, when DB.refresh_schema is called,
+    when this connection creates an asset type, or when a 'dmf_schema' notification is received
+    (sent by generate_table() in sql/create_functions.sql whenever a component table is created, and by
+    the sql/irel_cycle_stats*.sql scripts).
+    """
+
+    channel = 'dmf_schema'
+    _entries = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def get(db: psycopg2.extensions.connection) -> dict:
+        """
+        returns the cache entry for <db>, after discarding it if a schema change was announced
+        """
+        entry = SchemaCache._entries.setdefault(db, SchemaCache._empty())
+        if not entry['listening']:
+            SchemaCache.listen(db)
+        elif SchemaCache._changed(db):
+            SchemaCache.invalidate(db)
+        return entry
+
+
+
+    @staticmethod
+    def _empty() -> dict:
+        return {'tables': None, 'fields': {}, 'keys': {}, 'sequences': {}, 'asset_ids': None, 'extensions': None, 'listening': False}
+
+
+
+    @staticmethod
+    def invalidate(db: psycopg2.extensions.connection = None) -> None:
+        """
+        drops the cache for <db>, or for every connection if <db> is None
+        """
+        if db is None:
+            for entry in list(SchemaCache._entries.values()):
+                entry.update({'tables': None, 'fields': {}, 'keys': {}, 'sequences': {}, 'asset_ids': None, 'extensions': None})
+        elif db in SchemaCache._entries:
+            SchemaCache._entries[db].update({'tables': None, 'fields': {}, 'keys': {}, 'sequences': {}, 'asset_ids': None, 'extensions': None})
+
+
+
+    @staticmethod
+    def listen(db: psycopg2.extensions.connection) -> bool:
+        """
+        subscribes <db> to schema change notifications. LISTEN only takes effect on commit, so this is
+        skipped while the connection is inside a transaction and retried on the next lookup
+        """
+        entry = SchemaCache._entries.setdefault(db, SchemaCache._empty())
+        if entry['listening']:
+            return True
+        if db.closed or db.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        try:
+            with db.cursor() as cur:
+                cur.execute(f"LISTEN {SchemaCache.channel};")
+            db.commit()
+            entry['listening'] = True
+        except Exception as e:
+            print(f"[ERROR] could not listen for schema changes: {e}")
+            db.rollback()
+        return entry['listening']
+
+
+
+    @staticmethod
+    def _changed(db: psycopg2.extensions.connection) -> bool:
+        """
+        reads pending notifications without a round trip and consumes the schema ones
+        """
+        if db.closed:
+            return False
+        if db.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            db.poll()
+        changed = False
+        for n in list(db.notifies):
+            if n.channel == SchemaCache.channel:
+                db.notifies.remove(n)
+                changed = True
+        return changed
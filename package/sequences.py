@@ -0,0 +1,313 @@
+"""
+    fixed length training windows streamed from the data tables
+
+    every unit is read in dt order with DB.stream (a server side cursor, <chunksize> rows at a time) and
+    cut into windows of <window> rows every <stride> rows, carrying the last rows of a chunk over to the
+    next so no window is lost at chunk boundaries. windows are labelled from asset_tb and shuffled
+    through a fixed size buffer into float32 batches of shape (batch_size, window, features).
+
+    worker threads (one connection each) read units ahead of the trainer and a background thread fills
+    a queue of <prefetch> ready batches, so memory is bounded by the buffer and queue sizes rather than
+    by the size of the fleet.
+
+        ds = SequenceDataset(params, units=[1, 2, 3], features=['temperature', 'voltage'], window=100, stride=10)
+        for epoch in range(10):
+            for X, y in ds:
+                model.train_on_batch(X, y)
+"""
+import queue
+import threading
+import numpy as np
+import psycopg2
+try:
+    from package.api import DB
+except:
+    from api import DB
+
+
+class SequenceDataset:
+    """
+    iterable of (X, y) batches, X float32 (batch, window, features) and y float32 (batch, labels).
+    each iteration is an epoch over <units> in a new random order
+    """
+
+    def __init__(self,
+                 params: dict = None,
+                 units: list = None,
+                 features: list = None,
+                 window: int = 50,
+                 stride: int = 1,
+                 batch_size: int = 256,
+                 labels: list = None,
+                 table: str = 'data_tb',
+                 within_cycle: bool = False,
+                 shuffle_buffer: int = 10000,
+                 workers: int = 2,
+                 prefetch: int = 4,
+                 chunksize: int = 100000,
+                 drop_last: bool = False,
+                 pool=None,
+                 seed: int = None):
+        """
+            @params:
+                params: dictionary of db connection parameters, each worker opens its own connection
+                units: the asset ids to read
+                features: columns of <table> stacked into each window (default every float column)
+                window: rows per window
+                stride: rows between the starts of consecutive windows
+                batch_size: windows per batch
+                labels: asset_tb columns ('rul', 'age', 'eol') per window, default ['rul']. 'rul' of an asset with
+                        an eol is the cycles remaining after the last row of the window (eol - cycle), otherwise
+                        the asset's rul
+                table: data_tb or cb_data_tb
+                within_cycle: do not let a window span two cycles
+                shuffle_buffer: windows held for shuffling (at least <batch_size>), larger mixes more units per batch
+                workers: threads reading units concurrently
+                prefetch: ready batches queued ahead of the consumer
+                chunksize: rows fetched per round trip
+                drop_last: drop the last incomplete batch of an epoch
+                pool: a ConnectionPool to check connections out of instead of connecting with <params>
+                seed: seed of the unit order and shuffling
+        """
+        assert params is not None or pool is not None, '[ERROR] must supply <params>(dict) or <pool>(ConnectionPool)'
+        assert units is not None and len(units) > 0, '[ERROR] must supply the <units> to read'
+        assert window > 0 and stride > 0 and batch_size > 0 and workers > 0 and prefetch > 0, '[ERROR] <window>, <stride>, <batch_size>, <workers> and <prefetch> must be > 0'
+        self.params = params
+        self.pool = pool
+        self.units = [int(u) for u in units]
+        self.window = window
+        self.stride = stride
+        self.batch_size = batch_size
+        self.labels = list(labels) if labels is not None else ['rul']
+        assert all(label in ['rul', 'age', 'eol'] for label in self.labels), '[ERROR] <labels> must be asset_tb columns among rul, age, eol'
+        self.table = table
+        self.within_cycle = within_cycle
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.workers = min(workers, len(self.units))
+        self.prefetch = prefetch
+        self.chunksize = max(chunksize, window)
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+        db = self._connect()
+        try:
+            field_types = DB.get_field_types(table, db=db)
+            assert len(field_types) > 0, f'[ERROR] table <{table}> does not exist'
+            if features is None:
+                features = [col for col, t in field_types.items() if t in ['real', 'double precision']]
+            assert all(col in field_types for col in features), f'[ERROR] <{table}> does not contain all features <{features}>'
+            self.features = list(features)
+            assets = DB.execute("""select "id", "age", "eol", "rul" from asset_tb where "id" = any(%s);""", db, params=(self.units,))
+            missing = set(self.units) - set(assets.id.tolist())
+            assert len(missing) == 0, f'[ERROR] units <{sorted(missing)}> are not in asset_tb'
+            self.assets = {int(a.id): {'age': a.age, 'eol': a.eol, 'rul': a.rul} for a in assets.itertuples()}
+            db.commit()
+        finally:
+            self._release(db)
+
+        cols = ', '.join(f'"{col}"' for col in ['cycle'] + self.features)
+        self._query = f"""select {cols} from {table} where "asset_id" = %s order by "dt";"""
+        self._dtypes = dict({col: np.float32 for col in self.features}, cycle=np.float64)
+
+
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        if self.pool is not None:
+            return self.pool.getconn()
+        db, cur = DB.connect(self.params)
+        return db
+
+
+
+    def _release(self, db: psycopg2.extensions.connection) -> None:
+        if self.pool is not None:
+            self.pool.putconn(db)
+        else:
+            db.close()
+
+
+
+    def __len__(self) -> int:
+        """
+        batches per epoch, counted in the database (one aggregate per unit, not cached)
+        """
+        db = self._connect()
+        try:
+            group = '"asset_id", "cycle"' if self.within_cycle else '"asset_id"'
+            res = DB.execute(f"""select count(*) as "n" from {self.table} where "asset_id" = any(%s) group by {group};""",
+                             db, params=(self.units,))
+            db.commit()
+        finally:
+            self._release(db)
+        n = res.n.values.astype(np.int64) if len(res) > 0 else np.zeros(0, dtype=np.int64)
+        windows = int(np.sum(np.maximum(n - self.window, -1) // self.stride + 1))
+        return windows // self.batch_size if self.drop_last else -(-windows // self.batch_size)
+
+
+
+    def _label(self, unit: int, cycles: np.ndarray) -> np.ndarray:
+        """
+        labels of the windows ending at rows with <cycles>
+        """
+        asset = self.assets[unit]
+        y = np.empty((len(cycles), len(self.labels)), dtype=np.float32)
+        for j, label in enumerate(self.labels):
+            if label == 'rul' and asset['eol'] is not None and not np.isnan(asset['eol']):
+                y[:, j] = asset['eol'] - cycles
+            else:
+                value = asset[label]
+                y[:, j] = np.nan if value is None else value
+        return y
+
+
+
+    def windows(self, unit: int, db: psycopg2.extensions.connection):
+        """
+            @brief: streams one unit and yields its windows block by block
+            @returns: a generator of (X, y), X float32 (n, window, features), y float32 (n, labels)
+        """
+        w, s = self.window, self.stride
+        # rows of the current sequence not yet consumed and the position of the first of them in the sequence
+        tail_x = np.empty((0, len(self.features)), dtype=np.float32)
+        tail_c = np.empty(0, dtype=np.float64)
+        offset, last_cycle = 0, None
+        for chunk in DB.stream(self._query, db, chunksize=self.chunksize, params=(unit,), dtypes=self._dtypes):
+            x = np.concatenate([tail_x, np.column_stack([chunk[col].values for col in self.features]).astype(np.float32, copy=False)])
+            c = np.concatenate([tail_c, chunk['cycle'].values.astype(np.float64)])
+            if self.within_cycle and c[len(tail_c)] != last_cycle:
+                # the chunk starts a new cycle, the tail (if any) is shorter than a window
+                offset = 0
+            last_cycle = c[-1]
+            # sequences are the whole unit, or its cycles with <within_cycle>
+            bounds = [0] + (list(np.flatnonzero(np.diff(c) != 0) + 1) if self.within_cycle else []) + [len(c)]
+            blocks_x, blocks_y = [], []
+            for k in range(len(bounds) - 1):
+                a, b = bounds[k], bounds[k + 1]
+                first = a + (-offset) % s if k == 0 else a
+                starts = np.arange(first, b - w + 1, s)
+                if len(starts) > 0:
+                    view = np.lib.stride_tricks.sliding_window_view(x[a:b], w, axis=0)
+                    blocks_x.append(view[starts - a].transpose(0, 2, 1))
+                    blocks_y.append(self._label(unit, c[starts + w - 1]))
+                if k == len(bounds) - 2:
+                    # the last sequence may continue in the next chunk, keep it from its next window start
+                    nxt = starts[-1] + s if len(starts) > 0 else first
+                    keep = min(nxt, b)
+                    offset = (offset + keep - a) if k == 0 else keep - a
+                    tail_x, tail_c = x[keep:b].copy(), c[keep:b].copy()
+            if len(blocks_x) > 0:
+                yield np.ascontiguousarray(np.concatenate(blocks_x), dtype=np.float32), np.concatenate(blocks_y)
+
+
+
+    def _reader(self, units: queue.Queue, blocks: queue.Queue, stop: threading.Event) -> None:
+        """
+        worker thread, reads units off <units> until it is empty and puts their window blocks on <blocks>
+        """
+        db = None
+        try:
+            db = self._connect()
+            while not stop.is_set():
+                try:
+                    unit = units.get_nowait()
+                except queue.Empty:
+                    break
+                for block in self.windows(unit, db):
+                    if not self._put(blocks, block, stop):
+                        return
+                db.commit()
+        except Exception as e:
+            self._put(blocks, e, stop)
+        finally:
+            if db is not None:
+                if not db.closed:
+                    db.rollback()
+                self._release(db)
+            self._put(blocks, None, stop)
+
+
+
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+        """
+        blocking put that gives up once <stop> is set, returns False if it did
+        """
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+
+    def _assemble(self, blocks: queue.Queue, batches: queue.Queue, stop: threading.Event) -> None:
+        """
+        background thread, moves windows through the shuffle buffer into batches
+        """
+        try:
+            size, n_feat, n_lab = self.shuffle_buffer, len(self.features), len(self.labels)
+            buf_x = np.empty((size, self.window, n_feat), dtype=np.float32)
+            buf_y = np.empty((size, n_lab), dtype=np.float32)
+            # slots to fill next, free[filled:] are still empty
+            free, filled, running = np.arange(size), 0, self.workers
+            while running > 0 and not stop.is_set():
+                block = blocks.get()
+                if block is None:
+                    running -= 1
+                    continue
+                if isinstance(block, Exception):
+                    raise block
+                x, y = block
+                pos = 0
+                while pos < len(x):
+                    take = min(len(free) - filled, len(x) - pos)
+                    slots = free[filled:filled + take]
+                    buf_x[slots], buf_y[slots] = x[pos:pos + take], y[pos:pos + take]
+                    filled, pos = filled + take, pos + take
+                    if filled == len(free):
+                        # the buffer is full, emit a random batch and let the next windows take its slots
+                        idx = self.rng.choice(size, self.batch_size, replace=False)
+                        if not self._put(batches, (buf_x[idx], buf_y[idx]), stop):
+                            return
+                        free, filled = idx, 0
+            occupied = np.setdiff1d(np.arange(size), free[filled:])
+            order = self.rng.permutation(occupied)
+            for i in range(0, len(order), self.batch_size):
+                idx = order[i:i + self.batch_size]
+                if len(idx) < self.batch_size and self.drop_last:
+                    break
+                if not self._put(batches, (buf_x[idx], buf_y[idx]), stop):
+                    return
+        except Exception as e:
+            self._put(batches, e, stop)
+        finally:
+            self._put(batches, None, stop)
+
+
+
+    def __iter__(self):
+        units = queue.Queue()
+        for unit in self.rng.permutation(self.units).tolist():
+            units.put(unit)
+        blocks = queue.Queue(maxsize=2 * self.workers)
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._reader, args=(units, blocks, stop), daemon=True) for _ in range(self.workers)]
+        threads.append(threading.Thread(target=self._assemble, args=(blocks, batches, stop), daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # also reached when the consumer stops early, the threads exit at their next put
+            stop.set()
+            for t in threads:
+                t.join(timeout=5)
@@ -0,0 +1,288 @@
+import time
+import pandas as pd
+import psycopg2
+try:
+    from package.api import DB
+except:
+    from api import DB
+
+
+class StorageManager:
+    """
+    timescaledb storage management of the data tables (data_tb, cb_data_tb and any other *data_tb):
+    hypertable conversion, native compression, compression and retention policies, chunk interval
+    recommendations and compression reports
+
+        sm = StorageManager(db)
+        sm.create_hypertable('cb_data_tb', chunk_interval='7 days')
+        sm.enable_compression('data_tb')
+        sm.add_compression_policy('data_tb', compress_after='30 days')
+        print(sm.recommend_chunk_interval('data_tb'))
+        print(sm.compression_report('data_tb', units=[1, 2, 3]))
+
+    every statement is committed on success and rolled back on error
+    """
+
+    def __init__(self, db: psycopg2.extensions.connection = None):
+        assert db is not None, '[ERROR] must pass <db>(psycopg2.extensions.connection)'
+        self.db = db
+
+
+
+    def data_tables(self) -> list:
+        """returns the *data_tb tables"""
+        return [tb for tb in DB.get_tables(self.db).values.ravel().tolist() if tb.endswith('data_tb')]
+
+
+
+    def _check(self, tb: str, timescale: bool = True) -> None:
+        # table names are interpolated into ddl, only known data tables are accepted
+        assert tb in self.data_tables(), f'[ERROR] <{tb}> is not a data table, must be one of <{self.data_tables()}>'
+        if timescale:
+            assert DB.has_extension('timescaledb', self.db), '[ERROR] the timescaledb extension is not installed (see sql/enable_timescale.sql)'
+
+
+
+    def _run(self, statement: str, params: tuple = None, fetch: bool = True):
+        """
+        executes and commits a statement, returns its rows
+        """
+        try:
+            with self.db.cursor() as cur:
+                cur.execute(statement, params)
+                rows = cur.fetchall() if fetch and cur.description is not None else None
+            self.db.commit()
+            return rows
+        except Exception:
+            self.db.rollback()
+            raise
+
+
+
+    def is_hypertable(self, tb: str) -> bool:
+        if not DB.has_extension('timescaledb', self.db):
+            return False
+        res = DB.execute("""select 1 from timescaledb_information.hypertables where hypertable_name = %s;""", self.db, params=(tb,))
+        return len(res) > 0
+
+
+
+    def create_hypertable(self,
+                          tb: str = 'data_tb',
+                          chunk_interval: str = '14 days',
+                          migrate_data: bool = True) -> bool:
+        """
+            @brief: converts <tb> to a hypertable partitioned on dt, a no-op if it already is one
+            @params:
+                tb: the data table
+                chunk_interval: the chunk_time_interval, see recommend_chunk_interval
+                migrate_data: move existing rows into chunks (locks the table for the duration of the copy)
+            @returns: True if the table was converted
+        """
+        self._check(tb)
+        if self.is_hypertable(tb):
+            print(f"[INFO] {tb} is already a hypertable.")
+            return False
+        print(f"[INFO] converting {tb} to a hypertable with {chunk_interval} chunks.")
+        self._run("""select create_hypertable(%s::regclass, 'dt', chunk_time_interval => %s::interval,
+                     if_not_exists => true, migrate_data => %s);""", (tb, chunk_interval, migrate_data))
+        DB.refresh_schema(self.db)
+        return True
+
+
+
+    def set_chunk_interval(self, tb: str, chunk_interval: str) -> None:
+        """
+        changes the interval of chunks created from now on, existing chunks keep theirs
+        """
+        self._check(tb)
+        self._run("""select set_chunk_time_interval(%s::regclass, %s::interval);""", (tb, chunk_interval), fetch=False)
+
+
+
+    def enable_compression(self,
+                           tb: str = 'data_tb',
+                           segmentby: tuple = ('asset_id', 'group_id'),
+                           orderby: str = 'dt') -> None:
+        """
+        enables native compression. segmenting by asset and group keeps a per asset read (get_device_data)
+        to the segments of that asset, ordering by dt keeps the time filter and sort cheap
+        """
+        self._check(tb)
+        assert self.is_hypertable(tb), f'[ERROR] <{tb}> must be a hypertable first (create_hypertable)'
+        fields = DB.get_fields(tb, as_list=True, db=self.db)
+        assert all(col in fields for col in list(segmentby) + [orderby]), f'[ERROR] <{tb}> does not have the columns <{list(segmentby) + [orderby]}>'
+        self._run(f"""alter table {tb} set (timescaledb.compress,
+                      timescaledb.compress_segmentby = %s, timescaledb.compress_orderby = %s);""",
+                  (', '.join(segmentby), orderby), fetch=False)
+
+
+
+    def add_compression_policy(self, tb: str = 'data_tb', compress_after: str = '30 days') -> int:
+        """
+        compresses chunks once all their rows are older than <compress_after>, returns the job id
+        """
+        self._check(tb)
+        rows = self._run("""select add_compression_policy(%s::regclass, %s::interval, if_not_exists => true);""", (tb, compress_after))
+        return rows[0][0]
+
+
+
+    def remove_compression_policy(self, tb: str = 'data_tb') -> None:
+        self._check(tb)
+        self._run("""select remove_compression_policy(%s::regclass, if_exists => true);""", (tb,))
+
+
+
+    def add_retention_policy(self, tb: str = 'data_tb', drop_after: str = '5 years') -> int:
+        """
+        drops chunks once all their rows are older than <drop_after>, returns the job id
+        """
+        self._check(tb)
+        rows = self._run("""select add_retention_policy(%s::regclass, %s::interval, if_not_exists => true);""", (tb, drop_after))
+        return rows[0][0]
+
+
+
+    def remove_retention_policy(self, tb: str = 'data_tb') -> None:
+        self._check(tb)
+        self._run("""select remove_retention_policy(%s::regclass, if_exists => true);""", (tb,))
+
+
+
+    def compress(self, tb: str = 'data_tb', older_than: str = None) -> int:
+        """
+        compresses the chunks of <tb> now (those older than <older_than>, or all), returns the number of chunks
+        """
+        self._check(tb)
+        if older_than is None:
+            rows = self._run("""select compress_chunk(c, if_not_compressed => true) from show_chunks(%s::regclass) c;""", (tb,))
+        else:
+            rows = self._run("""select compress_chunk(c, if_not_compressed => true) from show_chunks(%s::regclass, older_than => %s::interval) c;""",
+                             (tb, older_than))
+        return len(rows)
+
+
+
+    def decompress(self, tb: str = 'data_tb') -> int:
+        """
+        decompresses every chunk of <tb>, returns the number of chunks
+        """
+        self._check(tb)
+        rows = self._run("""select decompress_chunk(c, if_compressed => true) from show_chunks(%s::regclass) c;""", (tb,))
+        return len(rows)
+
+
+
+    def ingest_rate(self, tb: str = 'data_tb', window: str = '7 days') -> dict:
+        """
+            @brief: observed ingest over the last <window> of data (by dt) and the average row size
+            @returns: {'rows_per_day', 'bytes_per_row', 'total_bytes', 'rows'}
+        """
+        self._check(tb, timescale=False)
+        rate = DB.execute(f"""select count(*) as "rows", extract(epoch from max(dt) - min(dt)) as "seconds"
+                              from {tb} where dt > (select max(dt) from {tb}) - %s::interval;""", self.db, params=(window,))
+        if self.is_hypertable(tb):
+            size = DB.execute("""select hypertable_size(%s::regclass) as "bytes", approximate_row_count(%s::regclass) as "rows";""",
+                              self.db, params=(tb, tb))
+        else:
+            size = DB.execute("""select pg_total_relation_size(%s::regclass) as "bytes",
+                                 greatest((select reltuples from pg_class where oid = %s::regclass), 0) as "rows";""",
+                              self.db, params=(tb, tb))
+        rows, seconds = int(rate.rows.values[0]), float(rate.seconds.values[0] or 0)
+        total_bytes, total_rows = int(size.bytes.values[0] or 0), float(size.rows.values[0] or 0)
+        return {
+            'rows': rows,
+            'rows_per_day': rows / max(seconds, 1.0) * 86400,
+            'bytes_per_row': total_bytes / total_rows if total_rows > 0 else None,
+            'total_bytes': total_bytes,
+        }
+
+
+
+    def recommend_chunk_interval(self,
+                                 tb: str = 'data_tb',
+                                 window: str = '7 days',
+                                 memory_fraction: float = 0.25,
+                                 memory_bytes: int = None) -> dict:
+        """
+            @brief: sizes chunks so the chunk being written (data and indexes) fits in <memory_fraction> of
+                    <memory_bytes> (shared_buffers by default), following the timescaledb guideline
+            @returns: the observed rate, the target chunk size, the recommended interval (a pandas Timedelta
+                      between 1 hour and 1 year, None without data) and the current interval
+        """
+        rate = self.ingest_rate(tb, window)
+        if memory_bytes is None:
+            memory_bytes = int(DB.execute("""select pg_size_bytes(current_setting('shared_buffers')) as "bytes";""", self.db).bytes.values[0])
+        target = memory_fraction * memory_bytes
+        recommended = None
+        if rate['rows_per_day'] > 0 and rate['bytes_per_row']:
+            days = target / (rate['rows_per_day'] * rate['bytes_per_row'])
+            recommended = min(max(pd.Timedelta(days=days), pd.Timedelta(hours=1)), pd.Timedelta(days=365)).round('1h')
+        current = None
+        if self.is_hypertable(tb):
+            res = DB.execute("""select time_interval from timescaledb_information.dimensions
+                                where hypertable_name = %s and column_name = 'dt';""", self.db, params=(tb,))
+            current = pd.Timedelta(res.time_interval.values[0]) if len(res) > 0 else None
+        return dict(rate, memory_bytes=memory_bytes, target_chunk_bytes=int(target), recommended_interval=recommended, current_interval=current)
+
+
+
+    def compression_stats(self, tb: str = 'data_tb') -> dict:
+        """
+        returns the compressed chunk count and the size of the compressed chunks before and after compression
+        """
+        self._check(tb)
+        res = DB.execute("""select total_chunks, number_compressed_chunks, before_compression_total_bytes, after_compression_total_bytes
+                            from hypertable_compression_stats(%s::regclass);""", self.db, params=(tb,))
+        row = res.iloc[0].to_dict() if len(res) > 0 else {}
+        before, after = row.get('before_compression_total_bytes'), row.get('after_compression_total_bytes')
+        row['compression_ratio'] = float(before) / float(after) if before and after else None
+        row['total_bytes'] = int(DB.execute("""select hypertable_size(%s::regclass) as "bytes";""", self.db, params=(tb,)).bytes.values[0])
+        return row
+
+
+
+    def scan_times(self, tb: str, units: list, repeat: int = 3) -> dict:
+        """
+        returns the mean seconds per unit of get_device_data for data_tb, or of reading the unit's rows in
+        dt order for the other data tables
+        """
+        times = {}
+        for unit in units:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                if tb == 'data_tb':
+                    DB.get_device_data(unit, self.db)
+                else:
+                    DB.execute(f"""select * from {tb} where asset_id = %s order by dt;""", self.db, params=(int(unit),))
+            times[int(unit)] = (time.perf_counter() - start) / repeat
+        self.db.commit()
+        return times
+
+
+
+    def compression_report(self, tb: str = 'data_tb', units: list = None, repeat: int = 3, older_than: str = None) -> dict:
+        """
+            @brief: measures the per unit reads of scan_times for <units> and the table size, compresses <tb> (chunks older
+                    than <older_than>, or all) and measures again. compression must be enabled
+            @returns: {'before': {...}, 'after': {...}, 'compressed_chunks', 'compression_ratio', 'scan_speedup'}
+        """
+        self._check(tb)
+        if units is None:
+            units = DB.execute(f"""select distinct asset_id from {tb} limit 5;""", self.db).asset_id.tolist()
+        before = {'total_bytes': self.compression_stats(tb)['total_bytes'], 'scan_seconds': self.scan_times(tb, units, repeat)}
+        chunks = self.compress(tb, older_than)
+        self._run(f"""analyze {tb};""", fetch=False)
+        stats = self.compression_stats(tb)
+        after = {'total_bytes': stats['total_bytes'], 'scan_seconds': self.scan_times(tb, units, repeat)}
+        return {
+            'table': tb,
+            'units': [int(u) for u in units],
+            'compressed_chunks': chunks,
+            'before': before,
+            'after': after,
+            'compression_ratio': stats['compression_ratio'],
+            'size_ratio': before['total_bytes'] / after['total_bytes'] if after['total_bytes'] else None,
+            'scan_speedup': sum(before['scan_seconds'].values()) / max(sum(after['scan_seconds'].values()), 1e-9),
+        }
@@ -3,22 +3,30 @@ import json
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from sklearn import preprocessing
-import seaborn as sns
-import matplotlib.pyplot as plt
+import importlib
 import random
 import string
 import sys
 
+# imported from plotting.py on first use, so the database api does not load matplotlib, seaborn and scikit-learn
+_plotting = ('plot_feature_distributions', 'plot_loss', 'plot_rmse')
+
+
+def __getattr__(name):
+    if name in _plotting:
+        plotting = importlib.import_module('.plotting', __package__) if __package__ else importlib.import_module('plotting')
+        return getattr(plotting, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def progressbar(iterator, prefix="", size=60, out=sys.stdout):
-  """
+    """
       @brief: Progress bar display for generators
       
       @params: 
               iterator - when using a generator, wrap in a list
               prefix - anything desired to be displayed 
-  """
+    """
     count = len(iterator)
     def show(j):
         x = int(size*j/count)
@@ -32,40 +40,42 @@ def progressbar(iterator, prefix="", size=60, out=sys.stdout):
 
 
 def generate_serial_number(length: int = 8) -> str:
-  """
+    """
       @brief: generates random alpha numeric serial numbers
       
       @params: 
               length - the length of the serial number
-  """
+    """
     return ''.join(random.choices(string.digits + string.ascii_letters, k=length))
 
 
 def load_json(file_location, data_header, footer):
-  """
+    """
       @brief: loads a json file as a dict
       
       @params: 
               file_location - the parent directory of the json files
               data_header - the header part of the file name
               footer - the footer part, must end in .json
-  """
-    fname = log_location + '/' + data_header + footer
+    """
+    fname = file_location + '/' + data_header + footer
     with open(fname, 'r') as f:
         data = json.loads(f.read())
     return data
 
 
-def parse_json(json_object, target_key, res=[]):
-  """
+def parse_json(json_object, target_key, res=None):
+    """
       @brief: parses a json object or python dict for a specific key
               the key can reside in any level
       
       @params: 
               json_object - the json or dict object
               target_key - the key to search for
-              res - output variable (typically [])
-  """
+              res - output variable, a new list if None
+    """
+    if res is None:
+        res = []
     if type(json_object) is dict and json_object:
         for key in json_object:
             if key == target_key:
@@ -79,14 +89,138 @@ def parse_json(json_object, target_key, res=[]):
     return res
 
 
+def iter_json(path, key=None, prefix=None, flatten=False):
+    """
+      @brief: streams values out of a json file without loading it, memory is bounded by the
+              largest value yielded rather than the file. .json files are read with ijson (an event
+              parser), .jsonl / .ndjson files (one document per line) need no extra package
+      
+      @params: 
+              path - the json or json lines file
+              key - yield the value of every occurrence of this key at any level, as parse_json, but
+                    occurrences nested inside a yielded value are not yielded again (for both formats)
+              prefix - or the ijson prefix of the values, e.g. 'samples.item' for every element of the
+                       top level "samples" list. about 2.5x faster than <key> when the layout is known
+              flatten - yield the elements of list values one at a time instead of the whole list
+    """
+    assert (key is None) != (prefix is None), '[ERROR] must supply one of <key> or <prefix>'
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                doc = json.loads(line)
+                values = _json_key(doc, key) if key is not None else _json_prefix(doc, prefix.split('.') if prefix else [])
+                for value in values:
+                    if flatten and type(value) is list:
+                        yield from value
+                    else:
+                        yield value
+        return
+
+    try:
+        import ijson
+    except ImportError:
+        raise ImportError('[ERROR] streaming .json files needs ijson (pip install ijson), or write the logs as json lines (.jsonl)')
+    with open(path, 'rb') as f:
+        if prefix is not None:
+            for value in ijson.items(f, prefix, use_float=True):
+                if flatten and type(value) is list:
+                    yield from value
+                else:
+                    yield value
+            return
+        events = ijson.parse(f, use_float=True)
+        for _, event, value in events:
+            if event != 'map_key' or value != key:
+                continue
+            _, event, value = next(events)
+            if event == 'start_array' and flatten:
+                # build the elements one at a time
+                while True:
+                    _, event, value = next(events)
+                    if event == 'end_array':
+                        break
+                    yield _json_build(ijson, events, event, value)
+            else:
+                yield _json_build(ijson, events, event, value)
+
+
+def _json_build(ijson, events, event, value):
+    """builds the value starting with (event, value) from the events that follow"""
+    builder, depth = ijson.ObjectBuilder(), 0
+    while True:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+        _, event, value = next(events)
+
+
+def _json_key(doc, key):
+    """values of <key> at any level of a parsed document in document order, without descending into them (as the .json path)"""
+    if type(doc) is dict:
+        for k, value in doc.items():
+            if k == key:
+                yield value
+            else:
+                yield from _json_key(value, key)
+    elif type(doc) is list:
+        for item in doc:
+            yield from _json_key(item, key)
+
+
+def _json_prefix(doc, parts):
+    """values of a parsed document at an ijson style prefix"""
+    if len(parts) == 0:
+        yield doc
+    elif parts[0] == 'item':
+        if type(doc) is list:
+            for item in doc:
+                yield from _json_prefix(item, parts[1:])
+    elif type(doc) is dict and parts[0] in doc:
+        yield from _json_prefix(doc[parts[0]], parts[1:])
+
+
+def json_batches(path, columns=None, key=None, prefix=None, batch_size=100000):
+    """
+      @brief: columnar batches of the records streamed by iter_json, for copy_insert or the ingest pipeline
+      
+      @params: 
+              path - the json or json lines file
+              columns - the record fields to keep, defaults to the fields of the first record
+              key, prefix - where the records are, see iter_json. a value may be a record (dict) or a list of records
+              batch_size - records per yielded dataframe
+    """
+    cols = None if columns is None else {c: [] for c in columns}
+    n = 0
+    for record in iter_json(path, key=key, prefix=prefix, flatten=True):
+        if type(record) is not dict:
+            continue
+        if cols is None:
+            cols = {c: [] for c in record}
+        for c, values in cols.items():
+            values.append(record.get(c))
+        n += 1
+        if n == batch_size:
+            yield pd.DataFrame(cols)
+            cols = {c: [] for c in cols}
+            n = 0
+    if n > 0:
+        yield pd.DataFrame(cols)
+
+
 def chunk_generator(X, n):
-  """
+    """
     @brief: breaks large data into smaller equal pieces + remainder as last yield
     
     @params:
           X - the dataframe, list, or np.array of data 
           n - the size of the chunk
-  """
+    """
     for i in range(0, len(X), n):
         if type(X) == pd.core.frame.DataFrame:
             yield i+1, X.iloc[i:i+n]
@@ -94,51 +228,32 @@ def chunk_generator(X, n):
             yield i+1, X[i:i+n]
 
 
-def plot_feature_distributions(df: pd.DataFrame = None,
-                                scale: bool = False,
-                               feature_range: tuple = (-1,1),
-                               figsize: tuple = (12,4)) -> None:
-    if scale:
-        scaler = preprocessing.MinMaxScaler(feature_range=feature_range)
-        _df = df.copy()
-        _df = pd.DataFrame(data=scaler.fit_transform(_df), columns=df.columns)
-    else:
-        _df = df
-    _plt = _df.melt(var_name='Feature', value_name='Normalized')
-    plt.figure(figsize=(figsize))
-    ax = sns.violinplot(x='Feature', y='Normalized', data=_plt)
-    _ = ax.set_xticklabels(_df.keys(), rotation=45)
-    plt.title("Normalized Feature Distribution")
-    plt.show()
-    
-    
-def plot_loss(history):
-    plt.plot(history.history['loss'], label='loss')
-    plt.plot(history.history['val_loss'], label='val_loss')
-    #plt.ylim([0, 10])
-    plt.xlabel('Epoch')
-    plt.ylabel('Loss')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
-
-
-def plot_rmse(history):
-    plt.plot(history.history['root_mean_squared_error'], label='root_mean_squared_error')
-    plt.plot(history.history['val_root_mean_squared_error'], label='val_root_mean_squared_error')
-    #plt.ylim([0, 10])
-    plt.xlabel('Epoch')
-    plt.ylabel('RMSE')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
+def lttb(x, y, n_out):
+    """
+        @brief: largest-triangle-three-buckets downsampling, keeps the points that preserve the visual shape
+                of a series (peaks and troughs) instead of averaging them away
+        
+        @params:
+                x - monotonically increasing np.array (e.g. time as float)
+                y - np.array of values
+                n_out - the number of points to keep (first and last are always kept)
+        
+        @returns: np.array of the indices of the kept points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    idx[-1] = n - 1
+    return idx
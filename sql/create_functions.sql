@@ -9,13 +9,15 @@
 
 /*
     This is the function requred to generate an empty component table every time an asset type 
-    is created. 
+    is created. Listeners on the dmf_schema channel (the python api schema cache) are notified 
+    when the transaction commits.
 */
 create or replace function generate_table()
   returns trigger as 
    $$ 
     begin
       execute format('create table "%s_%s_tb"(id int primary key not null references asset_tb(id));', new."type", new."subtype");
+      perform pg_notify('dmf_schema', format('%s_%s_tb', new."type", new."subtype"));
     return new;
   end;
   $$
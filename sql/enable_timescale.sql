@@ -6,6 +6,9 @@
           number of partitions or interval depends on the specific application.
           
           see https://docs.timescale.com/api/latest/hypertable/create_hypertable/#create-hypertable 
+
+          package/storage.py (StorageManager) converts the other data tables, enables compression,
+          adds compression/retention policies and recommends a chunk interval from the ingest rate
 */
 
 
@@ -47,13 +47,14 @@ add column "water_temperature2" float;
 ------------------------------------------------------------------------------------------------
 
 /*
-    enable timescale for cb_data_tb if timescale exists
+    enable timescale for cb_data_tb if the timescale extension is installed in this database
+    (see enable_timescale.sql)
 */
 DO $$
 BEGIN 
-    IF EXISTS (select * from pg_available_extensions where name ilike 'timescaledb') THEN
-        select create_hypertable('cb_data_tb', 'dt', chunk_time_interval => interval '14 days');
-        select add_dimension('cb_data_tb', 'group_id', number_partitions => 4);
+    IF EXISTS (select * from pg_extension where extname = 'timescaledb') THEN
+        perform create_hypertable('cb_data_tb', 'dt', chunk_time_interval => interval '14 days');
+        perform add_dimension('cb_data_tb', 'group_id', number_partitions => 4);
     END IF;
 END $$;
 
@@ -0,0 +1,79 @@
+/*
+          Per cycle statistics for the iREL4.0 data table (plain PostgreSQL)
+
+          get_unit_stats reads from cycle_stats_vw instead of aggregating data_tb when the view
+          exists and was refreshed recently enough. Use irel_cycle_stats_timescale.sql instead
+          when the timescaledb extension is enabled.
+
+          Each row holds mergeable partial aggregates (count, sum, sum of squares, min, max) for one
+          (asset_id, group_id, cycle, voltage band). Voltage band k holds the samples with
+          k * band_width < voltage <= (k + 1) * band_width, so "voltage > cutoff" is the same as
+          "vband >= cutoff / band_width" for any cutoff that is a multiple of the band width. Other
+          cutoffs fall back to the raw query. Keep the band width a power of two fraction (0.5, 0.25, ...)
+          so the division is exact, and update cycle_stats_meta_tb if it is changed.
+
+          Refresh with: select refresh_cycle_stats();
+*/
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+/*
+    describes how the statistics view is maintained and when it was last refreshed
+*/
+create table if not exists cycle_stats_meta_tb(
+    "view_name" varchar(64) primary key not null,
+    "kind" varchar(16) not null,
+    "band_width" float not null,
+    "refreshed_at" timestamp
+);
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+create materialized view cycle_stats_vw as
+select "asset_id",
+       "group_id",
+       "cycle",
+       (ceil("voltage" / 0.5) - 1)::int as "vband",
+       count("voltage") as "n_voltage",
+       sum("voltage") as "sum_voltage",
+       sum("voltage" * "voltage") as "sumsq_voltage",
+       min("voltage") as "min_voltage",
+       max("voltage") as "max_voltage",
+       count("temperature") as "n_temperature",
+       sum("temperature") as "sum_temperature",
+       sum("temperature" * "temperature") as "sumsq_temperature",
+       min("temperature") as "min_temperature",
+       max("temperature") as "max_temperature"
+from data_tb
+where "voltage" is not null
+group by "asset_id", "group_id", "cycle", "vband";
+
+-- required by refresh materialized view concurrently
+create unique index idx_cycle_stats on cycle_stats_vw("asset_id", "group_id", "cycle", "vband");
+
+insert into cycle_stats_meta_tb("view_name", "kind", "band_width", "refreshed_at")
+values ('cycle_stats_vw', 'materialized', 0.5, now())
+on conflict ("view_name") do update set "kind" = excluded."kind", "band_width" = excluded."band_width", "refreshed_at" = excluded."refreshed_at";
+
+-- connections that cached the table list without the aggregate pick it up (python api schema cache)
+select pg_notify('dmf_schema', 'cycle_stats_meta_tb');
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+/*
+    refreshes the view without blocking readers and records the refresh time
+*/
+create or replace function refresh_cycle_stats()
+  returns void as
+   $$
+    begin
+      refresh materialized view concurrently cycle_stats_vw;
+      update cycle_stats_meta_tb set "refreshed_at" = now() where "view_name" = 'cycle_stats_vw';
+  end;
+  $$
+  language 'plpgsql';
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
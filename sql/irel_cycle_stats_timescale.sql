@@ -0,0 +1,60 @@
+/*
+          Per cycle statistics for the iREL4.0 data table (TimescaleDB)
+
+          Same columns and voltage band design as irel_cycle_stats.sql, maintained as a continuous
+          aggregate over the data_tb hypertable (see enable_timescale.sql). Continuous aggregates
+          must group by a time bucket, so a cycle that spans several days has one row per day; the
+          partial aggregates are merged again by get_unit_stats. Real-time aggregation is enabled,
+          so the view always includes data that has not been materialized yet.
+*/
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+create table if not exists cycle_stats_meta_tb(
+    "view_name" varchar(64) primary key not null,
+    "kind" varchar(16) not null,
+    "band_width" float not null,
+    "refreshed_at" timestamp
+);
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+create materialized view cycle_stats_vw
+with (timescaledb.continuous) as
+select "asset_id",
+       "group_id",
+       "cycle",
+       time_bucket(interval '1 day', "dt") as "bucket",
+       (ceil("voltage" / 0.5) - 1)::int as "vband",
+       count("voltage") as "n_voltage",
+       sum("voltage") as "sum_voltage",
+       sum("voltage" * "voltage") as "sumsq_voltage",
+       min("voltage") as "min_voltage",
+       max("voltage") as "max_voltage",
+       count("temperature") as "n_temperature",
+       sum("temperature") as "sum_temperature",
+       sum("temperature" * "temperature") as "sumsq_temperature",
+       min("temperature") as "min_temperature",
+       max("temperature") as "max_temperature"
+from data_tb
+where "voltage" is not null
+group by "asset_id", "group_id", "cycle", "bucket", "vband"
+with no data;
+
+alter materialized view cycle_stats_vw set (timescaledb.materialized_only = false);
+
+select add_continuous_aggregate_policy('cycle_stats_vw',
+    start_offset => null,
+    end_offset => interval '1 hour',
+    schedule_interval => interval '30 minutes');
+
+insert into cycle_stats_meta_tb("view_name", "kind", "band_width", "refreshed_at")
+values ('cycle_stats_vw', 'continuous', 0.5, now())
+on conflict ("view_name") do update set "kind" = excluded."kind", "band_width" = excluded."band_width", "refreshed_at" = excluded."refreshed_at";
+
+-- connections that cached the table list without the aggregate pick it up (python api schema cache)
+select pg_notify('dmf_schema', 'cycle_stats_meta_tb');
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
@@ -0,0 +1,104 @@
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+/*
+	  change notification for the in-memory registry (package/registry.py)
+
+      every statement that changes asset_tb, asset_type_tb, group_tb, process_tb, process_type_tb
+      or a component table (<type>_<subtype>_tb) takes the next value of registry_version_seq and
+      notifies the dmf_registry channel with '<table>:<version>' when the transaction commits.
+      clients reload on a notification and compare versions to detect missed ones.
+
+      run after create_framework_tables.sql and create_functions.sql, it is safe to run again
+*/
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+create sequence if not exists registry_version_seq;
+
+/*
+    statement level, so a bulk insert of assets is a single version. nextval takes no row lock, so
+    concurrent writers of the registry tables do not wait on each other. the sequence moves before
+    the transaction commits (and also when it rolls back), a client that reads the new version too
+    early reloads again on the notification sent at commit
+*/
+create or replace function registry_changed()
+  returns trigger as
+   $$
+    begin
+      perform pg_notify('dmf_registry', format('%s:%s', tg_table_name, nextval('registry_version_seq')));
+      return null;
+    end;
+  $$
+  language 'plpgsql';
+
+
+-- earlier versions of this script kept the version in a single row table, every writer locked that row
+-- until commit. carry the version over so running clients see it move rather than go back
+DO $$
+BEGIN
+    IF to_regclass('registry_version_tb') is not null THEN
+        perform setval('registry_version_seq', greatest((select "version" from registry_version_tb), 1));
+        drop table registry_version_tb;
+    END IF;
+END $$;
+
+
+/*
+    attaches the registry trigger to a table (a no-op if it already has it)
+*/
+create or replace function registry_watch(tb text)
+  returns void as
+   $$
+    begin
+      if to_regclass(format('%I', tb)) is null then
+        return;
+      end if;
+      if not exists (select 1 from pg_trigger where tgname = 'registry_changed_trigger' and tgrelid = to_regclass(format('%I', tb))) then
+        execute format('create trigger registry_changed_trigger after insert or update or delete or truncate on %I
+                        for each statement execute procedure registry_changed();', tb);
+      end if;
+    end;
+  $$
+  language 'plpgsql';
+
+
+/*
+    component tables are created by generate_table() when an asset type is inserted, this trigger
+    runs after it (triggers fire in name order) and watches the new table
+*/
+create or replace function registry_watch_component()
+  returns trigger as
+   $$
+    begin
+      perform registry_watch(format('%s_%s_tb', new."type", new."subtype"));
+      return new;
+    end;
+  $$
+  language 'plpgsql';
+
+drop trigger if exists registry_watch_component_trigger on asset_type_tb;
+create trigger registry_watch_component_trigger
+	after insert
+	on asset_type_tb
+	for each row
+	execute procedure registry_watch_component();
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
+
+
+DO $$
+DECLARE
+    t record;
+BEGIN
+    perform registry_watch('asset_tb');
+    perform registry_watch('asset_type_tb');
+    perform registry_watch('group_tb');
+    perform registry_watch('process_tb');
+    perform registry_watch('process_type_tb');
+    FOR t IN select format('%s_%s_tb', "type", "subtype") as tb from asset_type_tb LOOP
+        perform registry_watch(t.tb);
+    END LOOP;
+END $$;
+------------------------------------------------------------------------------------------------
+------------------------------------------------------------------------------------------------
@@ -0,0 +1,77 @@
+"""
+    DB against a local PostgreSQL database, skipped unless DMF_TEST_DSN is set, e.g.
+
+        DMF_TEST_DSN="host=localhost dbname=dmf user=postgres" python -m pytest -q tests
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DSN = os.environ.get('DMF_TEST_DSN')
+pytestmark = pytest.mark.skipif(DSN is None, reason='DMF_TEST_DSN is not set')
+
+if DSN is not None:
+    from psycopg2.extensions import parse_dsn
+    from package.api import DB
+PARAMS = parse_dsn(DSN) if DSN is not None else None
+
+
+@pytest.fixture(scope='module')
+def db():
+    db, cur = DB.connect(PARAMS)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def table(db):
+    cur = db.cursor()
+    cur.execute("""create table copy_test_tb("id" serial primary key, "cycle" int, "small" smallint, "big" bigint, "value" double precision);""")
+    db.commit()
+    # plain DDL is not announced on dmf_schema
+    DB.refresh_schema(db)
+    yield 'copy_test_tb'
+    db.rollback()
+    cur.execute("""drop table if exists copy_test_tb;""")
+    db.commit()
+
+
+@pytest.mark.parametrize('fmt', ['text', 'binary'])
+def test_copy_insert_float_with_nan_into_integer(db, table, fmt):
+    # integer columns read with nulls arrive as float64
+    df = pd.DataFrame({'cycle': [1.0, np.nan, 3.0, 4.0], 'small': [np.nan, 2.0, 3.0, 4.0],
+                       'big': [2.0**40, 5.0, np.nan, 7.0], 'value': [0.5, np.nan, 1.5, 3.0]})
+    report = DB.copy_insert(df, table, num_batches=1, db=db, cur=db.cursor(), fmt=fmt)
+    assert report.rows.sum() == 4
+    actual = DB.execute(f"""select "cycle", "small", "big", "value" from {table} order by "id";""", db)
+    db.rollback()
+    pd.testing.assert_frame_equal(actual, df, check_dtype=False)
+
+
+def test_copy_insert_fraction_into_integer_fails(db, table):
+    df = pd.DataFrame({'cycle': [1.0, 2.5, np.nan]})
+    report = DB.copy_insert(df, table, num_batches=1, db=db, cur=db.cursor())
+    assert report.rows.sum() == 0
+    assert DB.execute(f"""select count(*) as "n" from {table};""", db).n.values[0] == 0
+    db.rollback()
+
+
+def test_copy_insert_empty(db, table):
+    report = DB.copy_insert(pd.DataFrame({'cycle': []}), table, db=db, cur=db.cursor())
+    assert len(report) == 0
+
+
+def test_refresh_cycle_stats_keeps_open_transaction(db, table):
+    cur = db.cursor()
+    cur.execute(f"""insert into {table}("cycle") values (1);""")
+    with pytest.raises(RuntimeError):
+        DB.refresh_cycle_stats(db)
+    # the caller's insert was neither committed nor rolled back
+    assert DB.execute(f"""select count(*) as "n" from {table};""", db).n.values[0] == 1
+    db.rollback()
+    assert DB.execute(f"""select count(*) as "n" from {table};""", db).n.values[0] == 0
+    db.rollback()
@@ -0,0 +1,152 @@
+"""
+    AsyncDB against DB on the same local PostgreSQL database, skipped unless DMF_TEST_DSN is set, e.g.
+
+        DMF_TEST_DSN="host=localhost dbname=dmf user=postgres" python -m pytest -q tests
+
+    the database needs the framework tables (setup_database.sh), the data comparisons are skipped
+    when it holds no device data
+"""
+import asyncio
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DSN = os.environ.get('DMF_TEST_DSN')
+pytestmark = pytest.mark.skipif(DSN is None, reason='DMF_TEST_DSN is not set')
+
+if DSN is not None:
+    from psycopg2.extensions import parse_dsn
+    from package.api import DB
+    from package.async_api import AsyncDB
+PARAMS = parse_dsn(DSN) if DSN is not None else None
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_connection(fn):
+    con = await AsyncDB.connect(PARAMS)
+    try:
+        return await fn(con)
+    finally:
+        await con.close()
+
+
+@pytest.fixture(scope='module')
+def db():
+    db, cur = DB.connect(PARAMS)
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def unit(db):
+    # the unit of get_device_data is the asset id
+    res = DB.execute("""select "asset_id" from data_tb limit 1;""", db)
+    db.rollback()
+    if len(res) == 0:
+        pytest.skip('no device data in the database')
+    return int(res.asset_id.values[0])
+
+
+@pytest.fixture
+def table(db):
+    cur = db.cursor()
+    cur.execute("""create table async_test_tb("id" serial primary key, "a" int, "b" double precision, "t" timestamp, "s" text);""")
+    db.commit()
+    # plain DDL is not announced on dmf_schema
+    DB.refresh_schema(db)
+    yield 'async_test_tb'
+    db.rollback()
+    cur.execute("""drop table if exists async_test_tb;""")
+    db.commit()
+
+
+def assert_same(expected: pd.DataFrame, actual: pd.DataFrame):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True), check_dtype=False)
+
+
+def test_execute(db):
+    query = """select g as "n", g * 0.5 as "half", 'row ' || g as "label" from generate_series(1, %s) g where g %% 3 <> 0;"""
+    expected = DB.execute(query, db, params=(100,))
+    actual = run(with_connection(lambda con: AsyncDB.execute(AsyncDB.numbered(query), con, (100,))))
+    assert len(expected) == 67
+    assert_same(expected, actual)
+
+
+def test_execute_empty_keeps_columns(db):
+    query = """select "id", "serial_number" from asset_tb where "id" = %s;"""
+    expected = DB.execute(query, db, params=(-1,))
+    actual = run(with_connection(lambda con: AsyncDB.execute(AsyncDB.numbered(query), con, (-1,))))
+    assert len(actual) == 0
+    assert list(actual.columns) == list(expected.columns) == ['id', 'serial_number']
+
+
+def test_execute_repeated_on_pool(db):
+    query = """select "id", "serial_number" from asset_tb order by "id";"""
+    expected = DB.execute(query, db)
+
+    async def go():
+        pool = await AsyncDB.create_pool(PARAMS, minconn=2, maxconn=4)
+        try:
+            return await asyncio.gather(*(AsyncDB.execute(query, pool) for _ in range(8)))
+        finally:
+            await pool.close()
+
+    for actual in run(go()):
+        assert_same(expected, actual)
+
+
+def test_catalog(db):
+    async def go(con):
+        return await AsyncDB.get_tables(con), await AsyncDB.get_fields('asset_tb', con)
+    tables, fields = run(with_connection(go))
+    assert sorted(tables) == sorted(DB.get_tables(db).table_name)
+    assert fields == DB.get_fields('asset_tb', as_list=True, db=db)
+
+
+def test_batch_insert(db, table):
+    n = 1000
+    df = pd.DataFrame({'a': np.arange(n), 'b': np.linspace(0, 1, n),
+                       't': pd.date_range('2022-01-01', periods=n, freq='s'),
+                       's': [f'row {i}' for i in range(n)]})
+    cur = db.cursor()
+    # DB.batch_insert writes the values with str(), so it gets the timestamps as text
+    DB.batch_insert(df.assign(t=df.t.astype(str)), table, num_batches=4, db=db, cur=cur)
+    expected = DB.execute(f"""select "a", "b", "t", "s" from {table} order by "id";""", db)
+    last_sync = DB.execute(f"""select max("id") as "id" from {table};""", db).id.values[0]
+
+    last = run(with_connection(lambda con: AsyncDB.batch_insert(df, table, num_batches=4, db=con)))
+    actual = DB.execute(f"""select "a", "b", "t", "s" from {table} where "id" > %s order by "id";""", db, params=(int(last_sync),))
+    assert last == DB.execute(f"""select max("id") as "id" from {table};""", db).id.values[0]
+    assert_same(expected, actual)
+
+
+def test_get_device_data_matches_stream(db, unit):
+    expected = DB.get_device_data(unit, db)
+    streamed = pd.concat(list(DB.get_device_data(unit, db, stream=True, chunksize=5000)))
+    db.rollback()
+    actual = run(with_connection(lambda con: AsyncDB.get_device_data(unit, con)))
+    assert len(actual) > 0
+    assert_same(expected, actual)
+    pd.testing.assert_frame_equal(streamed, actual, check_dtype=False)
+
+
+def test_get_round_data_matches_stream(db, unit):
+    group_id = int(DB.execute("""select "group_id" from data_tb where "asset_id" = %s limit 1;""", db, params=(unit,)).group_id.values[0])
+    streamed = pd.concat(list(DB.get_round_data(group_id, db, stream=True, chunksize=20000)))
+    db.rollback()
+    actual = run(with_connection(lambda con: AsyncDB.get_round_data(group_id, con)))
+    assert len(actual) > 0
+    assert_same(streamed, actual)
+
+
+def test_get_unit_stats(db, unit):
+    expected = DB.get_unit_stats(unit, 10, 0.1, db, use_aggregate=False)
+    actual = run(with_connection(lambda con: AsyncDB.get_unit_stats(unit, 10, 0.1, con, use_aggregate=False)))
+    assert_same(expected, actual)
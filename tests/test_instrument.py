@@ -0,0 +1,59 @@
+"""
+    the instrumentation sinks, no database needed
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from package.instrument import PrometheusSink
+
+
+def event(method, seconds, error=None, slow=False):
+    return {'ts': 0.0, 'method': method, 'statement': 'select 1', 'seconds': seconds, 'rows': 10, 'bytes': 100,
+            'error': error, 'slow': slow, 'explain': None}
+
+
+@pytest.fixture
+def sink():
+    sink = PrometheusSink()
+    sink.record(event('get_device_data', 0.02))
+    sink.record(event('get_device_data', 2.0, slow=True))
+    sink.record(event('execute', 0.3, error='boom'))
+    return sink
+
+
+def test_prometheus_families_are_contiguous(sink):
+    # every sample follows the TYPE line of its own family and no family appears twice
+    seen, family = [], None
+    for line in sink.render().splitlines():
+        if line.startswith('# TYPE '):
+            family = line.split()[2]
+            assert family not in seen
+            seen.append(family)
+            continue
+        name = line.split('{')[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if family.endswith('_seconds') and name == family + suffix:
+                name = family
+        assert name == family, line
+    assert seen == ['dmf_query_seconds', 'dmf_query_errors_total', 'dmf_query_slow_total',
+                    'dmf_query_rows_total', 'dmf_query_bytes_total']
+
+
+def test_prometheus_values(sink):
+    lines = sink.render().splitlines()
+    assert 'dmf_query_seconds_count{method="get_device_data"} 2' in lines
+    assert 'dmf_query_seconds_bucket{method="get_device_data",le="0.05"} 1' in lines
+    assert 'dmf_query_seconds_bucket{method="get_device_data",le="+Inf"} 2' in lines
+    assert 'dmf_query_errors_total{method="execute"} 1' in lines
+    assert 'dmf_query_slow_total{method="get_device_data"} 1' in lines
+
+
+def test_prometheus_parses(sink):
+    parser = pytest.importorskip('prometheus_client.parser')
+    families = {f.name: f for f in parser.text_string_to_metric_families(sink.render())}
+    assert sorted(families) == ['dmf_query_bytes', 'dmf_query_errors', 'dmf_query_rows', 'dmf_query_seconds', 'dmf_query_slow']
+    assert families['dmf_query_seconds'].type == 'histogram'
+    assert len(families['dmf_query_errors'].samples) == 2
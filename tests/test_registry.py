@@ -0,0 +1,53 @@
+"""
+    Registry against a local PostgreSQL database with sql/registry.sql installed, skipped unless DMF_TEST_DSN is set, e.g.
+
+        DMF_TEST_DSN="host=localhost dbname=dmf user=postgres" python -m pytest -q tests
+"""
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DSN = os.environ.get('DMF_TEST_DSN')
+pytestmark = pytest.mark.skipif(DSN is None, reason='DMF_TEST_DSN is not set')
+
+if DSN is not None:
+    import psycopg2
+    from psycopg2.extensions import parse_dsn
+    from package.registry import Registry
+PARAMS = parse_dsn(DSN) if DSN is not None else None
+
+
+@pytest.fixture
+def writers():
+    dbs = [psycopg2.connect(**PARAMS) for _ in range(2)]
+    cur = dbs[0].cursor()
+    cur.execute("""select to_regclass('registry_version_seq') is not null, array(select "id" from group_tb order by "id" limit 2);""")
+    installed, ids = cur.fetchone()
+    dbs[0].rollback()
+    if not installed or len(ids) < 2:
+        pytest.skip('sql/registry.sql is not installed or group_tb has fewer than 2 groups')
+    yield list(zip(dbs, ids))
+    for db in dbs:
+        db.rollback()
+        db.close()
+
+
+def test_concurrent_writers_do_not_wait_on_the_version(writers):
+    registry = Registry(PARAMS, max_staleness=None)
+    version = registry.version
+    assert version is not None
+    for db, group_id in writers:
+        cur = db.cursor()
+        # the second writer fails here if the first holds a lock it needs
+        cur.execute("""set lock_timeout = '2s';""")
+        cur.execute("""update group_tb set "group" = "group" where "id" = %s;""", (group_id,))
+    for db, _ in writers:
+        db.commit()
+    time.sleep(0.2)
+    registry.group(writers[0][1])
+    assert registry.version > version
+    assert registry.reloads > 1
+    registry.close()